@@ -1,15 +1,29 @@
-import threading
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
 
-def send_email(message,  recipient_list):
-    subject = "Reset your password"
-    from_email = settings.EMAIL_HOST_USER
+from jobs.queue import enqueue
 
-    send_mail(subject, message, from_email, recipient_list)
+SEND_EMAIL_JOB = "accounts.send_email"
 
 
-def send_email_threaded(message, recipient_list):
-    email_thread = threading.Thread(target=send_email, args=(message, recipient_list))
-    email_thread.start()
+def queue_email(message, recipient_list, subject="Reset your password"):
+    """Send an email from the job worker instead of the request."""
+    return enqueue(SEND_EMAIL_JOB, {"subject": subject, "message": message, "recipient_list": list(recipient_list)})
 
+
+def deliver_emails(payloads):
+    """Send a batch of queued emails over a single SMTP connection."""
+    results = []
+    with get_connection() as connection:
+        for payload in payloads:
+            email = EmailMessage(
+                payload["subject"], payload["message"], settings.EMAIL_HOST_USER, payload["recipient_list"],
+                connection=connection,
+            )
+            try:
+                email.send()
+            except Exception as exc:
+                results.append(exc)
+            else:
+                results.append(None)
+    return results
@@ -1,5 +1,11 @@
 from django import forms
 from django.contrib.auth import authenticate, get_user_model, login
+from django.contrib.auth import forms as auth_forms
+from django.forms.utils import ErrorDict
+from django.template.loader import render_to_string
+
+from accounts.emails import queue_email
+from accounts.lookups import users_with_emails
 
 User = get_user_model()
 
@@ -13,6 +19,12 @@ class BaseForm(forms.Form):
         for field in self.fields.values():
             field.widget.attrs['class'] = 'form-control'
 
+    def reject(self, message):
+        """Show ``message`` as the form's error without validating it."""
+        self._errors = ErrorDict()
+        self.cleaned_data = {}
+        self.add_error(None, message)
+
 
 class LoginForm(BaseForm):
     """Login form."""
@@ -44,7 +56,8 @@ class SignUpForm(BaseForm):
 
     def clean_email(self):
         email = self.cleaned_data.get('email')
-        if User.objects.filter(email=email).exists():
+        # emails are unique regardless of case (see migrations/0001_user_email_ci_unique.py)
+        if users_with_emails([email]).exists():
             raise forms.ValidationError('Email already exists')
         return email
 
@@ -68,3 +81,11 @@ class SignUpForm(BaseForm):
         user = User.objects.create_user(username=username, email=email, password=password)
         login(self.request, user)
         return user
+
+
+class PasswordResetForm(auth_forms.PasswordResetForm):
+    """Django's password reset form, sending the link from the job worker."""
+
+    def send_mail(self, subject_template_name, email_template_name, context, from_email, to_email, html_email_template_name=None):
+        subject = "".join(render_to_string(subject_template_name, context).splitlines())
+        queue_email(render_to_string(email_template_name, context), [to_email], subject=subject)
@@ -0,0 +1,28 @@
+"""
+Email lookups served by the case-insensitive unique index on user emails.
+
+The index (``migrations/0001_user_email_ci_unique.py``) is partial: it
+leaves out users without an email.  The database only uses it for a query
+that repeats its ``email <> ''`` predicate, which ``exclude(email="")``
+does not (it renders ``NOT (email = '')``), hence ``NotEqual``.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import F, Lookup
+from django.db.models.functions import Lower
+
+
+class NotEqual(Lookup):
+    lookup_name = "ne"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} <> {rhs}", (*lhs_params, *rhs_params)
+
+
+def users_with_emails(emails):
+    """The users whose email is one of ``emails``, ignoring case, annotated with ``email_lower``."""
+    return (
+        get_user_model().objects.annotate(email_lower=Lower("email"))
+        .filter(NotEqual(F("email"), ""), email_lower__in={email.lower() for email in emails})
+    )
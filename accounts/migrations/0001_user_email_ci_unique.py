@@ -0,0 +1,42 @@
+"""
+A case-insensitive unique index on user emails, backing the email lookups of
+signup and collaborator invitations (``LOWER(email) IN (...)``).  Users
+without an email are left out.  Expression and partial indexes are supported
+by PostgreSQL and SQLite.
+"""
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def check_duplicates(apps, schema_editor):
+    User = apps.get_model("auth", "User")
+    duplicates = list(
+        User.objects.using(schema_editor.connection.alias)
+        .exclude(email="")
+        .annotate(email_lower=Lower("email"))
+        .values("email_lower")
+        .annotate(total=Count("pk"))
+        .filter(total__gt=1)
+        .values_list("email_lower", flat=True)[:20]
+    )
+    if duplicates:
+        raise RuntimeError(
+            "These emails are used by more than one account, ignoring case; "
+            f"merge or change them before migrating: {', '.join(duplicates)}"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicates, migrations.RunPython.noop),
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX accounts_user_email_ci_uniq ON auth_user (LOWER(email)) WHERE email <> ''",
+            "DROP INDEX accounts_user_email_ci_uniq",
+        ),
+    ]
@@ -0,0 +1,169 @@
+"""
+Token-bucket throttling of the login and signup forms.
+
+Both forms hash a password on every POST, so a burst of attempts costs a
+full PBKDF2 run each.  ``check()`` is called before the form is validated
+and takes one token from a bucket per key of the scope: the client IP (see
+``client_ip()`` for proxies) and the submitted username.  A bucket holds up
+to ``N`` tokens and refills at ``N`` per period, as configured in
+``RATE_LIMITS``::
+
+    RATE_LIMITS = {"login": {"ip": "20/m", "username": "5/m"}}
+
+Buckets live in the store named by ``RATE_LIMIT_STORE``: ``LocalStore``
+keeps them in a bounded in-process LRU; ``CacheStore`` keeps them in the
+``RATE_LIMIT_CACHE`` cache so every process shares them.  Rejections are
+counted per scope and key kind, see ``rejection_stats()``.
+"""
+import ipaddress
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+_rejections = Counter()
+_rejections_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    """``"5/m"`` as ``(capacity, tokens per second)``."""
+    count, period = rate.split("/")
+    return int(count), int(count) / PERIODS[period]
+
+
+def refill(state, capacity, per_second, now):
+    """The bucket ``state`` (``(tokens, updated)`` or ``None``) topped up to ``now``."""
+    if state is None:
+        return float(capacity)
+    tokens, updated = state
+    return min(float(capacity), tokens + (now - updated) * per_second)
+
+
+class LocalStore:
+    """Buckets of this process, least recently used dropped past ``max_keys``."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, per_second, now):
+        """Take a token; return 0 or the seconds until one is available."""
+        with self._lock:
+            tokens = refill(self._buckets.get(key), capacity, per_second, now)
+            wait = 0 if tokens >= 1 else (1 - tokens) / per_second
+            self._buckets[key] = (tokens - 1 if tokens >= 1 else tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheStore:
+    """
+    Buckets in a Django cache, shared by every process.  Reads and writes are
+    not atomic, so concurrent attempts on one key may both get the last token.
+    """
+
+    prefix = "ratelimit:"
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, "RATE_LIMIT_CACHE", "default")]
+
+    def take(self, key, capacity, per_second, now):
+        key = self.prefix + key
+        tokens = refill(self.cache.get(key), capacity, per_second, now)
+        wait = 0 if tokens >= 1 else (1 - tokens) / per_second
+        # a bucket left alone until it is full again is the same as no bucket
+        self.cache.set(key, (tokens - 1 if tokens >= 1 else tokens, now), math.ceil(capacity / per_second))
+        return wait
+
+    def clear(self):
+        # keys are not tracked; buckets expire by themselves
+        pass
+
+
+@lru_cache(maxsize=None)
+def _load_store(path):
+    return import_string(path)()
+
+
+def get_store():
+    return _load_store(getattr(settings, "RATE_LIMIT_STORE", "accounts.ratelimit.LocalStore"))
+
+
+@lru_cache(maxsize=8)
+def _networks(proxies):
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+def _trusted(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in _networks(tuple(getattr(settings, "RATE_LIMIT_TRUSTED_PROXIES", ()))))
+
+
+def client_ip(request):
+    """
+    The address of the client.  Behind proxies listed in
+    ``RATE_LIMIT_TRUSTED_PROXIES`` it is the last ``X-Forwarded-For`` entry
+    that none of them added; the header is ignored from anyone else, since a
+    client can send whatever it likes.
+    """
+    address = request.META.get("REMOTE_ADDR") or "unknown"
+    if not _trusted(address):
+        return address
+    forwarded = [entry.strip() for entry in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",") if entry.strip()]
+    for entry in reversed(forwarded):
+        address = entry
+        if not _trusted(entry):
+            break
+    return address
+
+
+def check(request, scope):
+    """
+    Take a token for every key of ``scope``; return 0 when the attempt may
+    go ahead, else the seconds to wait before the next one.
+    """
+    limits = getattr(settings, "RATE_LIMITS", {}).get(scope, {})
+    values = {"ip": client_ip(request), "username": request.POST.get("username", "").strip().lower()}
+    store = get_store()
+    now = time.time()
+    wait = 0
+    for kind, rate in limits.items():
+        if not values.get(kind):
+            continue
+        capacity, per_second = parse_rate(rate)
+        kind_wait = store.take(f"{scope}:{kind}:{values[kind]}", capacity, per_second, now)
+        if kind_wait:
+            with _rejections_lock:
+                _rejections[f"{scope}:{kind}"] += 1
+            wait = max(wait, kind_wait)
+    return math.ceil(wait)
+
+
+def rejection_stats():
+    """Rejected attempts of this process, as ``{"scope:kind": n}``."""
+    with _rejections_lock:
+        return dict(_rejections)
+
+
+def reset():
+    """Forget every bucket and counter, e.g. between tests."""
+    get_store().clear()
+    with _rejections_lock:
+        _rejections.clear()
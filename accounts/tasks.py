@@ -0,0 +1,6 @@
+from django.conf import settings
+
+from accounts.emails import SEND_EMAIL_JOB, deliver_emails
+from jobs.queue import register
+
+register(SEND_EMAIL_JOB, batch_size=getattr(settings, "EMAIL_BATCH_SIZE", 50))(deliver_emails)
@@ -1,14 +1,24 @@
-from django.test import TestCase
+from unittest import mock
+
+from django.core import mail
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 
+from accounts import ratelimit
 from accounts.forms import SignUpForm, LoginForm
+from accounts.lookups import users_with_emails
+from books.benchmark import full_scans
+from jobs.models import Job
+from jobs.queue import Worker
 
 User = get_user_model()
 
 
 class TestLoginView(TestCase):
     def setUp(self) -> None:
+        ratelimit.reset()
         self.url = reverse("accounts:login")
         self.user = User.objects.create_user(username="test", password="test")
 
@@ -41,6 +51,7 @@ class TestLoginView(TestCase):
 
 class TestSignUpView(TestCase):
     def setUp(self) -> None:
+        ratelimit.reset()
         self.url = reverse("accounts:signup")
         self.valid_data = {
             "username": "test",
@@ -130,3 +141,151 @@ class TestSignUpView(TestCase):
         self.assertTemplateUsed(response, "accounts/signup.html")
         self.assertIsInstance(response.context["form"], SignUpForm)
         self.assertFormError(response, "form", "password", "Password must be at least 8 characters")
+
+
+@override_settings(RATE_LIMITS={"login": {"ip": "10/m", "username": "3/m"}, "signup": {"ip": "2/h"}})
+class TestRateLimit(TestCase):
+    def setUp(self) -> None:
+        ratelimit.reset()
+        self.url = reverse("accounts:login")
+        User.objects.create_user(username="test", password="test")
+
+    def test_username_limit_rejects_before_hashing(self):
+        for _ in range(3):
+            self.assertEqual(self.client.post(self.url, {"username": "test", "password": "wrong"}).status_code, 200)
+        with mock.patch("accounts.forms.authenticate") as authenticate:
+            response = self.client.post(self.url, {"username": " TEST ", "password": "test"})
+        authenticate.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "20")
+        self.assertFormError(response, "form", None, "Too many attempts. Try again in 20 seconds.")
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+        self.assertEqual(ratelimit.rejection_stats(), {"login:username": 1})
+        # other usernames from the same address still get through
+        self.assertEqual(self.client.post(self.url, {"username": "other", "password": "x"}).status_code, 200)
+
+    def test_ip_limit(self):
+        for number in range(10):
+            self.client.post(self.url, {"username": f"user{number}", "password": "x"})
+        response = self.client.post(self.url, {"username": "test", "password": "test"})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(ratelimit.rejection_stats(), {"login:ip": 1})
+        other = self.client.post(self.url, {"username": "test", "password": "test"}, REMOTE_ADDR="10.0.0.2")
+        self.assertRedirects(other, reverse("books:home"))
+
+    def test_forwarded_for_ignored_from_untrusted_address(self):
+        for number in range(10):
+            self.client.post(self.url, {"username": f"user{number}", "password": "x"}, HTTP_X_FORWARDED_FOR=f"10.1.0.{number}")
+        self.assertEqual(self.client.post(self.url, {"username": "test", "password": "test"}).status_code, 429)
+
+    @override_settings(RATE_LIMIT_TRUSTED_PROXIES=["10.0.0.0/24"])
+    def test_forwarded_for_behind_trusted_proxy(self):
+        for number in range(10):
+            self.client.post(
+                self.url, {"username": f"user{number}", "password": "x"},
+                REMOTE_ADDR="10.0.0.5", HTTP_X_FORWARDED_FOR="203.0.113.7, 10.0.0.9",
+            )
+        blocked = self.client.post(
+            self.url, {"username": "test", "password": "test"},
+            REMOTE_ADDR="10.0.0.5", HTTP_X_FORWARDED_FOR="203.0.113.7",
+        )
+        self.assertEqual(blocked.status_code, 429)
+        # a spoofed leftmost entry does not move the client to another bucket
+        spoofed = self.client.post(
+            self.url, {"username": "test", "password": "test"},
+            REMOTE_ADDR="10.0.0.5", HTTP_X_FORWARDED_FOR="198.51.100.1, 203.0.113.7",
+        )
+        self.assertEqual(spoofed.status_code, 429)
+        other = self.client.post(
+            self.url, {"username": "test", "password": "test"},
+            REMOTE_ADDR="10.0.0.5", HTTP_X_FORWARDED_FOR="203.0.113.8",
+        )
+        self.assertRedirects(other, reverse("books:home"))
+
+    def test_signup(self):
+        url = reverse("accounts:signup")
+        for _ in range(2):
+            self.client.post(url, {"username": "test"})
+        response = self.client.post(url, {"username": "new", "password": "test1234", "password2": "test1234"})
+        self.assertEqual(response.status_code, 429)
+        self.assertTemplateUsed(response, "accounts/signup.html")
+        self.assertFalse(User.objects.filter(username="new").exists())
+
+    def test_get_is_not_limited(self):
+        for _ in range(5):
+            self.client.post(self.url, {"username": "test", "password": "wrong"})
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_bucket_refills(self):
+        store = ratelimit.LocalStore()
+        self.assertEqual([store.take("k", 2, 1, 100) for _ in range(3)], [0, 0, 1])
+        self.assertEqual(store.take("k", 2, 1, 101), 0)
+        self.assertEqual(store.take("k", 2, 1, 101), 1)
+
+    def test_lru_store_is_bounded(self):
+        store = ratelimit.LocalStore(max_keys=2)
+        for key in ("a", "b", "a", "c"):
+            store.take(key, 1, 1, 0)
+        self.assertEqual(list(store._buckets), ["a", "c"])
+
+    @override_settings(RATE_LIMIT_STORE="accounts.ratelimit.CacheStore")
+    def test_cache_store(self):
+        store = ratelimit.get_store()
+        self.assertIsInstance(store, ratelimit.CacheStore)
+        self.assertEqual([store.take("cache-test", 1, 0.5, 100) for _ in range(2)], [0, 2])
+        self.assertEqual(store.take("cache-test", 1, 0.5, 102), 0)
+        store.cache.delete(store.prefix + "cache-test")
+
+
+class TestUserEmail(TestCase):
+    def test_unique_ignoring_case(self):
+        User.objects.create_user(username="a", email="Ada@example.com")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create_user(username="b", email="ada@EXAMPLE.com")
+        # accounts without an email are not constrained
+        User.objects.create_user(username="c")
+        User.objects.create_user(username="d")
+
+    def test_signup_email_taken_ignoring_case(self):
+        User.objects.create_user(username="a", email="Ada@example.com")
+        form = SignUpForm(None, {"username": "b", "email": "ada@example.com", "password": "test1234", "password2": "test1234"})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors["email"], ["Email already exists"])
+
+    def test_lookups_use_index(self):
+        User.objects.create_user(username="a", email="Ada@example.com")
+        User.objects.create_user(username="b")
+        self.assertEqual(list(users_with_emails(["ADA@example.com", ""]).values_list("username", flat=True)), ["a"])
+        for queryset in (users_with_emails(["ada@example.com", "bob@example.com"]), users_with_emails(["ada@example.com"])[:1]):
+            plan = queryset.explain()
+            self.assertEqual(full_scans(plan), [])
+            self.assertIn("accounts_user_email_ci_uniq", plan)
+
+
+class TestPasswordReset(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", email="test@example.com", password="old-password")
+
+    def test_reset_email_goes_through_the_job_queue(self):
+        response = self.client.post(reverse("accounts:password-reset"), {"email": "test@example.com"})
+        self.assertRedirects(response, reverse("accounts:password-reset-done"))
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Job.objects.filter(name="accounts.send_email").count(), 1)
+
+        Worker(concurrency=1).run(once=True)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, "Reset your password")
+        link = next(line for line in mail.outbox[0].body.splitlines() if "/accounts/reset/" in line)
+
+        response = self.client.get(link, follow=True)
+        self.assertTrue(response.context["validlink"])
+        response = self.client.post(
+            response.redirect_chain[-1][0], {"new_password1": "n3w-Passw0rd!", "new_password2": "n3w-Passw0rd!"}
+        )
+        self.assertRedirects(response, reverse("accounts:login"), fetch_redirect_response=False)
+        self.assertTrue(self.client.login(username="test", password="n3w-Passw0rd!"))
+
+    def test_unknown_email_sends_nothing(self):
+        response = self.client.post(reverse("accounts:password-reset"), {"email": "nobody@example.com"})
+        self.assertRedirects(response, reverse("accounts:password-reset-done"))
+        self.assertFalse(Job.objects.exists())
@@ -1,6 +1,9 @@
 from django.urls import path
+from django.views.generic import TemplateView
 from accounts.views import (
     LoginView,
+    PasswordResetConfirmView,
+    PasswordResetView,
     SignUpView,
     user_logout,
 )
@@ -11,4 +14,11 @@ urlpatterns = [
     path('login/', LoginView.as_view(), name='login'),
     path('signup/', SignUpView.as_view(), name='signup'),
     path('logout/', user_logout, name='logout'),
+    path('password-reset/', PasswordResetView.as_view(), name='password-reset'),
+    path(
+        'password-reset/done/',
+        TemplateView.as_view(template_name='accounts/password_reset_done.html'),
+        name='password-reset-done',
+    ),
+    path('reset/<uidb64>/<token>/', PasswordResetConfirmView.as_view(), name='password-reset-confirm'),
 ]
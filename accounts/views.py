@@ -1,14 +1,42 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout
+from django.contrib.auth import views as auth_views
+from django.urls import reverse_lazy
 from django.views import View
 
-from accounts.forms import LoginForm, SignUpForm
+from accounts import ratelimit
+from accounts.forms import LoginForm, PasswordResetForm, SignUpForm
 
 
-class SignUpView(View):
+class RateLimitMixin:
+    """
+    Throttle POSTs with ``accounts.ratelimit`` before the form hashes a
+    password; a throttled attempt gets the form back with status 429.
+    """
+    rate_limit_scope = None
+    form_class = None
+    template_name = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method == "POST":
+            wait = ratelimit.check(request, self.rate_limit_scope)
+            if wait:
+                form = self.form_class(request, request.POST)
+                form.reject(f"Too many attempts. Try again in {wait} seconds.")
+                response = render(request, self.template_name, {"form": form}, status=429)
+                response["Retry-After"] = str(wait)
+                return response
+        return super().dispatch(request, *args, **kwargs)
+
+
+class SignUpView(RateLimitMixin, View):
     """
     View to create a new user.
     """
+    rate_limit_scope = "signup"
+    form_class = SignUpForm
+    template_name = "accounts/signup.html"
+
     def post(self, request):
         form = SignUpForm(request, request.POST)
         if form.is_valid():
@@ -21,10 +49,14 @@ class SignUpView(View):
         return render(request, "accounts/signup.html", {"form": form})
 
 
-class LoginView(View):
+class LoginView(RateLimitMixin, View):
     """
     View to log a user in.
     """
+    rate_limit_scope = "login"
+    form_class = LoginForm
+    template_name = "accounts/login.html"
+
     def post(self, request):
         form = LoginForm(request, request.POST)
         if form.is_valid():
@@ -44,3 +76,22 @@ def user_logout(request):
     """
     logout(request)
     return redirect("accounts:login")
+
+
+class PasswordResetView(auth_views.PasswordResetView):
+    """
+    View to ask for a password reset link by email.
+    """
+    form_class = PasswordResetForm
+    template_name = "accounts/password_reset.html"
+    email_template_name = "accounts/password_reset_email.txt"
+    subject_template_name = "accounts/password_reset_subject.txt"
+    success_url = reverse_lazy("accounts:password-reset-done")
+
+
+class PasswordResetConfirmView(auth_views.PasswordResetConfirmView):
+    """
+    View to choose a new password from a reset link.
+    """
+    template_name = "accounts/password_reset_confirm.html"
+    success_url = reverse_lazy("accounts:login")
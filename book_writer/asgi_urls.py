@@ -0,0 +1,12 @@
+"""
+URL configuration used for ASGI requests (see ``ASGI_URLCONF``): the same
+routes as ``book_writer.urls`` with the async book views in front.
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('accounts/', include('accounts.urls')),
+    path('', include('books.async_urls')),
+]
@@ -0,0 +1,262 @@
+"""
+Project middleware.
+
+``ASGIUrlconfMiddleware`` routes ASGI requests through ``ASGI_URLCONF``.
+
+``ReplicaMiddleware`` lets safe requests read from a replica, see
+``book_writer.routers``.
+
+``QueryInstrumentationMiddleware`` is opt-in per-request SQL instrumentation.
+
+With ``SQL_INSTRUMENTATION`` on, every query of a request goes through a
+``connection.execute_wrapper`` that counts and times it and groups it by SQL
+template (literals and ``IN`` lists folded).  A template run at least
+``SQL_INSTRUMENTATION_N1_THRESHOLD`` times is reported as a likely N+1 along
+with where it came from: the template and line being rendered, or else the
+innermost project frame.
+
+The totals go out in a ``Server-Timing`` header and every request logs one
+JSON line to the ``book_writer.sql`` logger, at WARNING when an N+1 was found.
+When the setting is off the middleware removes itself at startup.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+import django
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
+
+from book_writer import routers
+
+logger = logging.getLogger("book_writer.sql")
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+_TEMPLATE_RENDER = os.path.join("django", "template", "base.py")
+_DJANGO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(django.__file__)))
+
+
+def sql_template(sql):
+    """Fold the parts of a statement that vary between otherwise identical queries."""
+    return _IN_LISTS.sub("(%s, ...)", _LITERALS.sub("?", sql))
+
+
+def query_origin():
+    """The template line being rendered, else the innermost frame of project code."""
+    frame = sys._getframe(1)
+    project_frame = None
+    base_dir = str(settings.BASE_DIR)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if frame.f_code.co_name == "render_annotated" and filename.endswith(_TEMPLATE_RENDER):
+            node = frame.f_locals.get("self")
+            origin = getattr(node, "origin", None)
+            if origin is not None:
+                name = origin.template_name or origin.name
+                return f"{name}:{node.token.lineno}" if getattr(node, "token", None) else str(name)
+        if (
+            project_frame is None
+            and filename.startswith(base_dir)
+            and not filename.startswith(_DJANGO_DIR)
+            and filename != __file__
+        ):
+            project_frame = f"{os.path.relpath(filename, base_dir)}:{frame.f_lineno}"
+        frame = frame.f_back
+    return project_frame or "unknown"
+
+
+class QueryGroup:
+    __slots__ = ("count", "duration", "origins")
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.origins = Counter()
+
+
+class QueryRecorder:
+    """An ``execute_wrapper`` collecting the queries of one request."""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.count = 0
+        self.duration = 0.0
+        self.groups = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            group = self.groups.setdefault(sql_template(sql), QueryGroup())
+            group.count += 1
+            group.duration += elapsed
+            group.origins[query_origin()] += 1
+
+    def repeated(self):
+        """Groups run at least ``threshold`` times, most frequent first."""
+        found = [
+            {
+                "sql": sql[:300],
+                "count": group.count,
+                "ms": round(group.duration * 1000, 2),
+                "origin": group.origins.most_common(1)[0][0],
+            }
+            for sql, group in self.groups.items()
+            if group.count >= self.threshold
+        ]
+        return sorted(found, key=lambda item: -item["count"])
+
+
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, "SQL_INSTRUMENTATION", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = getattr(settings, "SQL_INSTRUMENTATION_N1_THRESHOLD", 5)
+
+    def __call__(self, request):
+        recorder = QueryRecorder(self.threshold)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+            self.add_server_timing(response, recorder, started)
+            if response.streaming and not getattr(response, "is_async", False):
+                # keep recording while the body is produced and log once it is done
+                response.streaming_content = self.stream(
+                    response.streaming_content, stack.pop_all(), request, response, recorder, started
+                )
+                return response
+        self.log(request, response, recorder, started)
+        return response
+
+    def stream(self, content, stack, request, response, recorder, started):
+        with stack:
+            yield from content
+        self.log(request, response, recorder, started)
+
+    def add_server_timing(self, response, recorder, started):
+        total = (time.perf_counter() - started) * 1000
+        metrics = [
+            f'db;desc="{recorder.count} queries";dur={recorder.duration * 1000:.2f}',
+            f"total;dur={total:.2f}",
+        ]
+        repeated = recorder.repeated()
+        if repeated:
+            metrics.append(f'n1;desc="{len(repeated)} repeated queries"')
+        existing = response.headers.get("Server-Timing")
+        response.headers["Server-Timing"] = ", ".join(([existing] if existing else []) + metrics)
+
+    def log(self, request, response, recorder, started):
+        repeated = recorder.repeated()
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "queries": recorder.count,
+            "db_ms": round(recorder.duration * 1000, 2),
+            "total_ms": round((time.perf_counter() - started) * 1000, 2),
+            "n_plus_one": repeated,
+        }
+        logger.log(logging.WARNING if repeated else logging.INFO, json.dumps(record), extra={"sql": record})
+
+
+class ASGIUrlconfMiddleware:
+    """
+    Serve ASGI requests from ``ASGI_URLCONF``, whose async views avoid a
+    thread hop per request; WSGI requests keep ``ROOT_URLCONF``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.urlconf = getattr(settings, "ASGI_URLCONF", None)
+        if not self.urlconf:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if isinstance(request, ASGIRequest):
+            request.urlconf = self.urlconf
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.urlconf = self.urlconf
+        return await self.get_response(request)
+
+
+class ReplicaMiddleware:
+    """
+    Route the reads of GET, HEAD and OPTIONS requests to a replica, unless
+    the client wrote within the last ``DATABASE_PIN_SECONDS``.  The time of a
+    client's last write travels in the ``DATABASE_PIN_COOKIE`` cookie, so
+    pinning works across server processes.
+    """
+    sync_capable = True
+    async_capable = True
+    safe_methods = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(self, get_response):
+        if not routers.replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, "DATABASE_PIN_SECONDS", 10)
+        self.cookie = getattr(settings, "DATABASE_PIN_COOKIE", "primary_until")
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self.route(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = self.route(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.reset(token)
+        return self.pin(request, response)
+
+    def pinned(self, request):
+        try:
+            return float(request.COOKIES.get(self.cookie, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def route(self, request):
+        if request.method in self.safe_methods and not self.pinned(request):
+            return routers.use_replica()
+        return routers.use_primary()
+
+    def pin(self, request, response):
+        if request.method not in self.safe_methods and self.pin_seconds > 0:
+            response.set_cookie(
+                self.cookie, f"{time.time() + self.pin_seconds:.3f}",
+                max_age=self.pin_seconds, httponly=True, samesite="Lax",
+                secure=request.is_secure(),
+            )
+        return response
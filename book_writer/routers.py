@@ -0,0 +1,73 @@
+"""
+Read replicas.
+
+``DATABASE_REPLICAS`` names database aliases that replicate ``default``.
+``ReplicaMiddleware`` (see ``book_writer.middleware``) picks one of them
+for each GET, HEAD or OPTIONS request and ``PrimaryReplicaRouter`` sends
+that request's reads to it.  Everything else reads from the primary:
+requests that write, management commands, the job worker, and reads
+inside a transaction.  A request that writes reads from the primary from
+then on.
+
+After a write request the middleware pins the client to the primary for
+``DATABASE_PIN_SECONDS``, so users see their own changes even while the
+replicas lag behind.
+"""
+import contextvars
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_read_alias = contextvars.ContextVar("read_alias", default=None)
+
+
+def replicas():
+    return list(getattr(settings, "DATABASE_REPLICAS", []))
+
+
+def use_replica():
+    """Read from a randomly chosen replica until ``reset``; returns the token for it."""
+    aliases = replicas()
+    return _read_alias.set(random.choice(aliases) if aliases else None)
+
+
+def use_primary():
+    return _read_alias.set(None)
+
+
+def reset(token):
+    _read_alias.reset(token)
+
+
+def read_alias():
+    """The alias reads go to right now."""
+    alias = _read_alias.get()
+    if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+    return alias
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db == DEFAULT_DB_ALIAS:
+            # related rows of an object read from the primary
+            return DEFAULT_DB_ALIAS
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        # the rest of the request must see this write
+        _read_alias.set(None)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in replicas():
+            return False
+        return None
@@ -48,9 +48,13 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'accounts',
     'books',
+    'jobs',
 ]
 
 MIDDLEWARE = [
+    'book_writer.middleware.QueryInstrumentationMiddleware',
+    'book_writer.middleware.ASGIUrlconfMiddleware',
+    'book_writer.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,8 +64,27 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-request query counts, timings and N+1 warnings in a Server-Timing header
+# and the "book_writer.sql" log (see book_writer/middleware.py); off by default
+SQL_INSTRUMENTATION = env.bool('SQL_INSTRUMENTATION', default=False)
+SQL_INSTRUMENTATION_N1_THRESHOLD = env.int('SQL_INSTRUMENTATION_N1_THRESHOLD', default=5)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'book_writer.sql': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 ROOT_URLCONF = 'book_writer.urls'
 
+# ASGI requests are routed here instead, to the async read views
+ASGI_URLCONF = 'book_writer.asgi_urls'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -88,6 +111,87 @@ DATABASES = {
     'default': env.db(),
 }
 
+# Read replicas of the primary as comma separated database URLs, used by safe
+# requests (see book_writer/routers.py).  Tests read them from the primary.
+DATABASE_REPLICAS = []
+for number, url in enumerate(env.list('DATABASE_REPLICA_URLS', default=[]), start=1):
+    alias = f'replica{number}'
+    DATABASES[alias] = {**env.db_url_config(url), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['book_writer.routers.PrimaryReplicaRouter']
+# seconds a client reads from the primary after a write, while replicas catch up
+DATABASE_PIN_SECONDS = env.int('DATABASE_PIN_SECONDS', default=10)
+
+# Persistent connections (seconds, 0 closes them after every request) are
+# checked before each request reuses them
+for config in DATABASES.values():
+    config.setdefault('CONN_MAX_AGE', env.int('CONN_MAX_AGE', default=0))
+    config['CONN_HEALTH_CHECKS'] = True
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Cache alias holding the rendered book fragments (see books/cache.py).  It must
+# be shared by every server process; check --deploy warns about locmem (books.W001).
+BOOKS_FRAGMENT_CACHE = env('BOOKS_FRAGMENT_CACHE', default='default')
+BOOKS_FRAGMENT_TIMEOUT = env.int('BOOKS_FRAGMENT_TIMEOUT', default=60 * 60 * 24)
+
+
+# Live updates of the book event stream (see books/events.py).  Use
+# books.events.RedisBackend when running more than one server process.
+BOOKS_EVENTS_BACKEND = env('BOOKS_EVENTS_BACKEND', default='books.events.LocalBackend')
+BOOKS_EVENTS_REDIS_URL = env('BOOKS_EVENTS_REDIS_URL', default='redis://localhost:6379/0')
+# events held for a slow client before its stream is reset
+BOOKS_EVENTS_QUEUE_SIZE = env.int('BOOKS_EVENTS_QUEUE_SIZE', default=100)
+# seconds between keep-alive comments, and before a stream ends for the client to reconnect
+BOOKS_EVENTS_HEARTBEAT = env.float('BOOKS_EVENTS_HEARTBEAT', default=15)
+BOOKS_EVENTS_MAX_AGE = env.float('BOOKS_EVENTS_MAX_AGE', default=300)
+
+
+# Deleted books and sections stay in the trash, restorable, for this many
+# days before the books.purge_trash job removes them (see books/trash.py)
+BOOKS_TRASH_RETENTION_DAYS = env.int('BOOKS_TRASH_RETENTION_DAYS', default=30)
+
+
+# The activity log is written in batches of this many entries, or once the
+# oldest waiting entry is this many seconds old (see books/activity.py)
+BOOKS_ACTIVITY_BUFFER_SIZE = env.int('BOOKS_ACTIVITY_BUFFER_SIZE', default=100)
+BOOKS_ACTIVITY_FLUSH_INTERVAL = env.float('BOOKS_ACTIVITY_FLUSH_INTERVAL', default=5)
+
+
+# Section history: a full snapshot is stored every this many revisions, so
+# rebuilding any revision applies fewer deltas than this (see books/revisions.py)
+SECTION_REVISION_SNAPSHOT_INTERVAL = env.int('SECTION_REVISION_SNAPSHOT_INTERVAL', default=20)
+
+
+# Baseline the benchmark command compares against (see books/benchmark.py)
+BENCHMARK_BASELINE = env('BENCHMARK_BASELINE', default=str(BASE_DIR / 'benchmark_baseline.json'))
+
+
+# Throttling of login and signup attempts per client IP and username, as
+# "attempts/period" with period s, m, h or d (see accounts/ratelimit.py).
+# Use accounts.ratelimit.CacheStore to share the buckets between processes.
+RATE_LIMITS = {
+    'login': {
+        'ip': env('RATE_LIMIT_LOGIN_IP', default='20/m'),
+        'username': env('RATE_LIMIT_LOGIN_USERNAME', default='5/m'),
+    },
+    'signup': {
+        'ip': env('RATE_LIMIT_SIGNUP_IP', default='5/h'),
+        'username': env('RATE_LIMIT_SIGNUP_USERNAME', default='5/h'),
+    },
+}
+RATE_LIMIT_STORE = env('RATE_LIMIT_STORE', default='accounts.ratelimit.LocalStore')
+RATE_LIMIT_CACHE = env('RATE_LIMIT_CACHE', default='default')
+# Addresses or networks of the reverse proxies in front of the app, comma
+# separated; the client IP is read from X-Forwarded-For only behind them
+RATE_LIMIT_TRUSTED_PROXIES = env.list('RATE_LIMIT_TRUSTED_PROXIES', default=[])
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -129,6 +233,23 @@ STATIC_DIRS = [
     
 ]
 
+# Email
+# https://docs.djangoproject.com/en/4.2/topics/email/
+
+vars().update(env.email_url('EMAIL_URL', default='consolemail://'))
+
+# Number of queued emails sent over one SMTP connection
+EMAIL_BATCH_SIZE = env.int('EMAIL_BATCH_SIZE', default=50)
+
+
+# Background jobs (see jobs/queue.py)
+
+JOBS_CONCURRENCY = env.int('JOBS_CONCURRENCY', default=4)
+JOBS_POLL_INTERVAL = env.float('JOBS_POLL_INTERVAL', default=1.0)
+JOBS_RETRY_BACKOFF = env.int('JOBS_RETRY_BACKOFF', default=30)
+JOBS_RETRY_BACKOFF_MAX = env.int('JOBS_RETRY_BACKOFF_MAX', default=3600)
+JOBS_LOCK_TIMEOUT = env.int('JOBS_LOCK_TIMEOUT', default=600)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,110 @@
+"""
+Write-behind activity log: who did what in which book.
+
+``record()`` queues an ``Activity`` once the surrounding transaction
+commits, so a write view never waits on the log.  The process-wide
+``buffer`` writes queued entries with one ``bulk_create``:
+
+* as soon as it holds ``BOOKS_ACTIVITY_BUFFER_SIZE`` entries;
+* when a request finishes and the oldest entry has waited
+  ``BOOKS_ACTIVITY_FLUSH_INTERVAL`` seconds, so the flush happens after the
+  response has been sent;
+* when the process exits.
+
+Entries still in the buffer are lost if the process dies.  The log is a
+trail for people to read, not a ledger.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import IntegrityError, transaction
+from django.dispatch import receiver
+
+from books.models import Activity, Book
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._oldest = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, activity):
+        with self._lock:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append(activity)
+            full = len(self._pending) >= settings.BOOKS_ACTIVITY_BUFFER_SIZE
+        if full:
+            self.flush()
+
+    def due(self):
+        oldest = self._oldest
+        return bool(self._pending) and (
+            len(self._pending) >= settings.BOOKS_ACTIVITY_BUFFER_SIZE
+            or time.monotonic() - oldest >= settings.BOOKS_ACTIVITY_FLUSH_INTERVAL
+        )
+
+    def flush(self):
+        """Write everything buffered; returns the number of entries written."""
+        with self._lock:
+            batch, self._pending, self._oldest = self._pending, [], None
+        if not batch:
+            return 0
+        try:
+            try:
+                with transaction.atomic():
+                    Activity.objects.bulk_create(batch)
+            except IntegrityError:
+                # a book was deleted for good while its entries waited
+                books = set(Book.all_objects.filter(pk__in={entry.book_id for entry in batch}).values_list("pk", flat=True))
+                batch = [entry for entry in batch if entry.book_id in books]
+                Activity.objects.bulk_create(batch)
+        except Exception:
+            logger.exception("Could not write %d activity log entries.", len(batch))
+            return 0
+        return len(batch)
+
+    def clear(self):
+        with self._lock:
+            self._pending, self._oldest = [], None
+
+
+buffer = ActivityBuffer()
+
+
+def record(book, actor, verb, section=None, user=None, subject=""):
+    """
+    Log that ``actor`` did ``verb`` (an ``Activity`` constant) in ``book``,
+    to ``section`` or collaborator ``user`` if given.
+    """
+    if section is not None:
+        subject = section.title
+    elif user is not None:
+        subject = user.get_username()
+    activity = Activity(
+        book_id=book if isinstance(book, int) else book.pk,
+        actor_id=actor.pk if actor is not None and actor.is_authenticated else None,
+        verb=verb,
+        section_id=section.pk if section is not None else None,
+        subject=subject[:150],
+    )
+    transaction.on_commit(lambda: buffer.add(activity))
+
+
+@receiver(request_finished)
+def flush_after_request(sender, **kwargs):
+    if buffer.due():
+        buffer.flush()
+
+
+atexit.register(buffer.flush)
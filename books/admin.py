@@ -1,5 +1,5 @@
 from django.contrib import admin
-from books.models import Book, Section,  BookCollaborator
+from books.models import Activity, Book, Section,  BookCollaborator, BookMembership, SectionRevision
 
 
 @admin.register(Book)
@@ -15,3 +15,20 @@ class SectionAdmin(admin.ModelAdmin):
 @admin.register(BookCollaborator)
 class BookCollaboratorAdmin(admin.ModelAdmin):
     list_display = ["book", "collaborator", "created_at", "updated_at"]
+
+
+@admin.register(BookMembership)
+class BookMembershipAdmin(admin.ModelAdmin):
+    list_display = ["book", "user", "role", "created_at", "updated_at"]
+    list_filter = ["role"]
+
+
+@admin.register(SectionRevision)
+class SectionRevisionAdmin(admin.ModelAdmin):
+    list_display = ["section", "number", "base", "length", "author", "created_at"]
+
+
+@admin.register(Activity)
+class ActivityAdmin(admin.ModelAdmin):
+    list_display = ["book", "actor", "verb", "subject", "created_at"]
+    list_filter = ["verb"]
@@ -0,0 +1,399 @@
+"""
+JSON API over books, sections and collaborators.
+
+Read access follows ``get_books``: a user sees the books they wrote or
+collaborate on.  Sections are created by the book's author and updated or
+moved by any member, as in the HTML views.
+
+* ``GET api/books/`` and ``GET api/books/<pk>/sections/`` are cursor
+  paginated: pass the ``next`` or ``previous`` value of a response back as
+  ``cursor``, and ``limit`` to size pages.  Sections come in reading order,
+  as in the book's table of contents.
+* ``GET api/sections/?ids=1,2,3`` fetches many sections in one call and lists
+  the ids that do not exist or are not readable under ``missing``.
+* ``POST api/books/<pk>/collaborators/`` adds ``{"emails": [...]}`` as
+  collaborators (author only) and reports the ``added``, ``existing``,
+  ``unknown`` and ``invalid`` emails.
+* ``POST api/books/<pk>/sections/batch/`` applies ``{"operations": [...]}`` in
+  one transaction; either every operation succeeds or none does::
+
+      {"op": "create", "ref": "intro", "title": "Intro", "parent": null, "content": ""}
+      {"op": "update", "id": 7, "version": 3, "title": "New title", "content": "..."}
+      {"op": "move", "id": 8, "parent": "intro"}
+
+  ``parent`` is a section id, ``null`` for the top level or the ``ref`` of a
+  section created earlier in the same batch.  ``version`` is optional and,
+  when given, makes the update fail with 409 if the section changed since.
+* ``POST api/books/<pk>/sections/reorder/`` applies drag and drop moves
+  ``{"moves": [{"id": 8, "parent": 3, "after": 5}, ...]}`` in one
+  transaction: each section goes under ``parent`` right after its sibling
+  ``after``, or first when ``after`` is ``null``.
+
+Every listing accepts ``fields=id,title,...`` to return only those fields;
+the others, ``content`` in particular, are not even read from the database.
+"""
+import json
+
+from django.db import transaction
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views import View
+
+from books.activity import record
+from books.collaborators import MAX_INVITES, invite_collaborators
+from books.concurrency import VersionConflict, save_section
+from books.models import Activity, BookCollaborator, Section
+from books.ordering import reorder_sections
+from books.pagination import InvalidCursor, KeysetPaginator, ListPaginator
+from books.revisions import record_revision
+from books.tree import TableOfContents, TreeError
+from books.views import get_books
+
+MAX_BATCH = 500
+
+BOOK_FIELDS = {
+    "id": "id",
+    "name": "name",
+    "author": "author_id",
+    "word_count": "word_count",
+    "char_count": "char_count",
+    "section_count": "section_count",
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+}
+SECTION_FIELDS = {
+    "id": "id",
+    "book": "book_id",
+    "parent": "parent_id",
+    "title": "title",
+    "content": "content",
+    "depth": "depth",
+    "version": "version",
+    "position": "position",
+    "word_count": "word_count",
+    "char_count": "char_count",
+    "subtree_word_count": "subtree_word_count",
+    "subtree_char_count": "subtree_char_count",
+    "subtree_section_count": "subtree_section_count",
+    "author": "author_id",
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+def parse_fields(request, available):
+    """The requested ``fields=``, all of ``available`` by default."""
+    names = [name for name in request.GET.get("fields", "").split(",") if name]
+    if not names:
+        return list(available)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(available)}.")
+    return names
+
+
+def parse_limit(request, default, maximum):
+    try:
+        return min(max(int(request.GET.get("limit", default)), 1), maximum)
+    except ValueError:
+        raise ApiError("limit must be a number.")
+
+
+def serialize(obj, fields, available):
+    return {name: getattr(obj, available[name]) for name in fields}
+
+
+def paginate(request, queryset, ordering, fields, available, default_limit, max_limit):
+    """Cursor-paginated listing reading only the columns of ``fields``."""
+    columns = {available[name] for name in fields} | {"id", ordering.lstrip("-")}
+    paginator = KeysetPaginator(queryset.only(*columns), ordering, per_page=parse_limit(request, default_limit, max_limit))
+    try:
+        page = paginator.page(request.GET.get("cursor"))
+    except InvalidCursor:
+        raise ApiError("Invalid cursor.")
+    return {
+        "results": [serialize(obj, fields, available) for obj in page],
+        "next": page.next_cursor,
+        "previous": page.previous_cursor,
+    }
+
+
+class ApiView(View):
+    """Session-authenticated JSON view; errors are answered as JSON too."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({"error": "Authentication required."}, status=401)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except Http404:
+            return JsonResponse({"error": "Not found."}, status=404)
+        except ApiError as exc:
+            return JsonResponse({"error": str(exc), **exc.extra}, status=exc.status)
+
+
+class BookListApiView(ApiView):
+    def get(self, request):
+        fields = parse_fields(request, BOOK_FIELDS)
+        return JsonResponse(paginate(request, get_books(request.user), "-updated_at", fields, BOOK_FIELDS, 25, 100))
+
+
+class BookApiView(ApiView):
+    def get(self, request, pk):
+        fields = parse_fields(request, BOOK_FIELDS)
+        book = get_object_or_404(get_books(request.user).only(*{BOOK_FIELDS[name] for name in fields}), pk=pk)
+        return JsonResponse(serialize(book, fields, BOOK_FIELDS))
+
+
+class SectionListApiView(ApiView):
+    """
+    A book's sections in reading order, as in its table of contents: each
+    subtree after its root, siblings in ``position`` order.
+    """
+
+    def get(self, request, pk):
+        book = get_object_or_404(get_books(request.user), pk=pk)
+        fields = parse_fields(request, SECTION_FIELDS)
+        toc = TableOfContents.for_book(book)
+        paginator = ListPaginator([node.id for node in toc], parse_limit(request, 100, 500), Section._meta.pk)
+        try:
+            page = paginator.page(request.GET.get("cursor"))
+        except InvalidCursor:
+            raise ApiError("Invalid cursor.")
+        columns = {SECTION_FIELDS[name] for name in fields} | {"id"}
+        sections = Section.objects.filter(pk__in=page.object_list).only(*columns).in_bulk()
+        return JsonResponse({
+            "results": [serialize(sections[pk], fields, SECTION_FIELDS) for pk in page if pk in sections],
+            "next": page.next_cursor,
+            "previous": page.previous_cursor,
+        })
+
+
+class CollaboratorListApiView(ApiView):
+    def get(self, request, pk):
+        book = get_object_or_404(get_books(request.user), pk=pk)
+        rows = (
+            BookCollaborator.objects.filter(book=book)
+            .select_related("collaborator")
+            .only("created_at", "collaborator__id", "collaborator__username",
+                  "collaborator__first_name", "collaborator__last_name")
+            .order_by("pk")
+        )
+        return JsonResponse({"results": [
+            {
+                "id": row.collaborator.id,
+                "username": row.collaborator.username,
+                "first_name": row.collaborator.first_name,
+                "last_name": row.collaborator.last_name,
+                "added_at": row.created_at,
+            }
+            for row in rows
+        ]})
+
+    def post(self, request, pk):
+        book = get_object_or_404(get_books(request.user), pk=pk)
+        if book.author_id != request.user.pk:
+            raise ApiError("Only the author can add collaborators.", status=403)
+        try:
+            emails = json.loads(request.body)["emails"]
+        except (ValueError, KeyError, TypeError):
+            raise ApiError('Expected a JSON object with an "emails" list.')
+        if not isinstance(emails, list) or not all(isinstance(email, str) for email in emails):
+            raise ApiError('"emails" must be a list of strings.')
+        if len(emails) > MAX_INVITES:
+            raise ApiError(f"At most {MAX_INVITES} emails per request.")
+        result = invite_collaborators(book, emails)
+        for user in result.added:
+            record(book, request.user, Activity.COLLABORATOR_ADDED, user=user)
+        return JsonResponse({
+            "added": [{"id": user.pk, "username": user.username, "email": user.email} for user in result.added],
+            "existing": result.existing,
+            "unknown": result.unknown,
+            "invalid": result.invalid,
+        })
+
+
+class SectionBatchApiView(ApiView):
+    """Fetch many sections by id: ``?ids=1,2,3``."""
+
+    def get(self, request):
+        try:
+            ids = list(dict.fromkeys(int(pk) for pk in request.GET.get("ids", "").split(",") if pk))
+        except ValueError:
+            raise ApiError("ids must be a comma separated list of numbers.")
+        if len(ids) > MAX_BATCH:
+            raise ApiError(f"At most {MAX_BATCH} ids per request.")
+        fields = parse_fields(request, SECTION_FIELDS)
+        columns = {SECTION_FIELDS[name] for name in fields} | {"id"}
+        sections = {
+            section.pk: section
+            for section in Section.objects.filter(pk__in=ids, book__in=get_books(request.user)).only(*columns)
+        }
+        return JsonResponse({
+            "results": [serialize(sections[pk], fields, SECTION_FIELDS) for pk in ids if pk in sections],
+            "missing": [pk for pk in ids if pk not in sections],
+        })
+
+
+class SectionWriteBatchApiView(ApiView):
+    """Apply creates, updates and moves to one book's sections atomically."""
+
+    def post(self, request, pk):
+        book = get_object_or_404(get_books(request.user), pk=pk)
+        try:
+            operations = json.loads(request.body)["operations"]
+        except (ValueError, KeyError, TypeError):
+            raise ApiError('Expected a JSON object with an "operations" list.')
+        if not isinstance(operations, list) or len(operations) > MAX_BATCH:
+            raise ApiError(f'"operations" must be a list of at most {MAX_BATCH} operations.')
+
+        batch = _SectionBatch(book, request.user)
+        with transaction.atomic():
+            results = []
+            for index, operation in enumerate(operations):
+                try:
+                    results.append(batch.apply(operation))
+                except ApiError as exc:
+                    exc.extra["index"] = index
+                    raise
+        return JsonResponse({"results": results})
+
+
+class SectionReorderApiView(ApiView):
+    """Move many sections of one book, in one transaction."""
+
+    def post(self, request, pk):
+        book = get_object_or_404(get_books(request.user), pk=pk)
+        try:
+            moves = json.loads(request.body)["moves"]
+        except (ValueError, KeyError, TypeError):
+            raise ApiError('Expected a JSON object with a "moves" list.')
+        if not isinstance(moves, list) or len(moves) > MAX_BATCH:
+            raise ApiError(f'"moves" must be a list of at most {MAX_BATCH} moves.')
+
+        wanted = []
+        for index, move in enumerate(moves):
+            if not isinstance(move, dict) or not all(
+                _is_id(move.get(key)) or (key != "id" and move.get(key) is None) for key in ("id", "parent", "after")
+            ):
+                raise ApiError('Every move needs an "id" and a "parent" and "after" id or null.', index=index)
+            wanted.append((move["id"], move.get("parent"), move.get("after")))
+        sections = book.sections.only("id", "book_id", "parent_id", "title", "path", "depth", "position", "version").in_bulk(
+            {pk for pk, _, _ in wanted} | {parent for _, parent, _ in wanted if parent is not None}
+        )
+        for index, (section_pk, parent, _) in enumerate(wanted):
+            missing = next((pk for pk in (section_pk, parent) if pk is not None and pk not in sections), None)
+            if missing is not None:
+                raise ApiError(f"Section {missing} is not in this book.", status=404, index=index)
+
+        try:
+            reorder_sections(book, [(sections[pk], parent, after) for pk, parent, after in wanted])
+        except TreeError as exc:
+            raise ApiError(str(exc))
+        moved = {pk: sections[pk] for pk, _, _ in wanted}
+        for section in moved.values():
+            record(book, request.user, Activity.SECTION_MOVED, section=section)
+        return JsonResponse({"results": [
+            {"id": section.pk, "parent": section.parent_id, "position": section.position, "version": section.version}
+            for section in moved.values()
+        ]})
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class _SectionBatch:
+    def __init__(self, book, user):
+        self.book = book
+        self.user = user
+        self.refs = {}
+
+    def apply(self, operation):
+        if not isinstance(operation, dict):
+            raise ApiError("Every operation must be an object.")
+        handler = {"create": self.create, "update": self.update, "move": self.move}.get(operation.get("op"))
+        if handler is None:
+            raise ApiError('"op" must be one of create, update or move.')
+        return handler(operation)
+
+    def section(self, operation):
+        try:
+            return self.book.sections.get(pk=int(operation["id"]))
+        except (KeyError, TypeError, ValueError):
+            raise ApiError('"id" must be a section id.')
+        except Section.DoesNotExist:
+            raise ApiError(f"Section {operation['id']} is not in this book.", status=404)
+
+    def parent_id(self, value):
+        if value is None:
+            return None
+        if isinstance(value, str) and value in self.refs:
+            return self.refs[value]
+        if isinstance(value, int) and not isinstance(value, bool) and self.book.sections.filter(pk=value).exists():
+            return value
+        raise ApiError(f"Unknown parent {value!r}.")
+
+    def text(self, operation, name, default):
+        value = operation.get(name, default)
+        if not isinstance(value, str):
+            raise ApiError(f'"{name}" must be a string.')
+        if name == "title" and not 0 < len(value) <= Section._meta.get_field("title").max_length:
+            raise ApiError('"title" must be between 1 and 100 characters.')
+        return value
+
+    def create(self, operation):
+        if self.book.author_id != self.user.pk:
+            raise ApiError("Only the author can add sections.", status=403)
+        ref = operation.get("ref")
+        if ref is not None and (not isinstance(ref, str) or ref in self.refs):
+            raise ApiError('"ref" must be a string unique within the batch.')
+        section = Section.objects.create(
+            book=self.book,
+            author=self.user,
+            parent_id=self.parent_id(operation.get("parent")),
+            title=self.text(operation, "title", None),
+            content=self.text(operation, "content", ""),
+        )
+        record_revision(section, author=self.user)
+        record(self.book, self.user, Activity.SECTION_CREATED, section=section)
+        if ref is not None:
+            self.refs[ref] = section.pk
+        return {"op": "create", "ref": ref, "id": section.pk, "version": section.version}
+
+    def update(self, operation):
+        section = self.section(operation)
+        previous_content = section.content
+        section.title = self.text(operation, "title", section.title)
+        section.content = self.text(operation, "content", section.content or "")
+        self.save(section, operation, ("title", "content"))
+        record_revision(section, author=self.user, previous_content=previous_content)
+        record(self.book, self.user, Activity.SECTION_UPDATED, section=section)
+        return {"op": "update", "id": section.pk, "version": section.version}
+
+    def move(self, operation):
+        section = self.section(operation)
+        if "parent" not in operation:
+            raise ApiError('"parent" is required to move a section.')
+        section.parent_id = self.parent_id(operation["parent"])
+        self.save(section, operation, ("parent",))
+        record(self.book, self.user, Activity.SECTION_MOVED, section=section)
+        return {"op": "move", "id": section.pk, "version": section.version, "parent": section.parent_id}
+
+    def save(self, section, operation, fields):
+        version = operation.get("version", section.version)
+        if not isinstance(version, int) or isinstance(version, bool):
+            raise ApiError('"version" must be a number.')
+        try:
+            save_section(section, version, fields=fields)
+        except VersionConflict as conflict:
+            raise ApiError("Version conflict.", status=409, id=section.pk, version=conflict.current_version)
+        except TreeError as exc:
+            raise ApiError(str(exc))
@@ -0,0 +1,23 @@
+"""
+URLs served under ASGI: the async read views first, then every pattern of
+``books.urls`` for the rest.  Names match ``books.urls`` so ``reverse()``
+gives the same paths either way.
+"""
+from django.urls import path
+
+from books import urls
+from books.async_views import AsyncBookDetailView, AsyncBookListView, AsyncBookTocView, AsyncSectionDetailView
+
+app_name = urls.app_name
+
+urlpatterns = [
+    path("", AsyncBookListView.as_view(), name="home"),
+    path("books/", AsyncBookListView.as_view(), name="book-list"),
+    path("books/<int:pk>/", AsyncBookDetailView.as_view(), name="detail"),
+    path("books/<int:pk>/toc/", AsyncBookTocView.as_view(), name="toc"),
+    path(
+        "books/<int:pk>/sections/<int:section_pk>/",
+        AsyncSectionDetailView.as_view(),
+        name="section-detail",
+    ),
+] + urls.urlpatterns
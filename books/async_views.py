@@ -0,0 +1,211 @@
+"""
+Async versions of the read-heavy views, served under ASGI.
+
+``books.async_urls`` routes the book list, book detail, table of contents
+and section detail here (``book_writer.middleware.ASGIUrlconfMiddleware``
+selects it for ASGI requests); every other URL keeps its sync view.  Queries
+go through the async ORM (``aget``, ``afirst``, ``async for``) and cached
+fragments through the async cache API, so a request only leaves the event
+loop where Django 4.2 has no async path: loading the session user.
+
+Templates are rendered from fully evaluated data; a lazy relation touched
+while rendering would raise ``SynchronousOnlyOperation``.
+
+``BookEventsView`` is async in both urlconfs but only streams under ASGI: a
+WSGI worker would be held for the whole life of the connection.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.mixins import AccessMixin
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.views import View
+
+from books.cache import BookFragments
+from books.conditional import AsyncConditionalGetMixin, abook_last_modified, adashboard_last_modified, make_etag
+from books.events import format_event, hub
+from books.pagination import InvalidCursor, KeysetPaginator
+from books.tree import TableOfContents
+from books.views import BookListView, get_books
+
+
+async def aget_user(request):
+    """``request.user``, loaded in a worker thread as sessions have no async API yet."""
+
+    def load():
+        request.user.is_authenticated  # evaluates the lazy object
+        return request.user
+
+    return await sync_to_async(load)()
+
+
+async def aget_object_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f"No {queryset.model._meta.object_name} matches the given query.")
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    async def dispatch(self, request, *args, **kwargs):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class BookValidatorsMixin:
+    async def get_validators(self, request, pk, **kwargs):
+        last_modified = await abook_last_modified(request.user, pk)
+        if last_modified is None:
+            return None
+        return make_etag(request, self.etag_prefix, pk, *kwargs.values(), last_modified.isoformat()), last_modified
+
+
+class AsyncBookListView(AsyncLoginRequiredMixin, AsyncConditionalGetMixin, View):
+    paginate_by = BookListView.paginate_by
+    sort_options = BookListView.sort_options
+    default_sort = BookListView.default_sort
+
+    async def get_validators(self, request):
+        last_modified, count = await adashboard_last_modified(request.user)
+        if last_modified is None:
+            return None
+        return make_etag(request, "books", request.GET.urlencode(), count, last_modified.isoformat()), last_modified
+
+    async def get(self, request):
+        sort = request.GET.get("sort")
+        if sort not in self.sort_options:
+            sort = self.default_sort
+        books = get_books(request.user).with_dashboard_stats(request.user)
+        ordering, _ = self.sort_options[sort]
+        paginator = KeysetPaginator(books, ordering, per_page=self.paginate_by)
+        try:
+            page = await paginator.apage(request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404("Invalid cursor.")
+        return render(
+            request,
+            "books/books.html",
+            {
+                "books": page.object_list,
+                "page": page,
+                "sort": sort,
+                "sort_options": [(key, label) for key, (_, label) in self.sort_options.items()],
+            },
+        )
+
+
+async def _toc_fragment(fragments, book, context, variant):
+    async def render_toc():
+        toc = await TableOfContents.afor_book(book)
+        return render_to_string("books/partials/toc.html", {**context, "toc": toc})
+
+    return await fragments.aget("toc", render_toc, variant=variant)
+
+
+class AsyncBookDetailView(AsyncLoginRequiredMixin, BookValidatorsMixin, AsyncConditionalGetMixin, View):
+    etag_prefix = "book"
+
+    async def get(self, request, pk):
+        book = await aget_object_or_404(get_books(request.user).select_related("author"), pk=pk)
+        is_author = book.author_id == request.user.id
+        variant = "author" if is_author else "member"
+        fragments = await BookFragments.acreate(book.pk)
+        context = {"book": book, "is_author": is_author}
+
+        async def render_collaborators():
+            collaborators = [user async for user in book.collaborators.only("id", "first_name", "last_name")]
+            return render_to_string("books/partials/collaborators.html", {**context, "collaborators": collaborators})
+
+        toc_html = await _toc_fragment(fragments, book, context, variant)
+        collaborators_html = await fragments.aget("collaborators", render_collaborators, variant=variant)
+        return render(
+            request,
+            "books/book.html",
+            {**context, "toc_html": mark_safe(toc_html), "collaborators_html": mark_safe(collaborators_html)},
+        )
+
+
+class AsyncBookTocView(AsyncLoginRequiredMixin, BookValidatorsMixin, AsyncConditionalGetMixin, View):
+    etag_prefix = "book"
+
+    async def get(self, request, pk):
+        book = await aget_object_or_404(get_books(request.user), pk=pk)
+        is_author = book.author_id == request.user.id
+        fragments = await BookFragments.acreate(book.pk)
+        context = {"book": book, "is_author": is_author}
+        return HttpResponse(await _toc_fragment(fragments, book, context, "author" if is_author else "member"))
+
+
+class AsyncSectionDetailView(AsyncLoginRequiredMixin, BookValidatorsMixin, AsyncConditionalGetMixin, View):
+    etag_prefix = "section"
+
+    async def get(self, request, pk, section_pk):
+        book = await aget_object_or_404(get_books(request.user), pk=pk)
+        context = {"book": book, "section_id": section_pk, "is_author": book.author_id == request.user.id}
+
+        async def render_section():
+            section = await aget_object_or_404(book.sections.select_related("author"), pk=section_pk)
+            toc = await TableOfContents.afor_book(book)
+            context.update({
+                "section": section,
+                "toc": toc,
+                "breadcrumbs": toc.breadcrumbs(section.pk),
+                "subsections": toc.children(section.pk),
+                "previous_section": toc.previous(section.pk),
+                "next_section": toc.next(section.pk),
+            })
+            return render_to_string("books/partials/section_body.html", context)
+
+        fragments = await BookFragments.acreate(book.pk)
+        section_html = await fragments.aget("section", render_section, variant=str(section_pk))
+        return render(request, "books/section.html", {**context, "section_html": mark_safe(section_html)})
+
+
+class BookEventsView(AsyncLoginRequiredMixin, View):
+    """Server-Sent Events of one book's section and collaborator changes."""
+
+    retry_ms = 3000
+
+    async def get(self, request, pk):
+        if not isinstance(request, ASGIRequest):
+            return HttpResponse(
+                "Live updates are only served by the ASGI application.", status=400, content_type="text/plain"
+            )
+        book = await aget_object_or_404(get_books(request.user).only("id"), pk=pk)
+        response = StreamingHttpResponse(self.stream(book.pk, request.user.pk), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    async def stream(self, book_id, user_id):
+        loop = asyncio.get_running_loop()
+        heartbeat = settings.BOOKS_EVENTS_HEARTBEAT
+        # end long streams so clients reconnect, and are checked for access again
+        deadline = loop.time() + settings.BOOKS_EVENTS_MAX_AGE
+        subscriber = hub.subscribe(book_id, user_id)
+        try:
+            yield f"retry: {self.retry_ms}\n\n"
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), min(heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield format_event(message)
+                if (
+                    message["type"] in ("reset", "book.deleted")
+                    or (message["type"] == "collaborator.removed" and message["user"] == user_id)
+                ):
+                    return
+        finally:
+            hub.unsubscribe(subscriber)
@@ -0,0 +1,343 @@
+"""
+Per-view benchmarks against the data in the database (see ``seed_benchmark``).
+
+Every URL pattern of ``BENCHMARK_URLCONFS`` is requested with the test client
+as one seeded user.  Route arguments are filled from the largest book that
+user wrote: ``pk`` is the book, ``section_pk`` its most revised section,
+``collaborator_pk`` one of its collaborators and ``number`` that section's
+latest revision.  After a warm-up request each URL gets one pass counting
+queries, one under ``tracemalloc`` for the peak allocation and ``repeat``
+timed passes whose median is reported.  Patterns without a GET handler are
+reported as skipped.
+
+Results are compared with a JSON baseline: any extra query, or a time or
+allocation above the baseline plus its tolerance, is a regression.
+"""
+import json
+import re
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass
+from importlib import import_module
+
+from django.db import connection, reset_queries
+from django.db.models import Count, Max
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+
+from books.models import Book, SectionRevision
+
+BENCHMARK_URLCONFS = ("books.urls", "accounts.urls")
+
+# absolute slack so sub-millisecond views do not fail on noise
+TIME_SLACK_MS = 5.0
+
+
+@dataclass
+class Measurement:
+    name: str
+    url: str
+    status: int
+    queries: int = 0
+    time_ms: float = 0.0
+    alloc_kb: float = 0.0
+    skipped: bool = False
+
+
+def url_patterns(urlconfs=BENCHMARK_URLCONFS):
+    """``(namespaced name, pattern)`` for every named pattern, in urlconf order."""
+    for module_name in urlconfs:
+        module = import_module(module_name)
+        namespace = getattr(module, "app_name", None)
+        for pattern in module.urlpatterns:
+            if isinstance(pattern, URLPattern) and pattern.name:
+                yield (f"{namespace}:{pattern.name}" if namespace else pattern.name), pattern
+
+
+def route_arguments(user):
+    """Values for every route argument used by the benchmarked urlconfs."""
+    book = (
+        Book.objects.filter(author=user)
+        .annotate(sections_total=Count("sections", distinct=True))
+        .order_by("-sections_total", "pk")
+        .first()
+    )
+    if book is None:
+        return {"fmt": "md"}
+    arguments = {"pk": book.pk, "fmt": "md"}
+    revised = (
+        SectionRevision.objects.filter(section__book=book)
+        .values("section_id")
+        .annotate(total=Count("pk"), latest=Max("number"))
+        .order_by("-total", "section_id")
+        .first()
+    )
+    if revised is not None:
+        arguments["section_pk"] = revised["section_id"]
+        arguments["number"] = revised["latest"]
+    else:
+        sections = list(book.sections.order_by("path").values_list("pk", flat=True))
+        if sections:
+            arguments["section_pk"] = sections[len(sections) // 2]
+    collaborator = book.collaborators.order_by("pk").values_list("pk", flat=True).first()
+    if collaborator is not None:
+        arguments["collaborator_pk"] = collaborator
+    return arguments
+
+
+class Benchmark:
+    def __init__(self, user, repeat=5, urlconfs=BENCHMARK_URLCONFS):
+        self.user = user
+        self.repeat = max(repeat, 1)
+        self.urlconfs = urlconfs
+        self.client = Client()
+
+    def run(self, only=None):
+        arguments = route_arguments(self.user)
+        results = []
+        for name, pattern in url_patterns(self.urlconfs):
+            if only and name not in only:
+                continue
+            wanted = list(pattern.pattern.converters)
+            if any(key not in arguments for key in wanted):
+                results.append(Measurement(name=name, url="", status=0, skipped=True))
+                continue
+            results.append(self.measure(name, reverse(name, kwargs={key: arguments[key] for key in wanted})))
+        return results
+
+    def get(self, url):
+        response = self.client.get(url)
+        if getattr(response, "streaming", False):
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    def measure(self, name, url):
+        # log in before every request, outside the measurement, as logout is benchmarked too
+        self.client.force_login(self.user)
+        response = self.get(url)
+        if response.status_code == 405:
+            return Measurement(name=name, url=url, status=405, skipped=True)
+
+        self.client.force_login(self.user)
+        # request_started clears the query log, so start capturing from an empty one
+        reset_queries()
+        with CaptureQueriesContext(connection) as captured:
+            self.get(url)
+        queries = len(captured)
+
+        self.client.force_login(self.user)
+        tracemalloc.start()
+        try:
+            self.get(url)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        timings = []
+        for _ in range(self.repeat):
+            self.client.force_login(self.user)
+            started = time.perf_counter()
+            self.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+        return Measurement(
+            name=name,
+            url=url,
+            status=response.status_code,
+            queries=queries,
+            time_ms=round(statistics.median(timings), 2),
+            alloc_kb=round(peak / 1024, 1),
+        )
+
+
+def load_baseline(path):
+    with open(path) as fh:
+        return json.load(fh)["results"]
+
+
+def save_baseline(path, results, params=None):
+    data = {
+        "params": params or {},
+        "results": {m.name: {"queries": m.queries, "time_ms": m.time_ms, "alloc_kb": m.alloc_kb} for m in results if not m.skipped},
+    }
+    with open(path, "w") as fh:
+        json.dump(data, fh, indent=2, sort_keys=True)
+        fh.write("\n")
+
+
+def regressions(results, baseline, time_tolerance=0.5, alloc_tolerance=0.25):
+    """Human readable descriptions of every measurement worse than its baseline."""
+    found = []
+    for m in results:
+        base = baseline.get(m.name)
+        if m.skipped or base is None:
+            continue
+        if m.queries > base["queries"]:
+            found.append(f"{m.name}: {m.queries} queries, baseline {base['queries']}")
+        if m.time_ms > base["time_ms"] * (1 + time_tolerance) + TIME_SLACK_MS:
+            found.append(f"{m.name}: {m.time_ms:.1f} ms, baseline {base['time_ms']:.1f} ms")
+        if m.alloc_kb > base["alloc_kb"] * (1 + alloc_tolerance):
+            found.append(f"{m.name}: {m.alloc_kb:.0f} KiB allocated, baseline {base['alloc_kb']:.0f} KiB")
+    return found
+
+
+# Views with an async twin in books.async_urls, compared by ``compare_servers``
+ASYNC_VIEWS = ("books:book-list", "books:detail", "books:toc", "books:section-detail")
+
+
+@dataclass
+class Throughput:
+    name: str
+    server: str
+    requests: int
+    errors: int
+    per_second: float
+    p50_ms: float
+    p95_ms: float
+
+
+def _summary(name, server, latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return Throughput(
+        name=name,
+        server=server,
+        requests=len(latencies),
+        errors=errors,
+        per_second=round(len(latencies) / elapsed, 1),
+        p50_ms=round(latencies[len(latencies) // 2] * 1000, 2),
+        p95_ms=round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000, 2),
+    )
+
+
+def wsgi_throughput(name, path, cookie, requests, concurrency):
+    """Drive the WSGI handler from ``concurrency`` threads, like a threaded server."""
+    from concurrent.futures import ThreadPoolExecutor
+    from io import BytesIO
+
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+
+    def one(_):
+        environ = {
+            "REQUEST_METHOD": "GET", "PATH_INFO": path, "SCRIPT_NAME": "", "QUERY_STRING": "",
+            "SERVER_NAME": "testserver", "SERVER_PORT": "80", "SERVER_PROTOCOL": "HTTP/1.1",
+            "HTTP_HOST": "testserver", "HTTP_COOKIE": cookie,
+            "wsgi.input": BytesIO(), "wsgi.errors": BytesIO(), "wsgi.url_scheme": "http",
+        }
+        status = []
+        started = time.perf_counter()
+        body = application(environ, lambda code, headers, exc_info=None: status.append(code))
+        for _ in body:
+            pass
+        body.close()
+        return time.perf_counter() - started, status[0].startswith("200")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    return _summary(name, "wsgi", [r[0] for r in results], sum(not r[1] for r in results), elapsed)
+
+
+def asgi_throughput(name, path, cookie, requests, concurrency):
+    """Drive the ASGI handler with ``concurrency`` requests in flight on one event loop."""
+    import asyncio
+
+    from django.core.asgi import get_asgi_application
+
+    application = get_asgi_application()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"testserver"), (b"cookie", cookie.encode())],
+        "client": ("127.0.0.1", 0), "server": ("testserver", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def run():
+        gate = asyncio.Semaphore(concurrency)
+
+        async def one():
+            status = []
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    status.append(message["status"])
+
+            async with gate:
+                started = time.perf_counter()
+                await application(dict(scope), receive, send)
+                return time.perf_counter() - started, status[0] == 200
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one() for _ in range(requests)))
+        return results, time.perf_counter() - started
+
+    results, elapsed = asyncio.run(run())
+    return _summary(name, "asgi", [r[0] for r in results], sum(not r[1] for r in results), elapsed)
+
+
+def compare_servers(user, names=ASYNC_VIEWS, requests=500, concurrency=50):
+    """WSGI and ASGI throughput of each named view, requested as ``user``."""
+    from django.conf import settings
+
+    client = Client()
+    client.force_login(user)
+    cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+    arguments = route_arguments(user)
+    results = []
+    for name, pattern in url_patterns():
+        if name not in names:
+            continue
+        path = reverse(name, kwargs={key: arguments[key] for key in pattern.pattern.converters})
+        for measure in (wsgi_throughput, asgi_throughput):
+            measure(name, path, cookie, min(requests, concurrency), concurrency)  # warm up
+            results.append(measure(name, path, cookie, requests, concurrency))
+    return results
+
+
+# table scans in EXPLAIN output: SQLite's "SCAN t" without an index, PostgreSQL's "Seq Scan on t"
+_FULL_SCANS = re.compile(r"\bSCAN (\w+)\b(?! USING (?:COVERING )?INDEX)|Seq Scan on (\w+)")
+
+
+def main_queries(user):
+    """``(name, queryset)`` for the main queries of the book views, as ``user``."""
+    from accounts.lookups import users_with_emails
+    from books.conditional import _book_validators, _dashboard_stats, _memberships
+    from books.exporters import CHUNK_SIZE
+    from books.tree import TableOfContents
+    from books.views import BookListView, get_books
+
+    arguments = route_arguments(user)
+    queries = [
+        ("books:collaborators invite", users_with_emails([user.email or "nobody@example.com"])),
+        ("books:book-list", get_books(user).with_dashboard_stats(user).order_by("-updated_at", "-id")[:BookListView.paginate_by + 1]),
+        ("books:book-list validators", _memberships(user).values("user").annotate(**_dashboard_stats())),
+    ]
+    if "pk" not in arguments:
+        return queries
+    book = Book.objects.get(pk=arguments["pk"])
+    queries += [
+        ("books:detail validators", _book_validators(user, book.pk)),
+        ("books:toc", book.sections.order_by("path").values(*TableOfContents.fields)),
+        ("books:detail collaborators", book.collaborators.only("id", "first_name", "last_name")),
+        ("books:export", book.sections.only("id", "book_id", "title", "content", "depth", "path").filter(
+            pk__in=list(book.sections.values_list("pk", flat=True)[:CHUNK_SIZE])
+        )),
+        ("books:api-book-sections", book.sections.filter(pk__in=list(book.sections.values_list("pk", flat=True)[:100]))),
+    ]
+    if "section_pk" in arguments:
+        queries.append(
+            ("books:section-revisions", SectionRevision.objects.filter(section_id=arguments["section_pk"]).order_by("-number"))
+        )
+    return queries
+
+
+def full_scans(plan):
+    """Tables read in full according to an EXPLAIN ``plan``."""
+    return sorted({a or b for a, b in _FULL_SCANS.findall(plan)})
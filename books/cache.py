@@ -0,0 +1,140 @@
+"""
+Render cache for book fragments with generation based invalidation.
+
+Every book has a generation number in the cache.  Fragment keys embed the
+generation, so bumping it (from the signals in ``books.signals`` whenever a
+book, one of its sections or its collaborators change) orphans every cached
+fragment of that book at once; the orphans simply expire.  The bump waits
+for the write's transaction to commit.
+
+Fragments are shared between all readers of a book.  They may vary by role
+(``variant``) but must never contain per-user data such as CSRF tokens.
+"""
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, "BOOKS_FRAGMENT_CACHE", "default")]
+
+
+def _timeout():
+    return getattr(settings, "BOOKS_FRAGMENT_TIMEOUT", 60 * 60 * 24)
+
+
+def generation_key(book_id):
+    return f"books:gen:{book_id}"
+
+
+def fragment_key(book_id, generation, name, variant=""):
+    return f"books:frag:{book_id}:{generation}:{name}:{variant}"
+
+
+def _fresh_generation():
+    # Seeding from the clock instead of 1 means a generation that was evicted
+    # from the cache never comes back with a number old fragments still use.
+    return time.time_ns() // 1000
+
+
+def get_generation(book_id):
+    cache = get_cache()
+    generation = cache.get(generation_key(book_id))
+    if generation is None:
+        generation = _fresh_generation()
+        if not cache.add(generation_key(book_id), generation, timeout=None):
+            generation = cache.get(generation_key(book_id), generation)
+    return generation
+
+
+async def aget_generation(book_id):
+    cache = get_cache()
+    generation = await cache.aget(generation_key(book_id))
+    if generation is None:
+        generation = _fresh_generation()
+        if not await cache.aadd(generation_key(book_id), generation, timeout=None):
+            generation = await cache.aget(generation_key(book_id), generation)
+    return generation
+
+
+def bump_generation(book_id):
+    """
+    Orphan the cached fragments of a book once the current transaction
+    commits.  Bumping earlier would let a reader cache rows that are not
+    committed yet under the new generation, where they would outlive the
+    write.
+    """
+    transaction.on_commit(lambda: _bump(book_id))
+
+
+def _bump(book_id):
+    cache = get_cache()
+    try:
+        cache.incr(generation_key(book_id))
+    except ValueError:
+        cache.set(generation_key(book_id), _fresh_generation(), timeout=None)
+
+
+def _count(name, outcome):
+    with _stats_lock:
+        _stats[(name, outcome)] += 1
+
+
+def fragment_cache_stats():
+    """Hit and miss counters of this process, as ``{fragment: {"hits": n, "misses": n}}``."""
+    with _stats_lock:
+        snapshot = dict(_stats)
+    stats = {}
+    for (name, outcome), count in snapshot.items():
+        stats.setdefault(name, {"hits": 0, "misses": 0})[outcome] = count
+    return stats
+
+
+def reset_fragment_cache_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+class BookFragments:
+    """The cached fragments of one book, read at a single generation."""
+
+    def __init__(self, book_id, generation=None):
+        self.book_id = book_id
+        self.generation = get_generation(book_id) if generation is None else generation
+
+    @classmethod
+    async def acreate(cls, book_id):
+        return cls(book_id, await aget_generation(book_id))
+
+    def get(self, name, render, variant=""):
+        """Return the cached fragment, calling ``render()`` to build it on a miss."""
+        cache = get_cache()
+        key = fragment_key(self.book_id, self.generation, name, variant)
+        html = cache.get(key)
+        if html is not None:
+            _count(name, "hits")
+            return html
+        _count(name, "misses")
+        html = render()
+        cache.set(key, html, timeout=_timeout())
+        return html
+
+    async def aget(self, name, render, variant=""):
+        """Like ``get()``, awaiting ``render()`` on a miss."""
+        cache = get_cache()
+        key = fragment_key(self.book_id, self.generation, name, variant)
+        html = await cache.aget(key)
+        if html is not None:
+            _count(name, "hits")
+            return html
+        _count(name, "misses")
+        html = await render()
+        await cache.aset(key, html, timeout=_timeout())
+        return html
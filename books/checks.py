@@ -0,0 +1,28 @@
+"""
+Deployment checks (``manage.py check --deploy``) for settings that only work
+within a single server process.
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+from django.core.cache.backends.locmem import LocMemCache
+
+from books.cache import get_cache
+
+
+@register(Tags.caches, deploy=True)
+def fragment_cache_is_shared(app_configs, **kwargs):
+    """
+    Fragment generations live in ``BOOKS_FRAGMENT_CACHE``.  In a per-process
+    cache a change bumps them in one server process only, and the others
+    keep serving the old fragments until they expire.
+    """
+    if not isinstance(get_cache(), LocMemCache):
+        return []
+    return [Warning(
+        f"The book fragment cache {settings.BOOKS_FRAGMENT_CACHE!r} is local to each process.",
+        hint=(
+            "With more than one server process, point BOOKS_FRAGMENT_CACHE (or CACHE_URL) at a shared "
+            "cache such as Redis or Memcached, or pages show stale content for up to BOOKS_FRAGMENT_TIMEOUT."
+        ),
+        id="books.W001",
+    )]
@@ -0,0 +1,88 @@
+"""
+Adding collaborators to a book by email, many at a time.
+
+Emails are matched case-insensitively in one ``IN`` query on
+``LOWER(email)``, which the unique index of
+``accounts/migrations/0001_user_email_ci_unique.py`` serves (see
+``accounts.lookups``).  The new
+``BookCollaborator`` rows go in with one ``bulk_create``; as that skips the
+m2m signals, ``post_add`` is sent by hand so memberships, caches and live
+updates follow as they do for ``book.collaborators.add()``.
+"""
+import re
+from dataclasses import dataclass, field
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import router, transaction
+from django.db.models.signals import m2m_changed
+
+from accounts.lookups import users_with_emails
+from books.models import BookCollaborator
+
+User = get_user_model()
+
+MAX_INVITES = 1000
+
+_SEPARATORS = re.compile(r"[\s,;]+")
+
+
+@dataclass
+class InviteResult:
+    added: list = field(default_factory=list)
+    existing: list = field(default_factory=list)
+    unknown: list = field(default_factory=list)
+    invalid: list = field(default_factory=list)
+
+
+def split_emails(text):
+    """Emails separated by commas, semicolons or whitespace."""
+    return [email for email in _SEPARATORS.split(text) if email]
+
+
+def users_by_email(emails):
+    """``{lowercased email: user}`` for the accounts among ``emails``."""
+    users = users_with_emails(emails).only("id", "email", "username")
+    return {user.email_lower: user for user in users}
+
+
+def invite_collaborators(book, emails):
+    """Add the accounts of ``emails`` to ``book`` and report what became of each email."""
+    result = InviteResult()
+    wanted = {}
+    for email in emails:
+        try:
+            validate_email(email)
+        except ValidationError:
+            result.invalid.append(email)
+        else:
+            wanted.setdefault(email.lower(), email)
+
+    users = users_by_email(wanted)
+    current = set(
+        BookCollaborator.objects.filter(book=book, collaborator__in=[user.pk for user in users.values()])
+        .values_list("collaborator_id", flat=True)
+    )
+    current.add(book.author_id)
+    for key, email in wanted.items():
+        user = users.get(key)
+        if user is None:
+            result.unknown.append(email)
+        elif user.pk in current:
+            result.existing.append(email)
+        else:
+            current.add(user.pk)
+            result.added.append(user)
+
+    if result.added:
+        with transaction.atomic():
+            BookCollaborator.objects.bulk_create(
+                [BookCollaborator(book=book, collaborator=user) for user in result.added],
+                ignore_conflicts=True,
+            )
+            m2m_changed.send(
+                sender=BookCollaborator, instance=book, action="post_add", reverse=False,
+                model=User, pk_set={user.pk for user in result.added}, using=router.db_for_write(BookCollaborator),
+            )
+    return result
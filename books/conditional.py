@@ -0,0 +1,142 @@
+"""
+Conditional GET support for the per-user book pages.
+
+Validators come from ``updated_at`` columns only (never section content):
+the book row, the newest of its sections and the newest of its memberships.
+Deleting a section or a collaborator touches ``Book.updated_at`` (see
+``books.signals``) so removals move the validator forward too, and so do
+trashing and restoring a book (``books.trash``).  The dashboard leaves
+memberships of trashed books out.
+
+The ETag also covers the user, their role and CSRF cookie, because the
+rendered page differs per user, and responses carry ``Vary: Cookie`` so a
+shared cache never serves one user's page to another.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from books.models import Book, BookMembership, Section
+
+
+def _newest(queryset):
+    return Subquery(queryset.order_by().values("book").annotate(newest=Max("updated_at")).values("newest"))
+
+
+def _book_validators(user, book_id):
+    return (
+        Book.objects.for_user(user)
+        .filter(pk=book_id)
+        .annotate(
+            sections_updated=_newest(Section.objects.filter(book=OuterRef("pk"))),
+            members_updated=_newest(BookMembership.objects.filter(book=OuterRef("pk"))),
+        )
+        .values_list("updated_at", "sections_updated", "members_updated")
+    )
+
+
+def _latest(row):
+    if row is None:
+        return None
+    return max(value for value in row if value is not None)
+
+
+def book_last_modified(user, book_id):
+    """The newest ``updated_at`` over a readable book, its sections and memberships."""
+    return _latest(_book_validators(user, book_id).first())
+
+
+async def abook_last_modified(user, book_id):
+    return _latest(await _book_validators(user, book_id).afirst())
+
+
+def _dashboard_stats():
+    return {"books": Count("pk"), "members_updated": Max("updated_at"), "books_updated": Max("book__updated_at")}
+
+
+def _memberships(user):
+    return BookMembership.objects.filter(user=user, book__deleted_at__isnull=True)
+
+
+def _dashboard_result(row):
+    if not row["books"]:
+        return None, 0
+    return max(row["members_updated"], row["books_updated"]), row["books"]
+
+
+def dashboard_last_modified(user):
+    """The newest change across every book the user can read, plus how many there are."""
+    return _dashboard_result(_memberships(user).aggregate(**_dashboard_stats()))
+
+
+async def adashboard_last_modified(user):
+    return _dashboard_result(await _memberships(user).aaggregate(**_dashboard_stats()))
+
+
+def make_etag(request, *parts):
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, "")
+    value = ":".join(str(part) for part in (request.user.pk, csrf_cookie, *parts))
+    return quote_etag(hashlib.md5(value.encode()).hexdigest())
+
+
+class ConditionalGetMixin:
+    """
+    Answer GET and HEAD with 304 Not Modified when the client's validators
+    still match ``get_validators()``, which returns ``(etag, last_modified)``
+    or ``None`` to let the view handle the request as usual.
+    """
+
+    def get_validators(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD") or not request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+        validators = self.get_validators(request, *args, **kwargs)
+        if validators is None:
+            return super().dispatch(request, *args, **kwargs)
+        etag, timestamp = _unpack(validators)
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        return _finish(response, etag, timestamp)
+
+
+class AsyncConditionalGetMixin:
+    """``ConditionalGetMixin`` for async views, with an async ``get_validators()``."""
+
+    async def get_validators(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD") or not request.user.is_authenticated:
+            return await super().dispatch(request, *args, **kwargs)
+        validators = await self.get_validators(request, *args, **kwargs)
+        if validators is None:
+            return await super().dispatch(request, *args, **kwargs)
+        etag, timestamp = _unpack(validators)
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = await super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        return _finish(response, etag, timestamp)
+
+
+def _unpack(validators):
+    etag, last_modified = validators
+    return etag, int(last_modified.timestamp()) if last_modified else None
+
+
+def _finish(response, etag, timestamp):
+    response.headers.setdefault("ETag", etag)
+    if timestamp is not None:
+        response.headers.setdefault("Last-Modified", http_date(timestamp))
+    patch_vary_headers(response, ["Cookie"])
+    patch_cache_control(response, no_cache=True)
+    return response
@@ -0,0 +1,66 @@
+"""
+Compact text deltas.
+
+A delta is a JSON-friendly list of operations applied left to right to the
+old text:
+
+* a positive int keeps that many characters,
+* a negative int deletes that many characters,
+* a string inserts itself.
+
+``[120, -5, "new words", 300]`` keeps 120 characters, drops 5, inserts
+"new words" and keeps the remaining 300.  A delta must consume the whole old
+text, which lets ``apply_delta`` reject one made against a different version.
+"""
+from difflib import SequenceMatcher
+
+
+class DeltaError(ValueError):
+    pass
+
+
+def _push(ops, op):
+    # merge neighbours of the same kind to keep deltas short
+    if ops and type(ops[-1]) is type(op) and (isinstance(op, str) or (ops[-1] > 0) == (op > 0)):
+        ops[-1] += op
+    else:
+        ops.append(op)
+
+
+def make_delta(old, new):
+    """Diff two texts line by line and express the result in character counts."""
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            _push(ops, sum(len(line) for line in old_lines[i1:i2]))
+            continue
+        if i2 > i1:
+            _push(ops, -sum(len(line) for line in old_lines[i1:i2]))
+        if j2 > j1:
+            _push(ops, "".join(new_lines[j1:j2]))
+    return [op for op in ops if op != 0 and op != ""]
+
+
+def apply_delta(old, ops):
+    if not isinstance(ops, list):
+        raise DeltaError("A delta must be a list of operations.")
+    out = []
+    position = 0
+    for op in ops:
+        if isinstance(op, str):
+            out.append(op)
+        elif isinstance(op, int) and not isinstance(op, bool):
+            end = position + abs(op)
+            if end > len(old):
+                raise DeltaError("Delta runs past the end of the text.")
+            if op > 0:
+                out.append(old[position:end])
+            position = end
+        else:
+            raise DeltaError(f"Invalid delta operation: {op!r}")
+    if position != len(old):
+        raise DeltaError("Delta does not cover the whole text.")
+    return "".join(out)
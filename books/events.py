@@ -0,0 +1,170 @@
+"""
+Live book changes for the Server-Sent Events endpoint.
+
+``publish()`` is called from the signals in ``books.signals`` once the
+change has committed and hands the event to the configured backend
+(``BOOKS_EVENTS_BACKEND``).  The backend fans it out to the ``Hub`` of every
+process, which pushes it to the open streams of that book:
+
+* ``LocalBackend`` delivers straight to this process's hub.  It is enough for
+  a single server process and is what the tests use.
+* ``RedisBackend`` publishes on a Redis channel per book, and every process
+  runs one listener feeding its hub.  It needs the ``redis`` package.
+
+Each stream has a bounded queue.  A client too slow to keep up is not allowed
+to hold events in memory: once its queue is full it gets a ``reset`` event,
+telling it to reload, and its stream ends.
+"""
+import asyncio
+import json
+import logging
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+RESET = {"type": "reset"}
+
+
+class Subscriber:
+    """One open stream: a bounded queue living on the event loop that serves it."""
+
+    def __init__(self, book_id, user_id, maxsize):
+        self.book_id = book_id
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def push(self, message):
+        # always runs on self.loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESET)
+
+
+class Hub:
+    """The open streams of this process, by book."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, book_id, user_id, maxsize=None):
+        subscriber = Subscriber(book_id, user_id, maxsize or getattr(settings, "BOOKS_EVENTS_QUEUE_SIZE", 100))
+        with self._lock:
+            self._subscribers.setdefault(book_id, set()).add(subscriber)
+        get_backend().start(self)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.book_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(subscriber.book_id, None)
+
+    def subscriber_count(self, book_id=None):
+        with self._lock:
+            if book_id is not None:
+                return len(self._subscribers.get(book_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def deliver(self, book_id, message):
+        """Push ``message`` to every stream of the book; safe to call from any thread."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(book_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.push, message)
+            except RuntimeError:  # its event loop is gone
+                self.unsubscribe(subscriber)
+
+
+hub = Hub()
+
+
+class LocalBackend:
+    def publish(self, book_id, message):
+        hub.deliver(book_id, message)
+
+    def start(self, hub):
+        pass
+
+
+class RedisBackend:
+    """Fan-out across processes over Redis pub/sub (``BOOKS_EVENTS_REDIS_URL``)."""
+
+    prefix = "books:events:"
+
+    def __init__(self):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("RedisBackend needs the redis package: pip install redis")
+        self.url = getattr(settings, "BOOKS_EVENTS_REDIS_URL", "redis://localhost:6379/0")
+        self.client = redis.Redis.from_url(self.url)
+        self._listeners = {}
+
+    def publish(self, book_id, message):
+        self.client.publish(f"{self.prefix}{book_id}", json.dumps(message))
+
+    def start(self, hub):
+        loop = asyncio.get_running_loop()
+        if loop not in self._listeners or self._listeners[loop].done():
+            self._listeners[loop] = loop.create_task(self.listen(hub))
+
+    async def listen(self, hub):
+        import redis.asyncio
+
+        while True:
+            try:
+                pubsub = redis.asyncio.Redis.from_url(self.url).pubsub()
+                await pubsub.psubscribe(f"{self.prefix}*")
+                async for item in pubsub.listen():
+                    if item["type"] == "pmessage":
+                        book_id = int(item["channel"].decode().rsplit(":", 1)[1])
+                        hub.deliver(book_id, json.loads(item["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lost the Redis event subscription; reconnecting")
+                await asyncio.sleep(1)
+
+
+@lru_cache(maxsize=None)
+def _load_backend(path):
+    return import_string(path)()
+
+
+def get_backend():
+    return _load_backend(getattr(settings, "BOOKS_EVENTS_BACKEND", "books.events.LocalBackend"))
+
+
+def publish(book_id, event_type, **data):
+    """Send an event to the book's streams once the current transaction commits."""
+    message = {"type": event_type, "book": book_id, **data}
+
+    def send():
+        try:
+            get_backend().publish(book_id, message)
+        except Exception:
+            # live updates are best effort; never fail the write that caused them
+            logger.exception("Could not publish %s for book %s", event_type, book_id)
+
+    transaction.on_commit(send)
+
+
+def format_event(message):
+    return f"event: {message['type']}\ndata: {json.dumps(message, default=str)}\n\n"
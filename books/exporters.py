@@ -0,0 +1,164 @@
+"""
+Streaming exporters for whole books.
+
+Each exporter is a generator of ``bytes`` chunks that walks the book's
+sections in table of contents order, reading their content ``CHUNK_SIZE``
+sections at a time, so only that many are held in memory no matter how large
+the manuscript is.  The output can be handed to ``StreamingHttpResponse`` or
+written to a file as it is produced.
+"""
+import io
+import uuid
+import zipfile
+
+from django.utils import timezone
+from django.utils.html import escape, linebreaks
+from django.utils.text import slugify
+
+from books.tree import TableOfContents
+
+CHUNK_SIZE = 100
+
+
+def iter_sections(book, toc=None, chunk_size=CHUNK_SIZE):
+    """The book's sections in reading order, ``toc`` giving the order when already built."""
+    ids = [node.id for node in (toc if toc is not None else TableOfContents.for_book(book))]
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        # book_id is read when the related manager attaches ``book``; deferring it costs a query per row
+        sections = book.sections.only("id", "book_id", "title", "content", "depth", "path").in_bulk(chunk)
+        for pk in chunk:
+            if pk in sections:
+                yield sections[pk]
+
+
+def export_markdown(book):
+    yield f"# {book.name}\n\n".encode()
+    for section in iter_sections(book):
+        level = min(section.depth + 2, 6)
+        yield f"{'#' * level} {section.title}\n\n".encode()
+        if section.content:
+            yield section.content.rstrip().encode() + b"\n\n"
+
+
+def _section_html(section, level):
+    return (
+        f'<section id="section-{section.pk}">\n'
+        f"<h{level}>{escape(section.title)}</h{level}>\n"
+        f"{linebreaks(section.content or '', autoescape=True)}\n"
+        "</section>\n"
+    )
+
+
+def _toc_html(toc, href):
+    parts = []
+    depth = -1
+    for node in toc:
+        if node.depth > depth:
+            parts.append("<ol>" * (node.depth - depth))
+        else:
+            parts.append("</li></ol>" * (depth - node.depth) + "</li>")
+        parts.append(f'<li><a href="{href(node)}">{escape(node.title)}</a>')
+        depth = node.depth
+    parts.append("</li></ol>" * (depth + 1))
+    return "".join(parts)
+
+
+def export_html(book):
+    toc = TableOfContents.for_book(book)
+    yield (
+        "<!DOCTYPE html>\n"
+        '<html lang="en">\n<head>\n<meta charset="utf-8">\n'
+        f"<title>{escape(book.name)}</title>\n</head>\n<body>\n"
+        f"<h1>{escape(book.name)}</h1>\n"
+        f"<nav>{_toc_html(toc, lambda node: f'#section-{node.id}')}</nav>\n"
+    ).encode()
+    for section in iter_sections(book, toc):
+        yield _section_html(section, min(section.depth + 2, 6)).encode()
+    yield b"</body>\n</html>\n"
+
+
+class _ChunkSink(io.RawIOBase):
+    """A write-only, unseekable stream that hands back what was written so far."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _xhtml(title, body):
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+        f"<head><title>{escape(title)}</title></head>\n<body>\n{body}</body>\n</html>\n"
+    )
+
+
+def export_epub(book):
+    toc = TableOfContents.for_book(book)
+    chapter = lambda pk: f"section-{pk}.xhtml"
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        archive.writestr(
+            "META-INF/container.xml",
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>\n'
+            "</container>\n",
+        )
+        manifest = "".join(
+            f'<item id="s{node.id}" href="{chapter(node.id)}" media-type="application/xhtml+xml"/>\n' for node in toc
+        )
+        spine = "".join(f'<itemref idref="s{node.id}"/>\n' for node in toc)
+        modified = timezone.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+        archive.writestr(
+            "OEBPS/content.opf",
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">\n'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+            f'<dc:identifier id="book-id">urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, f"book-writer/books/{book.pk}")}</dc:identifier>\n'
+            f"<dc:title>{escape(book.name)}</dc:title>\n"
+            "<dc:language>en</dc:language>\n"
+            f'<meta property="dcterms:modified">{modified}</meta>\n'
+            "</metadata>\n"
+            '<manifest>\n<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>\n'
+            f"{manifest}</manifest>\n"
+            f"<spine>\n{spine}</spine>\n"
+            "</package>\n",
+        )
+        archive.writestr(
+            "OEBPS/nav.xhtml",
+            _xhtml(book.name, f'<nav epub:type="toc"><h1>{escape(book.name)}</h1>{_toc_html(toc, lambda node: chapter(node.id))}</nav>\n'),
+        )
+        yield sink.drain()
+        for section in iter_sections(book, toc):
+            if section.pk not in toc:
+                # created after the TOC was read; it is not in the spine
+                continue
+            with archive.open(f"OEBPS/{chapter(section.pk)}", "w") as entry:
+                entry.write(_xhtml(section.title, _section_html(section, min(section.depth + 1, 6))).encode())
+            yield sink.drain()
+    yield sink.drain()
+
+
+EXPORTERS = {
+    "md": (export_markdown, "text/markdown; charset=utf-8", "md"),
+    "html": (export_html, "text/html; charset=utf-8", "html"),
+    "epub": (export_epub, "application/epub+zip", "epub"),
+}
+
+
+def export_filename(book, fmt):
+    return f"{slugify(book.name) or f'book-{book.pk}'}.{EXPORTERS[fmt][2]}"
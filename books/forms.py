@@ -2,6 +2,7 @@ from typing import Any, Dict
 from django import forms
 from django.contrib.auth import get_user_model
 
+from books.collaborators import MAX_INVITES, invite_collaborators, split_emails, users_by_email
 from books.models import Book, Section
 
 User = get_user_model()
@@ -17,14 +18,23 @@ class BookForm(forms.ModelForm):
 
 
 class SectionForm(forms.ModelForm):
+    # the version the editor started from, checked when saving (see books.concurrency)
+    version = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
     def __init__(self, book, *args, **kwargs):
         self.book = book
         super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields["version"].initial = self.instance.version
+        parents = Section.objects.filter(book=book).only("id", "title", "book_id").order_by("path")
+        if self.instance.pk and self.instance.path:
+            parents = parents.exclude(path__startswith=self.instance.path)
+        self.fields["parent"].queryset = parents
 
     def clean(self) -> Dict[str, Any]:
         cleaned_data = super().clean()
         parent = cleaned_data.get("parent")
-        if parent and parent.book != self.book:
+        if parent and parent.book_id != self.book.pk:
             raise forms.ValidationError("Parent section is not from this book.")
         return cleaned_data
 
@@ -38,6 +48,40 @@ class SectionForm(forms.ModelForm):
         }
 
 
+class SectionMoveForm(forms.Form):
+    """Where to move a section and its subsections: any book of the user, under any section."""
+    book = forms.ModelChoiceField(queryset=Book.objects.none(), widget=forms.Select(attrs={"class": "form-control"}))
+    parent = forms.ModelChoiceField(
+        queryset=Section.objects.none(),
+        required=False,
+        empty_label="(top level)",
+        widget=forms.Select(attrs={"class": "form-control"}),
+    )
+
+    def __init__(self, section, user, *args, **kwargs):
+        self.section = section
+        super().__init__(*args, **kwargs)
+        self.fields["book"].queryset = user.books.only("id", "name").order_by("name")
+        self.fields["book"].initial = section.book_id
+        self.fields["parent"].queryset = (
+            Section.objects.filter(book__author=user, book__deleted_at__isnull=True)
+            .exclude(path__startswith=section.path)
+            .select_related("book")
+            .only("id", "title", "book__name")
+            .order_by("book__name", "path")
+        )
+        self.fields["parent"].label_from_instance = lambda parent: f"{parent.book.name} / {parent.title}"
+        self.fields["parent"].initial = section.parent_id
+
+    def clean(self):
+        cleaned_data = super().clean()
+        book = cleaned_data.get("book")
+        parent = cleaned_data.get("parent")
+        if book and parent and parent.book_id != book.pk:
+            raise forms.ValidationError("Parent section is not from this book.")
+        return cleaned_data
+
+
 class BaseCollaboratorForm(forms.Form):
     email = forms.EmailField(widget=forms.EmailInput(attrs={"class": "form-control"}))
 
@@ -48,7 +92,7 @@ class BaseCollaboratorForm(forms.Form):
 
     def clean_email(self):
         email = self.cleaned_data["email"]
-        self.user = User.objects.filter(email=email).first()
+        self.user = users_by_email([email]).get(email.lower())
         if not self.user:
             raise forms.ValidationError("User with this email does not exist.")
         return email
@@ -60,13 +104,51 @@ class BaseCollaboratorForm(forms.Form):
         if self.request.user.id != self.book.author_id:
             raise forms.ValidationError("You are not the author of this book.")
 
-        if self.book.collaborators.filter(email=email).exists():
+        if getattr(self, "user", None) and self.book.collaborators.filter(pk=self.user.pk).exists():
             raise forms.ValidationError("User with this email is already a collaborator.")
 
 
-
 class CollaboratorForm(BaseCollaboratorForm):
     def save(self):
         self.book.collaborators.add(self.user)
         self.book.save()
         return self.user
+
+
+class CollaboratorInviteForm(forms.Form):
+    """Many collaborators at once, pasted or uploaded as a text or CSV file."""
+    emails = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={"class": "form-control", "rows": 8}),
+        help_text="Separate emails with commas, semicolons or new lines.",
+    )
+    file = forms.FileField(required=False, widget=forms.FileInput(attrs={"class": "form-control"}))
+
+    def __init__(self, book, request, *args, **kwargs):
+        self.book = book
+        self.request = request
+        super().__init__(*args, **kwargs)
+
+    def clean_file(self):
+        upload = self.cleaned_data.get("file")
+        if not upload:
+            return ""
+        try:
+            return upload.read().decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise forms.ValidationError("Upload a UTF-8 text or CSV file.")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.request.user.id != self.book.author_id:
+            raise forms.ValidationError("You are not the author of this book.")
+        emails = split_emails(cleaned_data.get("emails", "")) + split_emails(cleaned_data.get("file", ""))
+        if not emails:
+            raise forms.ValidationError("Enter or upload at least one email.")
+        if len(emails) > MAX_INVITES:
+            raise forms.ValidationError(f"At most {MAX_INVITES} emails at a time.")
+        cleaned_data["email_list"] = emails
+        return cleaned_data
+
+    def save(self):
+        return invite_collaborators(self.book, self.cleaned_data["email_list"])
@@ -0,0 +1,356 @@
+"""
+Bulk import of manuscripts.
+
+Readers turn a source into a flat stream of ``BookRecord`` and
+``SectionRecord`` items, parents always before their children:
+
+* ``read_markdown(directory)`` makes a book of every ``*.md`` file below the
+  directory.  The ``#`` heading names the book and ``##``, ``###`` ... open
+  sections one level deeper each, which is the layout ``export_markdown``
+  writes.
+* ``read_jsonl(path)`` reads one JSON object per line::
+
+      {"type": "book", "id": "b1", "name": "Dune", "author": "frank"}
+      {"type": "section", "id": "s1", "book": "b1", "parent": null, "title": "Book One", "content": "..."}
+
+``Importer`` writes the stream in batches, one transaction each, with
+``bulk_create``.  Imported ids are kept in memory, so parents resolve without
+a lookup per row, and ``Section.path``, memberships, word counts and the
+search index are filled in per batch because ``bulk_create`` does not send the signals that
+normally maintain them.  After every committed batch the position reached
+and the ids it created are appended to a ``Checkpoint`` file that a later run
+resumes from.
+"""
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from books.models import Book, BookMembership, Section
+from books.search import index_sections
+from books.stats import SECTION_TOTALS, Counts, apply, content_counts, own_counts
+from books.tree import path_ids, segment
+
+BATCH_SIZE = 1000
+
+HEADING = re.compile(r"^(#{1,6})[ \t]+(.*?)(?:[ \t]+#+)?[ \t]*$")
+FENCE = re.compile(r"^[ \t]{0,3}(```|~~~)")
+
+
+class BookImportError(ValueError):
+    pass
+
+
+@dataclass
+class BookRecord:
+    key: str
+    name: str
+    author: str = None
+    origin: str = ""
+
+
+@dataclass
+class SectionRecord:
+    key: str
+    book: str
+    parent: str
+    title: str
+    content: str = ""
+    author: str = None
+    origin: str = ""
+
+
+def _clip(value, model, field):
+    return value[: model._meta.get_field(field).max_length]
+
+
+def parse_markdown(text, key, origin=None):
+    """Records for one Markdown manuscript; headings inside code fences are content."""
+    origin = origin or key
+    book = BookRecord(key=key, name=Path(key).stem, origin=origin)
+    records = [book]
+    stack = []  # (heading level, section record) of the open ancestors
+    lines = []
+    fenced = False
+
+    def close_section():
+        if len(records) > 1:
+            records[-1].content = "\n".join(lines).strip("\n").rstrip()
+        lines.clear()
+
+    for number, line in enumerate(text.splitlines(), start=1):
+        if FENCE.match(line):
+            fenced = not fenced
+        match = None if fenced else HEADING.match(line)
+        if match is None:
+            lines.append(line)
+            continue
+        level, title = len(match.group(1)), match.group(2)
+        if level == 1 and len(records) == 1:
+            book.name = title
+            lines.clear()
+            continue
+        close_section()
+        level = max(level, 2)
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        section = SectionRecord(
+            key=f"{key}#{len(records)}",
+            book=key,
+            parent=stack[-1][1].key if stack else None,
+            title=title,
+            origin=f"{origin}:{number}",
+        )
+        records.append(section)
+        stack.append((level, section))
+    close_section()
+    return records
+
+
+def read_markdown(directory):
+    root = Path(directory)
+    for path in sorted(root.rglob("*.md")):
+        key = path.relative_to(root).as_posix()
+        yield from parse_markdown(path.read_text(encoding="utf-8"), key, origin=key)
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as fh:
+        for number, line in enumerate(fh, start=1):
+            if not line.strip():
+                continue
+            origin = f"{os.path.basename(path)}:{number}"
+            try:
+                data = json.loads(line)
+                kind = data["type"]
+                if kind == "book":
+                    yield BookRecord(key=str(data["id"]), name=data["name"], author=data.get("author"), origin=origin)
+                elif kind == "section":
+                    parent = data.get("parent")
+                    yield SectionRecord(
+                        key=str(data["id"]),
+                        book=str(data["book"]),
+                        parent=None if parent is None else str(parent),
+                        title=data["title"],
+                        content=data.get("content") or "",
+                        author=data.get("author"),
+                        origin=origin,
+                    )
+                else:
+                    raise BookImportError(f"{origin}: unknown record type {kind!r}.")
+            except (ValueError, KeyError, TypeError) as exc:
+                if isinstance(exc, BookImportError):
+                    raise
+                raise BookImportError(f"{origin}: invalid record ({exc}).") from exc
+
+
+class Checkpoint:
+    """
+    Append-only JSON-lines log of committed batches.  A line is only written
+    once its batch committed, so a crash in between makes the resumed run
+    repeat that batch rather than lose it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """Return ``(position, books, sections)`` accumulated over every complete line."""
+        position, books, sections = 0, {}, {}
+        if not os.path.exists(self.path):
+            return position, books, sections
+        with open(self.path, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # torn last line
+                position = entry["position"]
+                books.update(entry["books"])
+                sections.update({key: tuple(value) for key, value in entry["sections"].items()})
+        return position, books, sections
+
+    def append(self, position, books, sections):
+        line = json.dumps({"position": position, "books": books, "sections": sections}, separators=(",", ":"))
+        with open(self.path, "a", encoding="utf-8") as fh:
+            fh.write(line + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Importer:
+    """
+    Writes records in batches.  ``progress(importer)`` is called after every
+    committed batch; ``position`` counts the records consumed so far.
+    """
+
+    def __init__(self, author=None, batch_size=BATCH_SIZE, checkpoint=None, progress=None):
+        self.default_author = author
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.progress = progress
+        self.users = {}
+        self.book_authors = {}  # book id -> author id
+        self.books = {}  # record key -> book id
+        self.sections = {}  # record key -> (section id, book id, path)
+        self.position = 0
+        self.books_created = 0
+        self.sections_created = 0
+        self.started = time.monotonic()
+        if checkpoint is not None:
+            self.position, self.books, self.sections = checkpoint.load()
+        self.resumed_at = self.position
+
+    @property
+    def rows(self):
+        return self.books_created + self.sections_created
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        """Rows written per second by this run."""
+        return self.rows / max(self.elapsed, 1e-6)
+
+    def run(self, records):
+        batch = []
+        for index, record in enumerate(records):
+            if index < self.resumed_at:
+                continue
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+        return self
+
+    def _author_ids(self, records):
+        names = {record.author for record in records if record.author is not None} - self.users.keys()
+        if names:
+            User = get_user_model()
+            self.users.update(User.objects.filter(username__in=names).values_list("username", "pk"))
+        for record in records:
+            if record.author is not None and record.author not in self.users:
+                raise BookImportError(f"{record.origin}: unknown user {record.author!r}.")
+            if isinstance(record, BookRecord) and record.author is None and self.default_author is None:
+                raise BookImportError(f"{record.origin}: no author given and no default author set.")
+
+    def _write(self, batch):
+        book_records = [record for record in batch if isinstance(record, BookRecord)]
+        section_records = [record for record in batch if isinstance(record, SectionRecord)]
+        self._author_ids(batch)
+        new_books, new_sections = {}, {}
+
+        with transaction.atomic():
+            for record in book_records:
+                if record.key in self.books or record.key in new_books:
+                    raise BookImportError(f"{record.origin}: duplicate book id {record.key!r}.")
+                new_books[record.key] = None
+            books = [
+                Book(name=_clip(record.name, Book, "name"), author_id=self._user_id(record.author))
+                for record in book_records
+            ]
+            Book.objects.bulk_create(books)
+            for record, book in zip(book_records, books):
+                if book.pk is None:
+                    raise BookImportError("The database backend does not return ids from bulk inserts.")
+                new_books[record.key] = book.pk
+                self.book_authors[book.pk] = book.author_id
+            BookMembership.objects.bulk_create(
+                [BookMembership(book=book, user_id=book.author_id, role=BookMembership.AUTHOR) for book in books]
+            )
+            self._book_author_ids(section_records, new_books)
+
+            created = []
+            pending = section_records
+            # insert level by level so every parent has an id before its children
+            while pending:
+                wave = [record for record in pending if record.parent is None or self._placed(record.parent, new_sections)]
+                if not wave:
+                    record = pending[0]
+                    raise BookImportError(f"{record.origin}: parent {record.parent!r} was not imported before this section.")
+                sections = [self._section(record, new_books, new_sections) for record in wave]
+                Section.objects.bulk_create(sections)
+                for record, section in zip(wave, sections):
+                    parent_path = self._placed(record.parent, new_sections)[2] if record.parent is not None else ""
+                    section.path = parent_path + segment(section.pk)
+                    section.depth = len(path_ids(section.path)) - 1
+                    new_sections[record.key] = (section.pk, section.book_id, section.path)
+                created.extend(sections)
+                pending = [record for record in pending if record.key not in new_sections]
+
+            # subtree totals of the new sections; those imported earlier get the difference
+            totals, book_totals = defaultdict(Counts), defaultdict(Counts)
+            for section in created:
+                counts = own_counts(section)
+                for pk in path_ids(section.path):
+                    totals[pk] += counts
+                book_totals[section.book_id] += counts
+            for section in created:
+                for name, value in zip(SECTION_TOTALS, totals.pop(section.pk)):
+                    setattr(section, name, value)
+            Section.objects.bulk_update(created, ["path", "depth", *SECTION_TOTALS], batch_size=500)
+            apply(totals, book_totals)
+            index_sections(created)
+
+        self.books.update(new_books)
+        self.sections.update(new_sections)
+        self.position += len(batch)
+        self.books_created += len(new_books)
+        self.sections_created += len(new_sections)
+        if self.checkpoint is not None:
+            self.checkpoint.append(self.position, new_books, new_sections)
+        if self.progress is not None:
+            self.progress(self)
+
+    def _user_id(self, username):
+        return self.default_author.pk if username is None else self.users[username]
+
+    def _book_id(self, key, new_books):
+        return new_books.get(key) or self.books.get(key)
+
+    def _book_author_ids(self, records, new_books):
+        """Sections without an author are credited to their book's author."""
+        missing = {self._book_id(record.book, new_books) for record in records if record.author is None}
+        missing -= self.book_authors.keys()
+        missing.discard(None)
+        if missing:
+            self.book_authors.update(Book.objects.filter(pk__in=missing).values_list("pk", "author_id"))
+
+    def _placed(self, key, new_sections):
+        return new_sections.get(key) or self.sections.get(key)
+
+    def _section(self, record, new_books, new_sections):
+        book_id = self._book_id(record.book, new_books)
+        if book_id is None:
+            raise BookImportError(f"{record.origin}: unknown book {record.book!r}.")
+        if record.key in self.sections or record.key in new_sections:
+            raise BookImportError(f"{record.origin}: duplicate section id {record.key!r}.")
+        parent_id = None
+        if record.parent is not None:
+            parent_id, parent_book_id, _ = self._placed(record.parent, new_sections)
+            if parent_book_id != book_id:
+                raise BookImportError(f"{record.origin}: parent {record.parent!r} belongs to another book.")
+        counts = content_counts(record.content)
+        return Section(
+            book_id=book_id,
+            parent_id=parent_id,
+            title=_clip(record.title, Section, "title"),
+            content=record.content,
+            author_id=self.users[record.author] if record.author is not None else self.book_authors[book_id],
+            word_count=counts.words,
+            char_count=counts.chars,
+        )
@@ -0,0 +1,66 @@
+import os
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from books.benchmark import Benchmark, load_baseline, regressions, save_baseline
+
+
+class Command(BaseCommand):
+    help = (
+        "Time every view of books/urls.py and accounts/urls.py against the current database "
+        "(see seed_benchmark), report query count, median wall time and peak allocation, "
+        "and fail when a view regresses past the stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", default="bench0", help="Username the views are requested as.")
+        parser.add_argument("--repeat", type=int, default=5, help="Timed requests per view.")
+        parser.add_argument("--only", nargs="+", metavar="NAME", help="Only these URL names, e.g. books:detail.")
+        parser.add_argument("--baseline", default=settings.BENCHMARK_BASELINE)
+        parser.add_argument("--save", action="store_true", help="Store these results as the new baseline.")
+        parser.add_argument("--time-tolerance", type=float, default=0.5, help="Allowed relative slowdown.")
+        parser.add_argument("--alloc-tolerance", type=float, default=0.25, help="Allowed relative allocation growth.")
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options["user"])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist; run seed_benchmark first.")
+
+        # the test client needs ALLOWED_HOSTS to accept "testserver"
+        try:
+            setup_test_environment()
+            started_environment = True
+        except RuntimeError:
+            started_environment = False  # already inside the test runner
+        try:
+            results = Benchmark(user, repeat=options["repeat"]).run(only=options["only"])
+        finally:
+            if started_environment:
+                teardown_test_environment()
+
+        self.stdout.write(f"{'view':<34} {'status':>6} {'queries':>8} {'ms':>9} {'KiB':>9}")
+        for m in results:
+            if m.skipped:
+                self.stdout.write(f"{m.name:<34} {'skipped (no GET or no data)':>44}")
+            else:
+                self.stdout.write(f"{m.name:<34} {m.status:>6} {m.queries:>8} {m.time_ms:>9.2f} {m.alloc_kb:>9.1f}")
+
+        baseline_path = str(options["baseline"])
+        if options["save"]:
+            save_baseline(baseline_path, results, params={"user": user.username, "repeat": options["repeat"]})
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline to {baseline_path}."))
+            return
+        if not os.path.exists(baseline_path):
+            self.stdout.write(self.style.WARNING(f"No baseline at {baseline_path}; run with --save to create one."))
+            return
+        found = regressions(
+            results, load_baseline(baseline_path),
+            time_tolerance=options["time_tolerance"], alloc_tolerance=options["alloc_tolerance"],
+        )
+        if found:
+            raise CommandError("Performance regressions:\n" + "\n".join(found))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
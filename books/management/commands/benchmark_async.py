@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from books.benchmark import ASYNC_VIEWS, compare_servers
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the throughput of the sync views under WSGI with their async versions under ASGI "
+        "at high concurrency, driving both handlers in process with the current database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", default="bench0", help="Username the views are requested as.")
+        parser.add_argument("--requests", type=int, default=500, help="Requests per view and server.")
+        parser.add_argument("--concurrency", type=int, default=50, help="Requests in flight at once.")
+        parser.add_argument("--only", nargs="+", metavar="NAME", default=ASYNC_VIEWS)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options["user"])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist; run seed_benchmark first.")
+
+        try:
+            setup_test_environment()
+            started_environment = True
+        except RuntimeError:
+            started_environment = False  # already inside the test runner
+        try:
+            results = compare_servers(
+                user, names=options["only"], requests=max(options["requests"], 1),
+                concurrency=max(options["concurrency"], 1),
+            )
+        finally:
+            if started_environment:
+                teardown_test_environment()
+
+        self.stdout.write(f"{'view':<24} {'server':<6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7}")
+        for r in results:
+            self.stdout.write(
+                f"{r.name:<24} {r.server:<6} {r.per_second:>9.1f} {r.p50_ms:>9.2f} {r.p95_ms:>9.2f} {r.errors:>7}"
+            )
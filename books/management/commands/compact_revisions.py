@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+
+from books.models import SectionRevision
+from books.revisions import rebase
+
+
+class Command(BaseCommand):
+    help = (
+        "Prune section revisions that are both older than --older-than days and "
+        "beyond the --keep most recent ones of their section. The oldest kept "
+        "revision is rebuilt into a snapshot so the remaining history stays complete."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep", type=int, default=50, help="Revisions to always keep per section.")
+        parser.add_argument("--older-than", type=int, default=30, help="Only prune revisions older than this many days.")
+        parser.add_argument("--batch-size", type=int, default=100, help="Sections examined per query.")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        keep = max(options["keep"], 1)
+        cutoff = timezone.now() - timedelta(days=options["older_than"])
+        candidates = (
+            SectionRevision.objects.values("section_id")
+            .annotate(total=Count("pk"), newest=Max("number"), oldest=Min("number"),
+                      first_recent=Min("number", filter=Q(created_at__gte=cutoff)))
+            .filter(total__gt=keep)
+            .order_by("section_id")
+        )
+        pruned = sections = 0
+        last_section_id = 0
+        while True:
+            # one section's chain is rebuilt at a time, so memory stays bounded
+            batch = list(candidates.filter(section_id__gt=last_section_id)[: options["batch_size"]])
+            if not batch:
+                break
+            last_section_id = batch[-1]["section_id"]
+            for row in batch:
+                first_kept = row["newest"] - keep + 1
+                if row["first_recent"] is not None:
+                    first_kept = min(first_kept, row["first_recent"])
+                if first_kept <= row["oldest"]:
+                    continue
+                first_kept = (
+                    SectionRevision.objects.filter(section_id=row["section_id"], number__gte=first_kept)
+                    .aggregate(number=Min("number"))["number"]
+                )
+                doomed = SectionRevision.objects.filter(section_id=row["section_id"], number__lt=first_kept)
+                if options["dry_run"]:
+                    pruned += doomed.count()
+                else:
+                    with transaction.atomic():
+                        rebase(row["section_id"], first_kept)
+                        pruned += doomed.delete()[0]
+                sections += 1
+        verb = "Would prune" if options["dry_run"] else "Pruned"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {pruned} revisions from {sections} sections."))
@@ -0,0 +1,39 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.exporters import EXPORTERS, export_filename
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = "Stream a whole book to a Markdown, HTML or EPUB file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("book_id", type=int)
+        parser.add_argument("--format", choices=sorted(EXPORTERS), default="md")
+        parser.add_argument(
+            "--output",
+            help="File to write to; defaults to the slugified book name. Use '-' for stdout.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            book = Book.objects.get(pk=options["book_id"])
+        except Book.DoesNotExist:
+            raise CommandError(f"Book {options['book_id']} does not exist.")
+        fmt = options["format"]
+        exporter = EXPORTERS[fmt][0]
+        output = options["output"] or export_filename(book, fmt)
+
+        if output == "-":
+            for chunk in exporter(book):
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+        written = 0
+        with open(output, "wb") as fh:
+            for chunk in exporter(book):
+                fh.write(chunk)
+                written += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} bytes to {output}."))
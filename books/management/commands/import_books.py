@@ -0,0 +1,67 @@
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from books.importers import BATCH_SIZE, BookImportError, Checkpoint, Importer, read_jsonl, read_markdown
+
+
+class Command(BaseCommand):
+    help = (
+        "Import books and their sections from a directory of Markdown files (one book per file) "
+        "or a JSON-lines dump, in batched transactions. Progress is checkpointed after every "
+        "batch and an interrupted import resumes where it stopped when run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="A directory of .md files or a .jsonl file.")
+        parser.add_argument("--format", choices=["md", "jsonl"], help="Defaults to md for directories, jsonl otherwise.")
+        parser.add_argument("--author", help="Username credited for records that do not name an author.")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Records written per transaction.")
+        parser.add_argument(
+            "--checkpoint",
+            help="Checkpoint file; defaults to SOURCE.checkpoint. It is removed once the import completes.",
+        )
+        parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start over.")
+
+    def handle(self, *args, **options):
+        source = options["source"]
+        if not os.path.exists(source):
+            raise CommandError(f"{source} does not exist.")
+        fmt = options["format"] or ("md" if os.path.isdir(source) else "jsonl")
+        records = read_markdown(source) if fmt == "md" else read_jsonl(source)
+
+        author = None
+        if options["author"]:
+            try:
+                author = get_user_model().objects.get(username=options["author"])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"User {options['author']} does not exist.")
+
+        checkpoint = Checkpoint(options["checkpoint"] or f"{source.rstrip(os.sep)}.checkpoint")
+        if options["restart"]:
+            checkpoint.clear()
+
+        importer = Importer(
+            author=author,
+            batch_size=max(options["batch_size"], 1),
+            checkpoint=checkpoint,
+            progress=self.report if options["verbosity"] > 0 else None,
+        )
+        if importer.resumed_at:
+            self.stdout.write(f"Resuming after {importer.resumed_at} records from {checkpoint.path}.")
+        try:
+            importer.run(records)
+        except BookImportError as exc:
+            raise CommandError(f"{exc} Imported {importer.position} records so far; run again to resume.")
+        checkpoint.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {importer.books_created} books and {importer.sections_created} sections "
+            f"in {importer.elapsed:.1f}s ({importer.rate:.0f} rows/s)."
+        ))
+
+    def report(self, importer):
+        self.stdout.write(
+            f"{importer.position} records: {importer.books_created} books, "
+            f"{importer.sections_created} sections ({importer.rate:.0f} rows/s)"
+        )
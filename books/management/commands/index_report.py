@@ -0,0 +1,43 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from books.benchmark import full_scans, main_queries
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the EXPLAIN plan of the main query of each book view, run as one user "
+        "against the current database (see seed_benchmark), and flag full table scans."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", default="bench0", help="Username the queries are run as.")
+        parser.add_argument("--only", nargs="+", metavar="NAME", help="Only these queries, e.g. books:toc.")
+        parser.add_argument("--analyze", action="store_true", help="EXPLAIN ANALYZE, where the database supports it.")
+        parser.add_argument("--check", action="store_true", help="Fail when a query reads a whole table.")
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options["user"])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist; run seed_benchmark first.")
+
+        explain_options = {"analyze": True} if options["analyze"] and connection.vendor != "sqlite" else {}
+        scanning = []
+        for name, queryset in main_queries(user):
+            if options["only"] and name not in options["only"]:
+                continue
+            plan = queryset.explain(**explain_options)
+            scans = full_scans(plan)
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(plan)
+            if scans:
+                scanning.append(name)
+                self.stdout.write(self.style.WARNING(f"full scan of {', '.join(scans)}"))
+            self.stdout.write("")
+
+        if scanning and options["check"]:
+            raise CommandError(f"Full table scans in: {', '.join(scanning)}")
+        self.stdout.write(f"{len(scanning)} quer{'y' if len(scanning) == 1 else 'ies'} with full table scans.")
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from books.trash import PURGE_BATCH_SIZE, purge, retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Permanently delete books and sections that have been in the trash longer "
+        "than BOOKS_TRASH_RETENTION_DAYS, in batches of --batch-size rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=PURGE_BATCH_SIZE)
+        parser.add_argument("--older-than", type=int, help="Purge rows trashed more than this many days ago instead.")
+
+    def handle(self, *args, **options):
+        days = options["older_than"]
+        before = timezone.now() - (retention() if days is None else timedelta(days=days))
+        purged = 0
+        while True:
+            count = purge(before, batch_size=options["batch_size"])
+            if not count:
+                break
+            purged += count
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Purged {purged} rows")
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} rows."))
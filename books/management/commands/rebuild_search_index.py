@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from books.models import Section
+from books.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of sections in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--book", type=int, help="Only reindex the sections of this book id.")
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        if backend is None:
+            raise CommandError("The configured database has no supported full-text engine.")
+        batch_size = options["batch_size"]
+        # trashed sections keep their entries until purged, see books.trash
+        sections = Section.all_objects.only("id", "book_id", "title", "content").order_by("pk")
+        if options["book"] is not None:
+            sections = sections.filter(book_id=options["book"])
+
+        backend.create_index()
+        backend.clear(book_id=options["book"])
+        indexed, last_pk = 0, 0
+        while True:
+            # keyset batches keep memory flat and each commit short
+            with transaction.atomic():
+                batch = list(sections.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                backend.index(batch)
+            indexed += len(batch)
+            last_pk = batch[-1].pk
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Indexed {indexed} sections")
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} sections."))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from books.models import Book
+from books.stats import recount_book
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the word, character and section counters of books and "
+        "sections from their content, reading it in chunks, and fix any drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500, help="Section contents read per query.")
+        parser.add_argument("--book", type=int, help="Only recount this book id.")
+
+    def handle(self, *args, **options):
+        books = Book.all_objects.order_by("pk").values_list("pk", flat=True)
+        if options["book"] is not None:
+            books = books.filter(pk=options["book"])
+        fixed = 0
+        for book_id in books.iterator():
+            # one book per transaction, so its totals never mix old and new counts
+            with transaction.atomic():
+                changed = recount_book(book_id, chunk_size=options["chunk_size"])
+            fixed += changed
+            if changed and options["verbosity"] > 1:
+                self.stdout.write(f"Book {book_id}: fixed {changed} rows")
+        self.stdout.write(self.style.SUCCESS(f"Fixed {fixed} rows."))
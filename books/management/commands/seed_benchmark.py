@@ -0,0 +1,134 @@
+import random
+import re
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat
+
+from books.importers import BookRecord, Importer, SectionRecord
+from books.models import Book, BookCollaborator
+from books.revisions import record_revision
+from books.signals import add_collaborator_memberships
+
+WORDS = (
+    "the a of and to in was he that it his her with as had for she on at but be by you which from not "
+    "castle river winter letter garden window silence morning stranger promise shadow journey lantern "
+    "harbour mirror orchard thunder whisper ember voyage meadow archive compass frontier"
+).split()
+
+
+def seeded_users(prefix):
+    """
+    The users this command created with ``prefix``: named ``prefix`` and a
+    number, with that name at example.com as email.  ``--flush`` deletes only
+    these, never other accounts that merely share the prefix.
+    """
+    return get_user_model().objects.filter(
+        username__regex=rf"^{re.escape(prefix)}[0-9]+$",
+        email=Concat(F("username"), Value("@example.com")),
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate users, books, collaborators and deep, wide section trees for benchmarking. "
+        "Every book gets WIDTH top-level sections, each with WIDTH subsections, down to DEPTH levels. "
+        "Users are named PREFIX0, PREFIX1, ... and share the password PREFIX."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--books", type=int, default=10, help="Books per user.")
+        parser.add_argument("--collaborators", type=int, default=3, help="Collaborators per book.")
+        parser.add_argument("--depth", type=int, default=3)
+        parser.add_argument("--width", type=int, default=5)
+        parser.add_argument("--words", type=int, default=200, help="Words of content per section.")
+        parser.add_argument("--revisions", type=int, default=10, help="Revisions recorded on one section per book.")
+        parser.add_argument("--prefix", default="bench")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--flush", action="store_true", help="Delete the users this command seeded with --prefix before, and their books, first.")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        prefix = options["prefix"]
+        rng = random.Random(options["seed"])
+        existing = seeded_users(prefix)
+        usernames = [f"{prefix}{i}" for i in range(options["users"])]
+        taken = list(
+            User.objects.filter(username__in=usernames).exclude(pk__in=existing).values_list("username", flat=True)[:5]
+        )
+        if taken:
+            raise CommandError(f"Accounts not created by this command use these names: {', '.join(taken)}; use another --prefix.")
+        if options["flush"]:
+            existing.delete()
+        elif existing.exists():
+            raise CommandError(f"Users seeded with prefix {prefix!r} already exist; use --flush or another --prefix.")
+
+        password = make_password(prefix)  # hashed once for every user
+        users = User.objects.bulk_create([
+            User(username=username, email=f"{username}@example.com", password=password) for username in usernames
+        ])
+        if users and users[0].pk is None:
+            users = list(seeded_users(prefix).order_by("pk"))
+        users_by_pk = {user.pk: user for user in users}
+
+        importer = Importer(progress=self.report if options["verbosity"] > 1 else None)
+        importer.run(self.records(users, options, rng))
+
+        books = list(Book.objects.filter(author__in=users).values_list("pk", "author_id"))
+        pairs = []
+        for book_id, author_id in books:
+            others = [user.pk for user in users if user.pk != author_id]
+            pairs.extend((book_id, user_id) for user_id in rng.sample(others, min(options["collaborators"], len(others))))
+        with transaction.atomic():
+            BookCollaborator.objects.bulk_create(
+                [BookCollaborator(book_id=book_id, collaborator_id=user_id) for book_id, user_id in pairs]
+            )
+            add_collaborator_memberships(pairs)
+
+        revisions = 0
+        for book_id, author_id in books:
+            section = Book.objects.get(pk=book_id).sections.order_by("path").first()
+            for _ in range(options["revisions"] if section else 0):
+                previous = section.content
+                section.content = self.paragraph(rng, options["words"])
+                section.save(update_fields=["content", "updated_at"])
+                record_revision(section, author=users_by_pk[author_id], previous_content=previous)
+                revisions += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {len(books)} books, "
+            f"{importer.sections_created} sections, {len(pairs)} collaborators and {revisions} revisions "
+            f"in {importer.elapsed:.1f}s."
+        ))
+
+    def paragraph(self, rng, words):
+        return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+    def records(self, users, options, rng):
+        for user in users:
+            for b in range(options["books"]):
+                book_key = f"{user.username}/{b}"
+                yield BookRecord(key=book_key, name=self.paragraph(rng, 3)[:-1].title(), author=user.username)
+                yield from self.subtree(book_key, None, 1, options, rng, user)
+
+    def subtree(self, book_key, parent_key, level, options, rng, user):
+        if level > options["depth"]:
+            return
+        for i in range(options["width"]):
+            key = f"{parent_key or book_key}.{i}"
+            yield SectionRecord(
+                key=key,
+                book=book_key,
+                parent=parent_key,
+                title=self.paragraph(rng, 4)[:-1],
+                content=self.paragraph(rng, options["words"]),
+                author=user.username,
+            )
+            yield from self.subtree(book_key, key, level + 1, options, rng, user)
+
+    def report(self, importer):
+        self.stdout.write(f"{importer.books_created} books, {importer.sections_created} sections")
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_memberships(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    BookCollaborator = apps.get_model('books', 'BookCollaborator')
+    BookMembership = apps.get_model('books', 'BookMembership')
+    BookMembership.objects.bulk_create(
+        (BookMembership(book_id=book_id, user_id=author_id, role='author')
+         for book_id, author_id in Book.objects.values_list('id', 'author_id').iterator()),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    BookMembership.objects.bulk_create(
+        (BookMembership(book_id=book_id, user_id=user_id, role='collaborator')
+         for book_id, user_id in BookCollaborator.objects.values_list('book_id', 'collaborator_id').iterator()),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0003_rename_name_section_title_section_content_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='collaborators',
+            field=models.ManyToManyField(related_name='contributed_books', through='books.BookCollaborator', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='BookMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('author', 'Author'), ('collaborator', 'Collaborator')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='books.book')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='book_memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='bookmembership',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='books_membership_user_book_uniq'),
+        ),
+        migrations.RunPython(backfill_memberships, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:18
+
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    Section = apps.get_model('books', 'Section')
+    parents = dict(Section.objects.values_list('id', 'parent_id').iterator())
+    paths = {}
+
+    def path_of(pk):
+        # walk up iteratively so deep trees do not hit the recursion limit
+        chain = []
+        while pk is not None and pk not in paths:
+            chain.append(pk)
+            pk = parents.get(pk)
+        prefix = paths.get(pk, '')
+        for node in reversed(chain):
+            prefix = paths[node] = prefix + f'{node:010d}/'
+        return prefix
+
+    batch = []
+    for pk in parents:
+        path = path_of(pk)
+        batch.append(Section(id=pk, path=path, depth=path.count('/') - 1))
+        if len(batch) >= 1000:
+            Section.objects.bulk_update(batch, ['path', 'depth'])
+            batch = []
+    Section.objects.bulk_update(batch, ['path', 'depth'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_membership'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='section',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=1000),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
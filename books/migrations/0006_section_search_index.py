@@ -0,0 +1,46 @@
+from django.db import migrations
+
+# The DDL is spelled out here rather than taken from books.search, so the
+# migration keeps creating the same schema however that module changes.
+CREATE_SQL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS books_section_fts USING fts5("
+        "title, content, book_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')",
+        "INSERT INTO books_section_fts (rowid, title, content, book_id) "
+        "SELECT id, title, COALESCE(content, ''), book_id FROM books_section",
+    ],
+    'postgresql': [
+        "CREATE TABLE IF NOT EXISTS books_section_search ("
+        "section_id bigint PRIMARY KEY REFERENCES books_section (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+        "book_id bigint NOT NULL, "
+        "document tsvector NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS books_section_search_document_gin ON books_section_search USING GIN (document)",
+        "CREATE INDEX IF NOT EXISTS books_section_search_book_id ON books_section_search (book_id)",
+        "INSERT INTO books_section_search (section_id, book_id, document) "
+        "SELECT id, book_id, setweight(to_tsvector('simple', title), 'A') "
+        "|| setweight(to_tsvector('simple', COALESCE(content, '')), 'B') FROM books_section",
+    ],
+}
+
+DROP_SQL = {
+    'sqlite': ["DROP TABLE IF EXISTS books_section_fts"],
+    'postgresql': ["DROP TABLE IF EXISTS books_section_search"],
+}
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_section_path'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE_SQL), run(DROP_SQL)),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0006_section_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SectionRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('base', models.PositiveIntegerField()),
+                ('title', models.CharField(max_length=100)),
+                ('snapshot', models.TextField(blank=True, null=True)),
+                ('delta', models.JSONField(blank=True, null=True)),
+                ('length', models.PositiveIntegerField(default=0)),
+                ('checksum', models.CharField(max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('section', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='books.section')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='sectionrevision',
+            constraint=models.UniqueConstraint(fields=('section', 'number'), name='books_revision_section_number_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_section_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
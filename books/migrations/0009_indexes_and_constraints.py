@@ -0,0 +1,49 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:59
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def dedupe_collaborators(apps, schema_editor):
+    """Keep the oldest row of every (book, collaborator) pair before it becomes unique."""
+    BookCollaborator = apps.get_model('books', 'BookCollaborator')
+    duplicates = (
+        BookCollaborator.objects.values('book_id', 'collaborator_id')
+        .annotate(rows=Count('id'), keep=Min('id'))
+        .filter(rows__gt=1)
+    )
+    for pair in list(duplicates):
+        BookCollaborator.objects.filter(
+            book_id=pair['book_id'], collaborator_id=pair['collaborator_id'],
+        ).exclude(id=pair['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_section_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_collaborators, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-updated_at', '-id'], name='books_book_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookmembership',
+            index=models.Index(fields=['book', 'updated_at'], name='books_memb_book_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='section',
+            index=models.Index(fields=['book', 'path'], name='books_sect_book_path_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='section',
+            index=models.Index(fields=['book', 'updated_at'], name='books_sect_book_updated_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookcollaborator',
+            constraint=models.UniqueConstraint(fields=('book', 'collaborator'), name='books_collaborator_book_user_uniq'),
+        ),
+    ]
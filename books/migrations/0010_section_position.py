@@ -0,0 +1,22 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_indexes_and_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='position',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='section',
+            index=models.Index(fields=['book', 'parent', 'position'], name='books_sect_siblings_idx'),
+        ),
+    ]
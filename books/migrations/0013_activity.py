@@ -0,0 +1,32 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0012_stat_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Activity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('verb', models.CharField(choices=[('book.created', 'created the book'), ('book.cloned', 'copied the book from'), ('book.deleted', 'deleted the book'), ('book.restored', 'restored the book'), ('section.created', 'added'), ('section.updated', 'edited'), ('section.moved', 'moved'), ('section.deleted', 'deleted'), ('section.restored', 'restored'), ('collaborator.added', 'added collaborator'), ('collaborator.removed', 'removed collaborator')], max_length=30)),
+                ('section_id', models.BigIntegerField(blank=True, null=True)),
+                ('subject', models.CharField(blank=True, default='', max_length=150)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activities', to='books.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['book', '-created_at', '-id'], name='books_activity_feed_idx')],
+            },
+        ),
+    ]
@@ -1,5 +1,17 @@
+import math
+
 from django.db import models
+from django.db.models import Case, Count, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.utils import timezone
+
+# average silent reading speed, for reading time estimates
+WORDS_PER_MINUTE = 200
+
+
+def reading_minutes(words):
+    return math.ceil(words / WORDS_PER_MINUTE) if words > 0 else 0
 
 
 class BookCollaborator(models.Model):
@@ -8,6 +20,40 @@ class BookCollaborator(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["book", "collaborator"], name="books_collaborator_book_user_uniq"),
+        ]
+
+
+def _count_subquery(queryset):
+    counted = queryset.order_by().values("book").annotate(count=Count("pk")).values("count")
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+class LiveManager(models.Manager):
+    """Leaves out rows in the trash; ``all_objects`` still has them (see ``books.trash``)."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class BookQuerySet(models.QuerySet):
+    def for_user(self, user):
+        """Books the user wrote or collaborates on, via the membership index."""
+        return self.filter(memberships__user=user)
+
+    def with_dashboard_stats(self, user):
+        """Annotate counts and the user's role so the dashboard needs a single query."""
+        return self.annotate(
+            collaborator_count=_count_subquery(BookCollaborator.objects.filter(book=OuterRef("pk"))),
+            role=Case(
+                When(author=user, then=Value("author")),
+                default=Value("collaborator"),
+                output_field=models.CharField(),
+            ),
+        )
+
 
 class Book(models.Model):
     name = models.CharField(max_length=100)
@@ -15,10 +61,28 @@ class Book(models.Model):
     collaborators = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name="contributed_books", through=BookCollaborator)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    deleted_at = models.DateTimeField(blank=True, null=True, editable=False, db_index=True)
+    # totals of the live sections, see books.stats
+    word_count = models.IntegerField(editable=False, default=0)
+    char_count = models.IntegerField(editable=False, default=0)
+    section_count = models.IntegerField(editable=False, default=0)
+
+    objects = LiveManager.from_queryset(BookQuerySet)()
+    all_objects = BookQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # the dashboard's default "recently updated" order
+            models.Index(fields=["-updated_at", "-id"], name="books_book_updated_idx"),
+        ]
 
     def __str__(self):
         return self.name
 
+    @property
+    def reading_minutes(self):
+        return reading_minutes(self.word_count)
+
 
 class Section(models.Model):
     title = models.CharField(max_length=100)
@@ -26,9 +90,145 @@ class Section(models.Model):
     parent = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True, related_name="subsections")
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="sections")
     content = models.TextField(blank=True, null=True)
+    path = models.CharField(max_length=1000, db_index=True, editable=False, default="")
+    depth = models.PositiveIntegerField(editable=False, default=0)
+    version = models.PositiveIntegerField(editable=False, default=1)
+    # order among siblings, see books.ordering
+    position = models.CharField(max_length=64, editable=False, blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    deleted_at = models.DateTimeField(blank=True, null=True, editable=False, db_index=True)
+    # of the content, and totals of the subtree including this section, see books.stats
+    word_count = models.IntegerField(editable=False, default=0)
+    char_count = models.IntegerField(editable=False, default=0)
+    subtree_word_count = models.IntegerField(editable=False, default=0)
+    subtree_char_count = models.IntegerField(editable=False, default=0)
+    subtree_section_count = models.IntegerField(editable=False, default=0)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # a book's sections grouped by subtree (toc, export, API listing)
+            models.Index(fields=["book", "path"], name="books_sect_book_path_idx"),
+            # the neighbours of a moved section and the last sibling of a new one
+            models.Index(fields=["book", "parent", "position"], name="books_sect_siblings_idx"),
+            # the newest change in a book, for conditional GETs
+            models.Index(fields=["book", "updated_at"], name="books_sect_book_updated_idx"),
+        ]
 
     def __str__(self):
         return self.title
 
+    @property
+    def reading_minutes(self):
+        return reading_minutes(self.subtree_word_count)
+
+
+
+class BookMembership(models.Model):
+    """
+    Denormalized index of who can read a book, maintained by the signals in
+    ``books.signals`` from ``Book.author`` and ``BookCollaborator`` rows.
+    """
+    AUTHOR = "author"
+    COLLABORATOR = "collaborator"
+    ROLE_CHOICES = [
+        (AUTHOR, "Author"),
+        (COLLABORATOR, "Collaborator"),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="book_memberships")
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="memberships")
+    role = models.CharField(max_length=20, choices=ROLE_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "book"], name="books_membership_user_book_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["book", "updated_at"], name="books_memb_book_updated_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user} ({self.role}) in {self.book}"
+
+
+class SectionRevision(models.Model):
+    """
+    One saved version of a section's content.  Every few revisions are full
+    snapshots; the rest store a delta (see ``books.diff``) against the
+    previous revision, and ``base`` is the number of the snapshot the chain
+    starts from.
+    """
+    section = models.ForeignKey(Section, on_delete=models.CASCADE, related_name="revisions")
+    number = models.PositiveIntegerField()
+    base = models.PositiveIntegerField()
+    title = models.CharField(max_length=100)
+    snapshot = models.TextField(blank=True, null=True)
+    delta = models.JSONField(blank=True, null=True)
+    length = models.PositiveIntegerField(default=0)
+    checksum = models.CharField(max_length=32)
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True, related_name="+")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["section", "number"], name="books_revision_section_number_uniq"),
+        ]
+
+    @property
+    def is_snapshot(self):
+        return self.base == self.number
+
+    def __str__(self):
+        return f"{self.title} r{self.number}"
+
+
+class Activity(models.Model):
+    """One entry of a book's activity feed, written in batches by ``books.activity``."""
+    BOOK_CREATED = "book.created"
+    BOOK_CLONED = "book.cloned"
+    BOOK_DELETED = "book.deleted"
+    BOOK_RESTORED = "book.restored"
+    SECTION_CREATED = "section.created"
+    SECTION_UPDATED = "section.updated"
+    SECTION_MOVED = "section.moved"
+    SECTION_DELETED = "section.deleted"
+    SECTION_RESTORED = "section.restored"
+    COLLABORATOR_ADDED = "collaborator.added"
+    COLLABORATOR_REMOVED = "collaborator.removed"
+    VERB_CHOICES = [
+        (BOOK_CREATED, "created the book"),
+        (BOOK_CLONED, "copied the book from"),
+        (BOOK_DELETED, "deleted the book"),
+        (BOOK_RESTORED, "restored the book"),
+        (SECTION_CREATED, "added"),
+        (SECTION_UPDATED, "edited"),
+        (SECTION_MOVED, "moved"),
+        (SECTION_DELETED, "deleted"),
+        (SECTION_RESTORED, "restored"),
+        (COLLABORATOR_ADDED, "added collaborator"),
+        (COLLABORATOR_REMOVED, "removed collaborator"),
+    ]
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="activities")
+    actor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True, related_name="+")
+    verb = models.CharField(max_length=30, choices=VERB_CHOICES)
+    # not a foreign key: the entry outlives the section
+    section_id = models.BigIntegerField(blank=True, null=True)
+    # the section title or username at the time, for display
+    subject = models.CharField(max_length=150, blank=True, default="")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # the feed of a book, newest first
+            models.Index(fields=["book", "-created_at", "-id"], name="books_activity_feed_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.actor} {self.get_verb_display()} {self.subject}".strip()
@@ -0,0 +1,157 @@
+"""
+Order of sibling sections.
+
+``Section.position`` is a rank: a string over ``DIGITS`` compared as plain
+text, so a key can always be made between two neighbours and moving a
+section rewrites that one row.  Siblings sort by ``(position, id)``; an
+empty position sorts first and falls back to creation order, which is what
+sections created before ranks existed, or in bulk by the importer, have.
+
+Keys between close neighbours get longer.  Once a move produces a key
+longer than ``MAX_RANK_LENGTH`` the siblings are re-spaced by the
+``books.rebalance_positions`` job.  A sibling group holding unranked or
+equal keys is ranked on the spot the first time a section is moved into it.
+"""
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from books.events import publish
+from books.models import Section
+from books.tree import TreeError, check_parent, place_section
+from jobs.queue import enqueue
+
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+MAX_RANK_LENGTH = 8
+REBALANCE_JOB = "books.rebalance_positions"
+
+
+def rank_between(before, after):
+    """A key sorting strictly between ``before`` and ``after``; ``""`` is an open end."""
+    if after and before >= after:
+        raise ValueError(f"No rank between {before!r} and {after!r}.")
+    rank = ""
+    index = 0
+    bounded = bool(after)
+    while True:
+        low = DIGITS.index(before[index]) if index < len(before) else 0
+        high = DIGITS.index(after[index]) if bounded and index < len(after) else len(DIGITS)
+        if high - low > 1:
+            return rank + DIGITS[(low + high) // 2]
+        rank += DIGITS[low]
+        if low < high:
+            # rank is now below ``after`` whatever follows
+            bounded = False
+        index += 1
+
+
+def spaced_ranks(count):
+    """``count`` increasing keys, evenly spread and of equal length."""
+    width = 1
+    while len(DIGITS) ** width <= count:
+        width += 1
+    step = len(DIGITS) ** width / (count + 1)
+    ranks = []
+    for number in range(1, count + 1):
+        value = int(number * step)
+        digits = ""
+        for _ in range(width):
+            value, digit = divmod(value, len(DIGITS))
+            digits = DIGITS[digit] + digits
+        # trailing zeros sort like nothing, and keys ending in one leave no room before them
+        ranks.append(digits.rstrip("0"))
+    return ranks
+
+
+def siblings(book_id, parent_id):
+    return Section.objects.filter(book_id=book_id, parent_id=parent_id)
+
+
+def last_position(book_id, parent_id, exclude=None):
+    """The key for a section appended after its siblings."""
+    queryset = siblings(book_id, parent_id)
+    if exclude is not None:
+        queryset = queryset.exclude(pk=exclude)
+    last = queryset.aggregate(last=Max("position"))["last"]
+    if last == "":
+        # unranked siblings keep creation order, which puts a new section last already
+        return ""
+    return rank_between(last or "", "")
+
+
+def rebalance(book_id, parent_id):
+    """Give the siblings evenly spaced keys, keeping their order."""
+    with transaction.atomic():
+        rows = sorted(
+            siblings(book_id, parent_id).select_for_update().only("id", "position"),
+            key=lambda section: (section.position, section.pk),
+        )
+        for section, rank in zip(rows, spaced_ranks(len(rows))):
+            section.position = rank
+        Section.objects.bulk_update(rows, ["position"], batch_size=500)
+    return len(rows)
+
+
+def _neighbours(book_id, parent_id, after_id, moving_id):
+    """
+    The keys around the slot following ``after_id`` (``None``: the first
+    slot); the second is ``None`` when the slot is last.
+    """
+    group = siblings(book_id, parent_id).exclude(pk=moving_id)
+    if after_id is None:
+        before = ""
+    else:
+        anchor = group.filter(pk=after_id).values_list("position", flat=True).first()
+        if anchor is None:
+            raise TreeError(f"Section {after_id} is not a sibling there.")
+        before = anchor
+        group = group.filter(position__gte=before).exclude(position=before, id__lte=after_id)
+    after = group.order_by("position", "id").values_list("position", flat=True).first()
+    return before, after
+
+
+def move_section(section, parent_id, after_id=None):
+    """
+    Put ``section`` under ``parent_id`` right after its sibling ``after_id``
+    (first when ``None``).  Only the moved row is written, unless its new
+    sibling group first needs ranking.  The caller invalidates the book's
+    caches, see ``reorder_sections``.
+    """
+    before, after = _neighbours(section.book_id, parent_id, after_id, section.pk)
+    if (after_id is not None and not before) or (after is not None and after <= before):
+        # unranked or tied neighbours leave no key in between
+        rebalance(section.book_id, parent_id)
+        before, after = _neighbours(section.book_id, parent_id, after_id, section.pk)
+    position = rank_between(before, after or "")
+
+    # earlier moves in the same batch may have re-rooted it
+    section.refresh_from_db(fields=["path", "depth"])
+    section.parent_id = parent_id
+    check_parent(section)
+    now = timezone.now()
+    with transaction.atomic():
+        Section.objects.filter(pk=section.pk).update(
+            parent_id=parent_id, position=position, version=F("version") + 1, updated_at=now,
+        )
+        section.position = position
+        section.version += 1
+        section.updated_at = now
+        place_section(section, keep_position=True)
+        if len(position) > MAX_RANK_LENGTH:
+            enqueue(REBALANCE_JOB, {"book": section.book_id, "parent": parent_id})
+    publish(section.book_id, "section.moved", id=section.pk, parent=parent_id, position=position, version=section.version)
+    return section
+
+
+def reorder_sections(book, moves):
+    """
+    Apply ``[(section, parent_id, after_id), ...]`` in order, in one
+    transaction; each move sees the ones before it.
+    """
+    from books.signals import book_changed
+
+    with transaction.atomic():
+        for section, parent_id, after_id in moves:
+            move_section(section, parent_id, after_id)
+        if moves:
+            book_changed(book.pk)
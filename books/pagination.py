@@ -0,0 +1,156 @@
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset on ``(ordering field, pk)`` instead of OFFSET, so
+    every page costs the same no matter how deep the user has scrolled.
+
+    Cursors are opaque strings encoding the sort value and primary key of
+    the row at the page boundary plus the direction to read in.
+    """
+
+    def __init__(self, queryset, ordering, per_page=25):
+        self.queryset = queryset
+        self.descending = ordering.startswith("-")
+        self.field_name = ordering.lstrip("-")
+        self.per_page = per_page
+        try:
+            self.field = queryset.model._meta.get_field(self.field_name)
+        except FieldDoesNotExist:
+            self.field = None
+
+    def encode_cursor(self, obj, direction):
+        value = getattr(obj, self.field_name)
+        if hasattr(value, "isoformat"):
+            value = value.isoformat()
+        payload = json.dumps([direction, value, obj.pk], separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            direction, value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if self.field is not None:
+                value = self.field.to_python(value)
+            pk = self.queryset.model._meta.pk.to_python(pk)
+        except Exception as exc:
+            raise InvalidCursor(cursor) from exc
+        if direction not in ("n", "p") or value is None or pk is None:
+            raise InvalidCursor(cursor)
+        return direction, value, pk
+
+    def _ordering(self, reverse=False):
+        descending = self.descending != reverse
+        prefix = "-" if descending else ""
+        return [f"{prefix}{self.field_name}", f"{prefix}pk"]
+
+    def _after(self, value, pk, reverse=False):
+        lookup = "lt" if self.descending != reverse else "gt"
+        return Q(**{f"{self.field_name}__{lookup}": value}) | Q(
+            **{self.field_name: value, f"pk__{lookup}": pk}
+        )
+
+    def _page_queryset(self, cursor):
+        direction = "n"
+        queryset = self.queryset
+        if cursor:
+            direction, value, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(self._after(value, pk, reverse=direction == "p"))
+        queryset = queryset.order_by(*self._ordering(reverse=direction == "p"))
+        return queryset[: self.per_page + 1], direction
+
+    def _make_page(self, rows, direction, cursor):
+        has_more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        if direction == "p":
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(cursor)
+        next_cursor = self.encode_cursor(rows[-1], "n") if rows and has_next else None
+        previous_cursor = self.encode_cursor(rows[0], "p") if rows and has_previous else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    def page(self, cursor=None):
+        queryset, direction = self._page_queryset(cursor)
+        return self._make_page(list(queryset), direction, cursor)
+
+    async def apage(self, cursor=None):
+        queryset, direction = self._page_queryset(cursor)
+        return self._make_page([row async for row in queryset], direction, cursor)
+
+
+class ListPaginator:
+    """
+    Paginate an ordered list of primary keys, for orders no column holds
+    (the reading order of a book's sections).  Cursors name the pk at the
+    page boundary, so pages stay put when rows are added before them; a
+    cursor whose row is gone is invalid.  ``pk_field`` converts the pk read
+    from a cursor.
+    """
+
+    def __init__(self, pks, per_page=25, pk_field=None):
+        self.pks = list(pks)
+        self.index = {pk: index for index, pk in enumerate(self.pks)}
+        self.per_page = per_page
+        self.pk_field = pk_field
+
+    def encode_cursor(self, pk, direction):
+        payload = json.dumps([direction, pk], separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            direction, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if self.pk_field is not None:
+                pk = self.pk_field.to_python(pk)
+            index = self.index[pk]
+        except Exception as exc:
+            raise InvalidCursor(cursor) from exc
+        if direction not in ("n", "p"):
+            raise InvalidCursor(cursor)
+        return direction, index
+
+    def page(self, cursor=None):
+        start = 0
+        if cursor:
+            direction, index = self.decode_cursor(cursor)
+            start = index + 1 if direction == "n" else max(index - self.per_page, 0)
+        pks = self.pks[start:start + self.per_page]
+        has_next = start + self.per_page < len(self.pks)
+        next_cursor = self.encode_cursor(pks[-1], "n") if pks and has_next else None
+        previous_cursor = self.encode_cursor(pks[0], "p") if pks and start > 0 else None
+        return KeysetPage(pks, next_cursor, previous_cursor)
@@ -0,0 +1,113 @@
+"""
+Whole-tree operations: moving a section with its subtree, possibly to
+another book, and cloning a book.
+
+Both read the affected rows once, work out parents, paths and depths in
+memory and write them back with ``bulk_create``/``bulk_update``, so the
+number of queries depends on the batch size, not on the size of the tree.
+Everything runs in one transaction.  Bulk writes skip the model signals,
+so the search index, word counts, caches and live updates are refreshed
+here.
+"""
+from django.db import transaction
+
+from books.events import publish
+from books.models import Book, Section
+from books.ordering import last_position
+from books.search import index_sections
+from books.stats import BOOK_TOTALS, SECTION_TOTALS, ZERO, move_totals, own_counts, subtree_counts
+from books.tree import TreeError, check_depth, path_ids, segment
+
+BATCH_SIZE = 1000
+
+_FIELDS = (
+    "id", "book_id", "parent_id", "author_id", "title", "content", "path", "depth", "position", "version",
+    "word_count", "char_count", *SECTION_TOTALS,
+)
+
+
+def move_subtree(section, book, parent_id=None):
+    """
+    Move ``section`` and everything under it below ``parent_id`` of ``book``
+    (top level when ``None``), after the sections already there.
+    """
+    from books.signals import book_changed
+
+    with transaction.atomic():
+        section.refresh_from_db(fields=["book", "path", "depth"])
+        source_book_id = section.book_id
+        # trashed subsections move along, to be restored in place
+        rows = list(Section.all_objects.filter(path__startswith=section.path).only(*_FIELDS).order_by("path"))
+        moved_ids = {row.pk for row in rows}
+        parent_path = ""
+        if parent_id is not None:
+            try:
+                parent_path = Section.objects.filter(book=book, pk=parent_id).values_list("path", flat=True).get()
+            except Section.DoesNotExist:
+                raise TreeError(f"Section {parent_id} is not in {book}.")
+            if parent_id in moved_ids:
+                raise TreeError("A section cannot be moved under itself or one of its subsections.")
+            check_depth(parent_path, max(row.depth for row in rows) - section.depth)
+
+        old_root = section.path
+        new_root = parent_path + segment(section.pk)
+        depth_change = (len(path_ids(new_root)) - 1) - section.depth
+        for row in rows:
+            row.book_id = book.pk
+            row.path = new_root + row.path[len(old_root):]
+            row.depth += depth_change
+            if row.pk == section.pk:
+                row.parent_id = parent_id
+                row.position = last_position(book.pk, parent_id, exclude=section.pk)
+                # an editor still holding the old parent must not save it back
+                row.version += 1
+        Section.all_objects.bulk_update(
+            rows, ["book", "parent", "path", "depth", "position", "version"], batch_size=BATCH_SIZE
+        )
+        move_totals(subtree_counts(rows[0]), old_root, source_book_id, new_root, book.pk)
+        # the search index carries the book of every section
+        index_sections(rows)
+        for book_id in {source_book_id, book.pk}:
+            book_changed(book_id)
+
+    root = rows[0]
+    for name in ("book_id", "parent_id", "path", "depth", "position", "version"):
+        setattr(section, name, getattr(root, name))
+    if source_book_id != book.pk:
+        publish(source_book_id, "section.deleted", id=section.pk)
+        publish(book.pk, "section.created", id=section.pk, parent=parent_id, title=section.title, version=section.version)
+    else:
+        publish(book.pk, "section.moved", id=section.pk, parent=parent_id, position=section.position, version=section.version)
+    return len(rows)
+
+
+def clone_book(book, author, name=None):
+    """
+    A copy of ``book`` and all its sections, written by ``author``.  Section
+    history and collaborators are not copied.
+    """
+    with transaction.atomic():
+        originals = list(book.sections.only(*_FIELDS).order_by("path"))
+        totals = sum((own_counts(original) for original in originals), ZERO)
+        clone = Book.objects.create(
+            name=name or f"{book.name} (copy)"[:100], author=author, **dict(zip(BOOK_TOTALS, totals)),
+        )
+        # parents are linked once the copies have ids
+        copies = Section.objects.bulk_create(
+            [
+                Section(
+                    book=clone, author=author, title=original.title, content=original.content,
+                    depth=original.depth, position=original.position,
+                    **{name: getattr(original, name) for name in ("word_count", "char_count", *SECTION_TOTALS)},
+                )
+                for original in originals
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        new_ids = {original.pk: copy.pk for original, copy in zip(originals, copies)}
+        for original, copy in zip(originals, copies):
+            copy.parent_id = new_ids.get(original.parent_id)
+            copy.path = "".join(segment(new_ids[pk]) for pk in path_ids(original.path) if pk in new_ids)
+        Section.objects.bulk_update(copies, ["parent", "path"], batch_size=BATCH_SIZE)
+        index_sections(copies)
+    return clone
@@ -0,0 +1,91 @@
+"""
+Revision history for section content.
+
+``record_revision`` is called by the views after a section is saved.  A new
+revision stores a delta against the previous one unless the chain since the
+last snapshot has reached ``SECTION_REVISION_SNAPSHOT_INTERVAL`` revisions,
+so rebuilding any revision never applies more than that many deltas.  Each
+revision keeps a checksum of its text; if the previous content handed in
+does not match it (the section was changed behind the history's back) a
+snapshot is written instead of a delta that would not apply.  Revisions of
+one section are numbered under a lock on its row.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+
+from books.diff import apply_delta, make_delta
+from books.models import Section, SectionRevision
+
+
+def snapshot_interval():
+    return getattr(settings, "SECTION_REVISION_SNAPSHOT_INTERVAL", 20)
+
+
+def checksum(text):
+    return hashlib.md5((text or "").encode()).hexdigest()
+
+
+def _snapshot(section, number, content, author):
+    return SectionRevision(
+        section=section, number=number, base=number, title=section.title,
+        snapshot=content, length=len(content), checksum=checksum(content), author=author,
+    )
+
+
+def record_revision(section, author=None, previous_content=None):
+    """Add a revision for the section's current content, if it changed."""
+    content = section.content or ""
+    with transaction.atomic():
+        # concurrent saves of the section wait here, so they never take the same number
+        list(Section.all_objects.select_for_update().filter(pk=section.pk).values_list("pk"))
+        last = section.revisions.order_by("-number").only("section_id", "number", "base", "title", "checksum").first()
+        if last is None and previous_content:
+            # history starts now; keep what was there before as revision 1
+            last = _snapshot(section, 1, previous_content, None)
+            last.save()
+        if last is not None and last.checksum == checksum(content) and last.title == section.title:
+            return last
+        number = last.number + 1 if last else 1
+        if last is None or last.checksum != checksum(previous_content) or number - last.base >= snapshot_interval():
+            revision = _snapshot(section, number, content, author)
+        else:
+            revision = SectionRevision(
+                section=section, number=number, base=last.base, title=section.title,
+                delta=make_delta(previous_content or "", content), length=len(content),
+                checksum=checksum(content), author=author,
+            )
+        revision.save()
+        return revision
+
+
+def rebuild(revision):
+    """The full text of a revision, from its snapshot and at most N deltas."""
+    if revision.is_snapshot:
+        return revision.snapshot or ""
+    chain = SectionRevision.objects.filter(
+        section_id=revision.section_id, number__gte=revision.base, number__lte=revision.number
+    ).order_by("number").only("number", "base", "snapshot", "delta")
+    content = ""
+    for link in chain:
+        content = (link.snapshot or "") if link.is_snapshot else apply_delta(content, link.delta)
+    return content
+
+
+def rebase(section_id, number):
+    """
+    Make revision ``number`` a snapshot so everything before it can be
+    dropped, pointing the rest of its chain at it.
+    """
+    revision = SectionRevision.objects.get(section_id=section_id, number=number)
+    if revision.is_snapshot:
+        return revision
+    content = rebuild(revision)
+    with transaction.atomic():
+        SectionRevision.objects.filter(
+            section_id=section_id, base=revision.base, number__gt=number
+        ).update(base=number)
+        SectionRevision.objects.filter(pk=revision.pk).update(base=number, snapshot=content, delta=None)
+    revision.refresh_from_db()
+    return revision
@@ -0,0 +1,235 @@
+"""
+Full-text search over section titles and content.
+
+The index lives next to ``books_section`` in a vendor specific table that is
+created by migration ``0006_section_search_index``:
+
+* SQLite: an FTS5 virtual table keyed by the section id (``rowid``).
+* PostgreSQL: a ``tsvector`` column per section behind a GIN index.
+
+``books.signals`` keeps the index up to date on every section save and
+delete, and ``manage.py rebuild_search_index`` rebuilds it in batches.
+Sections in the trash keep their entries until they are purged (see
+``books.trash``); searches skip them.
+"""
+import re
+from dataclasses import dataclass
+
+from django.db import connections, router
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+# Control characters never appear in user text, so they are safe markers to
+# have the database wrap matches in before the snippet gets HTML-escaped.
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+ELLIPSIS = "…"
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class SearchResult:
+    section_id: int
+    book_id: int
+    book_name: str
+    title: str
+    snippet: str
+    rank: float
+
+
+def highlight(text):
+    """HTML-escape a database snippet and turn its match markers into <mark> tags."""
+    text = escape(text or "")
+    return mark_safe(text.replace(MATCH_START, "<mark>").replace(MATCH_END, "</mark>"))
+
+
+def query_terms(query):
+    return WORD_RE.findall(query or "")
+
+
+class SqliteSearchBackend:
+    table = "books_section_fts"
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                "title, content, book_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def index(self, sections):
+        rows = [(s.pk, s.title, s.content or "", s.book_id) for s in sections]
+        if not rows:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [(row[0],) for row in rows])
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, title, content, book_id) VALUES (%s, %s, %s, %s)", rows
+            )
+
+    def remove(self, section_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [(pk,) for pk in section_ids])
+
+    def clear(self, book_id=None):
+        with self.connection.cursor() as cursor:
+            if book_id is None:
+                cursor.execute(f"DELETE FROM {self.table}")
+            else:
+                cursor.execute(f"DELETE FROM {self.table} WHERE book_id = %s", [book_id])
+
+    def search(self, user, query, book_id=None, limit=50):
+        terms = query_terms(query)
+        if not terms:
+            return []
+        # quote every term so FTS5 operators in user input are matched literally
+        match = " ".join('"%s"' % term.replace('"', '""') for term in terms)
+        sql = (
+            f"SELECT f.rowid, f.book_id, b.name, "
+            f"highlight({self.table}, 0, %s, %s), "
+            f"snippet({self.table}, 1, %s, %s, %s, 24), "
+            f"bm25({self.table}, 10.0, 1.0) AS rank "
+            f"FROM {self.table} f JOIN books_book b ON b.id = f.book_id "
+            f"JOIN books_section s ON s.id = f.rowid "
+            f"WHERE {self.table} MATCH %s "
+            f"AND s.deleted_at IS NULL AND b.deleted_at IS NULL "
+            f"AND f.book_id IN (SELECT book_id FROM books_bookmembership WHERE user_id = %s)"
+        )
+        params = [MATCH_START, MATCH_END, MATCH_START, MATCH_END, ELLIPSIS, match, user.pk]
+        if book_id is not None:
+            sql += " AND f.book_id = %s"
+            params.append(book_id)
+        sql += " ORDER BY rank LIMIT %s"
+        params.append(limit)
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [SearchResult(*row[:3], highlight(row[3]), highlight(row[4]), row[5]) for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    table = "books_section_search"
+    config = "simple"
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "section_id bigint PRIMARY KEY REFERENCES books_section (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+                "book_id bigint NOT NULL, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_document_gin ON {self.table} USING GIN (document)")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_book_id ON {self.table} (book_id)")
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def index(self, sections):
+        rows = [(s.pk, s.book_id, s.title, s.content or "") for s in sections]
+        if not rows:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.table} (section_id, book_id, document) VALUES (%s, %s, "
+                f"setweight(to_tsvector('{self.config}', %s), 'A') || setweight(to_tsvector('{self.config}', %s), 'B')) "
+                "ON CONFLICT (section_id) DO UPDATE SET book_id = EXCLUDED.book_id, document = EXCLUDED.document",
+                rows,
+            )
+
+    def remove(self, section_ids):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE section_id = ANY(%s)", [list(section_ids)])
+
+    def clear(self, book_id=None):
+        with self.connection.cursor() as cursor:
+            if book_id is None:
+                cursor.execute(f"TRUNCATE {self.table}")
+            else:
+                cursor.execute(f"DELETE FROM {self.table} WHERE book_id = %s", [book_id])
+
+    def search(self, user, query, book_id=None, limit=50):
+        terms = query_terms(query)
+        if not terms:
+            return []
+        book_filter = "AND i.book_id = %s" if book_id is not None else ""
+        # rank inside the GIN-backed subquery, then build headlines for the top rows only
+        sql = (
+            "SELECT hit.section_id, hit.book_id, b.name, "
+            f"ts_headline('{self.config}', s.title, hit.q, %s), "
+            f"ts_headline('{self.config}', coalesce(s.content, ''), hit.q, %s), "
+            "hit.rank "
+            "FROM ("
+            "  SELECT i.section_id, i.book_id, q, ts_rank_cd(i.document, q) AS rank "
+            f"  FROM {self.table} i "
+            "  JOIN books_section live ON live.id = i.section_id AND live.deleted_at IS NULL "
+            "  JOIN books_book live_book ON live_book.id = i.book_id AND live_book.deleted_at IS NULL "
+            f"  CROSS JOIN plainto_tsquery('{self.config}', %s) q "
+            "  WHERE i.document @@ q "
+            "  AND i.book_id IN (SELECT book_id FROM books_bookmembership WHERE user_id = %s) "
+            f"  {book_filter} "
+            "  ORDER BY rank DESC LIMIT %s"
+            ") hit "
+            "JOIN books_section s ON s.id = hit.section_id "
+            "JOIN books_book b ON b.id = hit.book_id "
+            "ORDER BY hit.rank DESC"
+        )
+        options = f"StartSel={MATCH_START}, StopSel={MATCH_END}"
+        params = [
+            options + ", HighlightAll=true",
+            options + f", MaxFragments=2, MaxWords=24, MinWords=8, FragmentDelimiter={ELLIPSIS}",
+            " ".join(terms),
+            user.pk,
+        ]
+        if book_id is not None:
+            params.append(book_id)
+        params.append(limit)
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [SearchResult(*row[:3], highlight(row[3]), highlight(row[4]), row[5]) for row in cursor.fetchall()]
+
+
+BACKENDS = {
+    "sqlite": SqliteSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+def get_backend(connection=None):
+    """The search backend for a database connection, or ``None`` if it has no full-text engine."""
+    if connection is None:
+        from books.models import Section
+
+        connection = connections[router.db_for_write(Section)]
+    backend_class = BACKENDS.get(connection.vendor)
+    return backend_class(connection) if backend_class else None
+
+
+def index_sections(sections):
+    backend = get_backend()
+    if backend is not None:
+        backend.index(sections)
+
+
+def remove_sections(section_ids):
+    backend = get_backend()
+    if backend is not None:
+        backend.remove(section_ids)
+
+
+def search_sections(user, query, book_id=None, limit=50):
+    backend = get_backend()
+    if backend is None:
+        return []
+    return backend.search(user, query, book_id=book_id, limit=limit)
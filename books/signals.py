@@ -0,0 +1,202 @@
+from collections import defaultdict
+
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from books.cache import bump_generation
+from books.events import publish
+from books.models import Book, BookCollaborator, BookMembership, Section
+from books.ordering import last_position
+from books.search import index_sections, remove_sections
+from books.stats import SECTION_TOTALS, ZERO, Counts, add_to_ancestors, content_counts, own_counts
+from books.tree import check_parent, is_placed, place_section
+
+
+def book_changed(book_id):
+    """Invalidate cached fragments of a book and move its ``updated_at`` forward."""
+    Book.objects.filter(pk=book_id).update(updated_at=timezone.now())
+    bump_generation(book_id)
+
+
+def add_collaborator_memberships(pairs):
+    """Index ``(book_id, user_id)`` pairs as collaborators; authors keep their role."""
+    BookMembership.objects.bulk_create(
+        [BookMembership(book_id=book_id, user_id=user_id, role=BookMembership.COLLABORATOR) for book_id, user_id in pairs],
+        ignore_conflicts=True,
+    )
+
+
+def remove_collaborator_memberships(pairs):
+    by_book = defaultdict(list)
+    for book_id, user_id in pairs:
+        by_book[book_id].append(user_id)
+    for book_id, user_ids in by_book.items():
+        BookMembership.objects.filter(book_id=book_id, user_id__in=user_ids, role=BookMembership.COLLABORATOR).delete()
+
+
+def sync_book_memberships(book):
+    """Rebuild the membership rows of one book from its author and collaborators."""
+    wanted = dict.fromkeys(
+        BookCollaborator.objects.filter(book=book).values_list("collaborator_id", flat=True),
+        BookMembership.COLLABORATOR,
+    )
+    wanted[book.author_id] = BookMembership.AUTHOR
+    existing = dict(BookMembership.objects.filter(book=book).values_list("user_id", "role"))
+
+    stale = existing.keys() - wanted.keys()
+    if stale:
+        BookMembership.objects.filter(book=book, user_id__in=stale).delete()
+    for role in (BookMembership.AUTHOR, BookMembership.COLLABORATOR):
+        changed = [user_id for user_id, wanted_role in wanted.items() if wanted_role == role and existing.get(user_id, role) != role]
+        if changed:
+            BookMembership.objects.filter(book=book, user_id__in=changed).update(role=role)
+    BookMembership.objects.bulk_create(
+        [BookMembership(book=book, user_id=user_id, role=role) for user_id, role in wanted.items() if user_id not in existing],
+        ignore_conflicts=True,
+    )
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    bump_generation(instance.pk)
+    if created:
+        BookMembership.objects.create(book=instance, user_id=instance.author_id, role=BookMembership.AUTHOR)
+    elif not BookMembership.objects.filter(book=instance, user_id=instance.author_id, role=BookMembership.AUTHOR).exists():
+        # the author changed
+        sync_book_memberships(instance)
+
+
+@receiver(post_save, sender=BookCollaborator)
+def collaborator_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        add_collaborator_memberships([(instance.book_id, instance.collaborator_id)])
+        publish(instance.book_id, "collaborator.added", user=instance.collaborator_id)
+    book_changed(instance.book_id)
+
+
+@receiver(post_delete, sender=BookCollaborator)
+def collaborator_deleted(sender, instance, **kwargs):
+    # also sent per row by the m2m remove() and clear(), which delete through a queryset
+    remove_collaborator_memberships([(instance.book_id, instance.collaborator_id)])
+    publish(instance.book_id, "collaborator.removed", user=instance.collaborator_id)
+    book_changed(instance.book_id)
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    bump_generation(instance.pk)
+    publish(instance.pk, "book.deleted")
+
+
+@receiver(m2m_changed, sender=Book.collaborators.through)
+def collaborators_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and reverse:
+        # remember which books lose this collaborator before the rows are gone
+        instance._cleared_book_ids = list(
+            BookCollaborator.objects.filter(collaborator=instance).values_list("book_id", flat=True)
+        )
+    elif action in ("post_add", "post_remove"):
+        if reverse:
+            pairs = [(book_id, instance.pk) for book_id in pk_set]
+        else:
+            pairs = [(instance.pk, user_id) for user_id in pk_set]
+        if action == "post_add":
+            add_collaborator_memberships(pairs)
+            for book_id, user_id in pairs:
+                publish(book_id, "collaborator.added", user=user_id)
+        else:
+            remove_collaborator_memberships(pairs)
+        for book_id in {book_id for book_id, _ in pairs}:
+            book_changed(book_id)
+    elif action == "post_clear":
+        if reverse:
+            BookMembership.objects.filter(user=instance, role=BookMembership.COLLABORATOR).delete()
+            for book_id in getattr(instance, "_cleared_book_ids", []):
+                book_changed(book_id)
+        else:
+            sync_book_memberships(instance)
+            book_changed(instance.pk)
+
+
+@receiver(pre_save, sender=Section)
+def section_parent_checked(sender, instance, raw=False, **kwargs):
+    # a bad parent is refused before the row is written; section_saved only writes paths
+    if not raw and not is_placed(instance):
+        check_parent(instance)
+
+
+@receiver(pre_save, sender=Section)
+def section_positioned(sender, instance, raw=False, **kwargs):
+    if instance._state.adding and not raw and not instance.position and instance.book_id:
+        instance.position = last_position(instance.book_id, instance.parent_id)
+
+
+@receiver(pre_save, sender=Section)
+def section_counts_loaded(sender, instance, raw=False, update_fields=None, **kwargs):
+    if instance._state.adding or raw:
+        return
+    stored = Section.all_objects.filter(pk=instance.pk).values("word_count", "char_count", *SECTION_TOTALS).first()
+    if stored is not None:
+        # a full save writes the counters back unchanged; section_counted moves them on
+        for name, value in stored.items():
+            setattr(instance, name, value)
+        instance._stored_counts = Counts(stored["word_count"], stored["char_count"], 1)
+
+
+def count_section(instance, created):
+    """Add the change of a saved section's content to its counters, ancestors and book."""
+    if created:
+        old = ZERO
+    else:
+        old = getattr(instance, "_stored_counts", None)
+        if old is None:
+            old = own_counts(Section.all_objects.only("word_count", "char_count").get(pk=instance.pk))
+    instance.__dict__.pop("_stored_counts", None)
+    new = content_counts(instance.content)
+    change = new - old
+    if change == ZERO:
+        return
+    Section.all_objects.filter(pk=instance.pk).update(
+        word_count=new.words,
+        char_count=new.chars,
+        **{name: F(name) + value for name, value in zip(SECTION_TOTALS, change)},
+    )
+    instance.word_count, instance.char_count = new.words, new.chars
+    for name, value in zip(SECTION_TOTALS, change):
+        setattr(instance, name, getattr(instance, name) + value)
+    if instance.deleted_at is None:
+        add_to_ancestors(instance.path, instance.book_id, change)
+
+
+@receiver(post_save, sender=Section)
+def section_saved(sender, instance, created=False, raw=False, **kwargs):
+    if not raw:
+        place_section(instance)
+        count_section(instance, created)
+    index_sections([instance])
+    if instance.book_id:
+        book_changed(instance.book_id)
+        if not raw:
+            publish(
+                instance.book_id,
+                "section.created" if created else "section.updated",
+                id=instance.pk,
+                parent=instance.parent_id,
+                title=instance.title,
+                version=instance.version,
+            )
+
+
+@receiver(post_delete, sender=Section)
+def section_deleted(sender, instance, **kwargs):
+    remove_sections([instance.pk])
+    if instance.deleted_at is None:
+        # trashed sections were taken out of the totals already
+        add_to_ancestors(instance.path, instance.book_id, -own_counts(instance))
+    if instance.book_id:
+        book_changed(instance.book_id)
+        publish(instance.book_id, "section.deleted", id=instance.pk)
@@ -0,0 +1,154 @@
+"""
+Word, character and section totals of books and section subtrees.
+
+Every section stores the counts of its own content (``word_count``,
+``char_count``) and the totals of its subtree, itself included
+(``subtree_*``).  A book stores the totals of its live sections.  Nothing
+is counted when a page is read.  Every write adds its difference to the
+section, its ancestors and its book with ``F()`` updates instead:
+
+* saving a section adds the change of its content (``books.signals``);
+* moving a subtree takes its totals from the old ancestors and gives them
+  to the new ones (``books.tree``, ``books.restructure``);
+* trashing and restoring a subtree take and give back its totals
+  (``books.trash``); the purge changes nothing.
+
+Subsections trashed on their own are not in the totals of their ancestors,
+so a section's totals cover the descendants sharing its ``deleted_at``.
+``manage.py recount_stats`` recomputes everything from the content, to fix
+drift from writes that bypass all this.
+"""
+from collections import defaultdict
+from typing import NamedTuple
+
+from django.db.models import F
+
+from books.models import Book, Section
+from books.tree import path_ids
+
+SECTION_TOTALS = ("subtree_word_count", "subtree_char_count", "subtree_section_count")
+BOOK_TOTALS = ("word_count", "char_count", "section_count")
+
+
+class Counts(NamedTuple):
+    words: int = 0
+    chars: int = 0
+    sections: int = 0
+
+    def __add__(self, other):
+        return Counts(*(mine + theirs for mine, theirs in zip(self, other)))
+
+    def __sub__(self, other):
+        return Counts(*(mine - theirs for mine, theirs in zip(self, other)))
+
+    def __neg__(self):
+        return Counts() - self
+
+
+ZERO = Counts()
+
+
+def content_counts(content):
+    """The counts of one section with this content."""
+    content = content or ""
+    return Counts(len(content.split()), len(content), 1)
+
+
+def own_counts(section):
+    return Counts(section.word_count, section.char_count, 1)
+
+
+def subtree_counts(section):
+    return Counts(*(getattr(section, name) for name in SECTION_TOTALS))
+
+
+def ancestor_ids(path):
+    """The ids of the sections above the one at ``path``."""
+    return path_ids(path)[:-1]
+
+
+def apply(sections=None, books=None):
+    """
+    Add ``{section id: Counts}`` to subtree totals and ``{book id: Counts}``
+    to book totals, one UPDATE per distinct difference.
+    """
+    for model, fields, changes in ((Section, SECTION_TOTALS, sections), (Book, BOOK_TOTALS, books)):
+        grouped = defaultdict(list)
+        for pk, counts in (changes or {}).items():
+            if pk is not None and counts != ZERO:
+                grouped[counts].append(pk)
+        for counts, pks in grouped.items():
+            model.all_objects.filter(pk__in=pks).update(
+                **{name: F(name) + value for name, value in zip(fields, counts)}
+            )
+
+
+def add_to_ancestors(path, book_id, counts):
+    """Add ``counts`` to every section above ``path`` and to the book."""
+    apply(dict.fromkeys(ancestor_ids(path), counts), {book_id: counts})
+
+
+def move_totals(counts, old_path, old_book_id, new_path, new_book_id):
+    """Take a subtree's ``counts`` from its old ancestors and book and give them to the new ones."""
+    old_ids, new_ids = set(ancestor_ids(old_path)), set(ancestor_ids(new_path))
+    sections = dict.fromkeys(old_ids - new_ids, -counts)
+    sections.update(dict.fromkeys(new_ids - old_ids, counts))
+    books = {} if old_book_id == new_book_id else {old_book_id: -counts, new_book_id: counts}
+    apply(sections, books)
+
+
+def rollup(rows):
+    """
+    ``{id: Counts}`` subtree totals of ``rows``, ``(id, path, deleted_at,
+    Counts)`` tuples covering whole subtrees, from their own counts.
+    """
+    trashed = {pk: deleted_at for pk, _, deleted_at, _ in rows}
+    totals = defaultdict(Counts)
+    for pk, path, deleted_at, counts in rows:
+        for ancestor in path_ids(path):
+            if trashed.get(ancestor, deleted_at) == deleted_at:
+                totals[ancestor] += counts
+    return totals
+
+
+def recount_book(book_id, chunk_size=500):
+    """
+    Recompute the counters of a book and its sections from their content,
+    reading ``chunk_size`` contents at a time.  Returns the number of rows
+    that were off; when there were any, the book's cached fragments are
+    invalidated.
+    """
+    from books.signals import book_changed
+
+    sections = Section.all_objects.filter(book_id=book_id)
+    stored = {
+        pk: (path, deleted_at, values)
+        for pk, path, deleted_at, *values in sections.values_list(
+            "id", "path", "deleted_at", "word_count", "char_count", *SECTION_TOTALS
+        ).iterator(chunk_size=chunk_size)
+    }
+    own, last_pk = {}, 0
+    while True:
+        chunk = list(sections.filter(pk__gt=last_pk).order_by("pk").values_list("id", "content")[:chunk_size])
+        if not chunk:
+            break
+        for pk, content in chunk:
+            own[pk] = content_counts(content)
+        last_pk = chunk[-1][0]
+
+    totals = rollup([(pk, path, deleted_at, own[pk]) for pk, (path, deleted_at, _) in stored.items() if pk in own])
+    fixed = []
+    for pk, counts in own.items():
+        values = [counts.words, counts.chars, *totals[pk]]
+        if values != list(stored[pk][2]):
+            fixed.append(Section(pk=pk, **dict(zip(("word_count", "char_count", *SECTION_TOTALS), values))))
+    Section.all_objects.bulk_update(fixed, ["word_count", "char_count", *SECTION_TOTALS], batch_size=chunk_size)
+
+    book_totals = sum((counts for pk, counts in own.items() if stored[pk][1] is None), ZERO)
+    book_fixed = Book.all_objects.filter(pk=book_id).exclude(**dict(zip(BOOK_TOTALS, book_totals))).update(
+        **dict(zip(BOOK_TOTALS, book_totals))
+    )
+    changed = len(fixed) + book_fixed
+    if changed:
+        book_changed(book_id)
+    return changed
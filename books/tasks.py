@@ -0,0 +1,15 @@
+from books.ordering import REBALANCE_JOB, rebalance
+from books.trash import PURGE_JOB, purge
+from jobs.queue import enqueue, register
+
+
+@register(REBALANCE_JOB)
+def rebalance_positions(payload):
+    rebalance(payload["book"], payload["parent"])
+
+
+@register(PURGE_JOB)
+def purge_trash(payload):
+    # one batch per run, so a huge book never holds the database for long
+    if purge():
+        enqueue(PURGE_JOB)
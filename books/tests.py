@@ -1,9 +1,56 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+import tempfile
+import zipfile
+from io import BytesIO, StringIO
+
+import asyncio
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.template import Context, Template
+from django.template.base import Origin
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 
-from books.forms import BookForm, SectionForm, CollaboratorForm
-from books.models import Book, Section
+from book_writer.middleware import QueryInstrumentationMiddleware, QueryRecorder, ReplicaMiddleware, sql_template
+from book_writer.routers import PrimaryReplicaRouter
+from books.activity import buffer as activity_buffer, record
+from books.benchmark import full_scans
+from books.async_views import AsyncBookDetailView, AsyncBookListView, AsyncSectionDetailView
+from books.collaborators import invite_collaborators
+from books.forms import BookForm, SectionForm, CollaboratorForm, CollaboratorInviteForm
+from books.exporters import export_markdown
+from books.diff import DeltaError, apply_delta, make_delta
+from books.events import Hub
+from books.models import Activity, Book, BookCollaborator, BookMembership, Section, SectionRevision
+from books.ordering import MAX_RANK_LENGTH, REBALANCE_JOB, move_section, rank_between, rebalance, spaced_ranks
+from books.restructure import clone_book, move_subtree
+from books.revisions import rebuild, record_revision
+from books.checks import fragment_cache_is_shared
+from books.cache import BookFragments, fragment_cache_stats, get_cache, get_generation, reset_fragment_cache_stats
+from books.concurrency import VersionConflict, save_section
+from books.conditional import book_last_modified, dashboard_last_modified
+from books.search import get_backend, search_sections
+from books.signals import book_changed
+from books.stats import recount_book
+from books.tree import TableOfContents, TreeError, path_ids
+from books.trash import PURGE_JOB, purge, restore_book, restore_section, trash_book, trash_section
+from books.views import ActivityFeedView, BookTocView
+from jobs.models import Job
+from jobs.queue import get_handler
 
 User = get_user_model()
 
@@ -67,6 +114,58 @@ class TestBookListView(TestCase, TestLoginRequired):
         self.assertTemplateUsed(response, "books/books.html")
         self.assertQuerysetEqual(response.context["books"], [book])
 
+    def test_get_annotates_counts_and_role(self):
+        user2 = User.objects.create_user(username="test2", password="test")
+        book = Book.objects.create(name="mine", author=self.user)
+        book.collaborators.add(user2)
+        Section.objects.create(title="s1", book=book, author=self.user)
+        Section.objects.create(title="s2", book=book, author=self.user)
+        shared = Book.objects.create(name="shared", author=user2)
+        shared.collaborators.add(self.user)
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        books = {book.name: book for book in response.context["books"]}
+        self.assertEqual(books["mine"].collaborator_count, 1)
+        self.assertEqual(books["mine"].section_count, 2)
+        self.assertEqual(books["mine"].role, "author")
+        self.assertEqual(books["shared"].role, "collaborator")
+
+    def test_query_count_is_independent_of_book_count(self):
+        self.client.force_login(self.user)
+        Book.objects.create(name="book", author=self.user)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+        for i in range(20):
+            book = Book.objects.create(name=f"book {i}", author=self.user)
+            Section.objects.create(title="s", book=book, author=self.user)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(self.url)
+        self.assertEqual(len(few), len(many))
+
+    def test_keyset_pagination(self):
+        self.client.force_login(self.user)
+        books = [Book.objects.create(name=f"book {i:02}", author=self.user) for i in range(30)]
+        response = self.client.get(self.url, {"sort": "name"})
+        page = response.context["page"]
+        self.assertEqual(list(page), books[:25])
+        self.assertFalse(page.has_previous)
+        self.assertTrue(page.has_next)
+        response = self.client.get(self.url, {"sort": "name", "cursor": page.next_cursor})
+        page = response.context["page"]
+        self.assertEqual(list(page), books[25:])
+        self.assertFalse(page.has_next)
+        response = self.client.get(self.url, {"sort": "name", "cursor": page.previous_cursor})
+        self.assertEqual(list(response.context["page"]), books[:25])
+
+    def test_invalid_cursor(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url, {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 404)
+        Book.objects.create(name="book", author=self.user)
+        for payload in (["n", "2024-01-01T00:00:00+00:00", "abc"], ["n", None, 1]):
+            cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            self.assertEqual(self.client.get(self.url, {"cursor": cursor}).status_code, 404)
+
 
 class TestBookDetailView(TestCase, TestLoginRequired):
     def setUp(self) -> None:
@@ -236,6 +335,23 @@ class TestSectionUpdateView(TestCase, TestLoginRequired):
         self.assertEqual(self.section.content, "new content")
         self.assertRedirects(response, reverse("books:section-detail", kwargs={"pk": self.book.pk, "section_pk": self.section.pk}))
 
+    def test_post_bumps_version(self):
+        self.client.force_login(self.user)
+        response = self.client.post(self.url, {"title": "new title", "content": "new content", "version": 1})
+        self.assertEqual(response.status_code, 302)
+        self.section.refresh_from_db()
+        self.assertEqual(self.section.version, 2)
+
+    def test_post_stale_version(self):
+        self.client.force_login(self.user)
+        self.client.post(self.url, {"title": "first", "content": "first", "version": 1})
+        response = self.client.post(self.url, {"title": "second", "content": "second", "version": 1})
+        self.assertEqual(response.status_code, 409)
+        self.assertTemplateUsed(response, "books/update_section.html")
+        self.assertTrue(response.context["form"].non_field_errors())
+        self.section.refresh_from_db()
+        self.assertEqual((self.section.title, self.section.version), ("first", 2))
+
 
 class TestSectionDetailView(TestCase, TestLoginRequired):
     def setUp(self) -> None:
@@ -243,6 +359,8 @@ class TestSectionDetailView(TestCase, TestLoginRequired):
         self.book = Book.objects.create(name="test", author=self.user)
         self.section = Section.objects.create(title="test", content="test", book=self.book, author=self.user)
         self.url = reverse("books:section-detail", kwargs={"pk": self.book.pk, "section_pk": self.section.pk})
+        # generations move on commit, which a TestCase never reaches; ids of earlier tests come back
+        get_cache().clear()
 
     def test_get(self):
         self.client.force_login(self.user)
@@ -308,6 +426,65 @@ class TestCollaboratorCreateView(TestCase, TestLoginRequired):
         self.assertFormError(response, "form", "email", "User with this email does not exist.")
 
 
+class TestCollaboratorInviteView(TestCase, TestLoginRequired):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test", email="test1@gmail.com")
+        self.user2 = User.objects.create_user(username="test2", password="test", email="test2@gmail.com")
+        self.user3 = User.objects.create_user(username="test3", password="test", email="Test3@Gmail.com")
+        self.book = Book.objects.create(name="test", author=self.user)
+        self.url = reverse("books:invite-collaborators", kwargs={"pk": self.book.pk})
+
+    def test_get(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.context["form"], CollaboratorInviteForm)
+
+    def test_post(self):
+        self.book.collaborators.add(self.user2)
+        self.client.force_login(self.user)
+        emails = "TEST2@gmail.com, test3@gmail.com;test1@gmail.com\nnobody@gmail.com not-an-email test3@GMAIL.com"
+        response = self.client.post(self.url, {"emails": emails})
+        self.assertEqual(response.status_code, 200)
+        result = response.context["result"]
+        self.assertEqual(result.added, [self.user3])
+        self.assertEqual(result.existing, ["TEST2@gmail.com", "test1@gmail.com"])
+        self.assertEqual(result.unknown, ["nobody@gmail.com"])
+        self.assertEqual(result.invalid, ["not-an-email"])
+        self.assertContains(response, "No account for: nobody@gmail.com")
+        self.assertEqual(set(self.book.collaborators.all()), {self.user2, self.user3})
+        self.assertTrue(BookMembership.objects.filter(book=self.book, user=self.user3, role=BookMembership.COLLABORATOR).exists())
+
+    def test_upload(self):
+        self.client.force_login(self.user)
+        upload = BytesIO(b"email\ntest2@gmail.com\ntest3@gmail.com\n")
+        upload.name = "emails.csv"
+        response = self.client.post(self.url, {"file": upload})
+        self.assertEqual(response.context["result"].invalid, ["email"])
+        self.assertEqual(self.book.collaborators.count(), 2)
+
+    def test_post_empty(self):
+        self.client.force_login(self.user)
+        response = self.client.post(self.url, {"emails": " , "})
+        self.assertFormError(response, "form", None, "Enter or upload at least one email.")
+
+    def test_post_not_author(self):
+        self.client.force_login(self.user2)
+        response = self.client.post(self.url, {"emails": "test3@gmail.com"})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.book.collaborators.count(), 0)
+
+    def test_queries_do_not_grow_with_emails(self):
+        User.objects.bulk_create([User(username=f"bulk{i}", email=f"bulk{i}@example.com") for i in range(30)])
+        other = Book.objects.create(name="other", author=self.user)
+        with CaptureQueriesContext(connection) as few:
+            invite_collaborators(self.book, ["bulk0@example.com", "bulk1@example.com", "missing@example.com"])
+        with CaptureQueriesContext(connection) as many:
+            invite_collaborators(other, [f"bulk{i}@example.com" for i in range(30)] + ["missing@example.com"])
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(other.collaborators.count(), 30)
+
+
 class TestCollaboratorDeleteView(TestCase, TestLoginRequired):
     def setUp(self) -> None:
         self.user = User.objects.create_user(username="test", password="test", email="test1@gmail.com")
@@ -324,6 +501,10 @@ class TestCollaboratorDeleteView(TestCase, TestLoginRequired):
         self.assertEqual(self.book.collaborators.count(), 0)
         self.assertRedirects(response, reverse("books:detail", kwargs={"pk": self.book.pk}))
 
+    def test_pair_is_unique(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BookCollaborator.objects.create(book=self.book, collaborator=self.user2)
+
     def test_post_invalid_user(self):
         user3 = User.objects.create_user(username="test3", password="test")
         self.client.force_login(user3)
@@ -332,3 +513,1595 @@ class TestCollaboratorDeleteView(TestCase, TestLoginRequired):
         self.book.refresh_from_db()
         self.assertEqual(self.book.collaborators.count(), 1)
         self.assertEqual(self.book.collaborators.first(), self.user2)
+
+
+class TestBookMembership(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.user2 = User.objects.create_user(username="test2", password="test")
+        self.book = Book.objects.create(name="test", author=self.user)
+
+    def roles(self):
+        return dict(self.book.memberships.values_list("user__username", "role"))
+
+    def test_author_membership_created(self):
+        self.assertEqual(self.roles(), {"test": BookMembership.AUTHOR})
+
+    def test_collaborators_add_and_remove(self):
+        self.book.collaborators.add(self.user2)
+        self.assertEqual(self.roles(), {"test": "author", "test2": "collaborator"})
+        self.book.collaborators.remove(self.user2)
+        self.assertEqual(self.roles(), {"test": "author"})
+
+    def test_collaborator_rows_and_clear(self):
+        BookCollaborator.objects.create(book=self.book, collaborator=self.user2)
+        self.assertEqual(self.roles(), {"test": "author", "test2": "collaborator"})
+        self.book.collaborators.clear()
+        self.assertEqual(self.roles(), {"test": "author"})
+
+    def test_reverse_add(self):
+        self.user2.contributed_books.add(self.book)
+        self.assertEqual(self.roles(), {"test": "author", "test2": "collaborator"})
+
+    def test_author_change(self):
+        self.book.collaborators.add(self.user2)
+        self.book.author = self.user2
+        self.book.save()
+        self.assertEqual(self.roles(), {"test2": "author"})
+
+    def test_author_as_collaborator_is_not_duplicated(self):
+        self.book.collaborators.add(self.user)
+        self.assertEqual(self.roles(), {"test": "author"})
+        self.assertQuerysetEqual(Book.objects.for_user(self.user), [self.book])
+        self.book.collaborators.remove(self.user)
+        self.assertEqual(self.roles(), {"test": "author"})
+
+    def test_access_check_uses_membership(self):
+        self.client.force_login(self.user2)
+        url = reverse("books:detail", kwargs={"pk": self.book.pk})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.book.collaborators.add(self.user2)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class TestSectionTree(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.book = Book.objects.create(name="test", author=self.user)
+        self.part1 = Section.objects.create(title="part 1", book=self.book, author=self.user)
+        self.chapter1 = Section.objects.create(title="chapter 1", book=self.book, parent=self.part1, author=self.user)
+        self.scene1 = Section.objects.create(title="scene 1", book=self.book, parent=self.chapter1, author=self.user)
+        self.part2 = Section.objects.create(title="part 2", book=self.book, author=self.user)
+
+    def test_paths_and_depth(self):
+        self.scene1.refresh_from_db()
+        self.assertEqual(self.scene1.depth, 2)
+        self.assertEqual(path_ids(self.scene1.path), [self.part1.pk, self.chapter1.pk, self.scene1.pk])
+
+    def test_move_subtree(self):
+        self.chapter1.parent = self.part2
+        self.chapter1.save()
+        self.scene1.refresh_from_db()
+        self.assertEqual(path_ids(self.scene1.path), [self.part2.pk, self.chapter1.pk, self.scene1.pk])
+        self.chapter1.parent = None
+        self.chapter1.save()
+        self.scene1.refresh_from_db()
+        self.assertEqual(self.scene1.depth, 1)
+        self.assertEqual(path_ids(self.scene1.path), [self.chapter1.pk, self.scene1.pk])
+
+    def test_move_under_descendant_rejected(self):
+        form = SectionForm(self.book, {"title": "part 1", "parent": self.scene1.pk}, instance=self.part1)
+        self.assertFalse(form.is_valid())
+        self.assertIn("parent", form.errors)
+
+    def test_bad_parent_rejected_before_writing(self):
+        other = Section.objects.create(title="other", book=Book.objects.create(name="other", author=self.user), author=self.user)
+        for parent in (self.scene1, other):
+            self.part1.parent = parent
+            with CaptureQueriesContext(connection) as queries, self.assertRaises(TreeError):
+                self.part1.save()
+            self.assertFalse([query for query in queries.captured_queries if query["sql"].startswith("UPDATE")])
+        with self.assertRaises(TreeError):
+            Section.objects.create(title="stray", book=self.book, parent=other, author=self.user)
+        self.part1.refresh_from_db()
+        self.assertIsNone(self.part1.parent_id)
+        self.assertFalse(Section.objects.filter(title="stray").exists())
+
+    def test_depth_limit(self):
+        chain = [self.scene1]
+        while len(chain) < 88:
+            chain.append(Section.objects.create(title="deeper", book=self.book, parent=chain[-1], author=self.user))
+        self.assertEqual(chain[-1].depth, 89)
+        with self.assertRaisesMessage(TreeError, "more than 90 levels deep"):
+            Section.objects.create(title="too deep", book=self.book, parent=chain[-1], author=self.user)
+        # part 2 fits under the second deepest section, its subsection does not
+        Section.objects.create(title="chapter 2", book=self.book, parent=self.part2, author=self.user)
+        self.part2.parent = chain[-2]
+        with CaptureQueriesContext(connection) as queries, self.assertRaises(TreeError):
+            self.part2.save()
+        self.assertFalse([query for query in queries.captured_queries if query["sql"].startswith("UPDATE")])
+        with self.assertRaises(TreeError):
+            move_subtree(self.part2, self.book, chain[-2].pk)
+        self.part2.refresh_from_db()
+        self.assertEqual(self.part2.depth, 0)
+        self.assertFalse(Section.objects.filter(title="too deep").exists())
+
+    def test_parent_moved_meanwhile_is_a_form_error(self):
+        self.client.force_login(self.user)
+        url = reverse("books:update-section", kwargs={"pk": self.book.pk, "section_pk": self.part1.pk})
+
+        def move_part2_first(section, *args, **kwargs):
+            # part 2 goes under part 1 after the form accepted it as the new parent
+            self.part2.refresh_from_db()
+            self.part2.parent = self.scene1
+            self.part2.save()
+            return save_section(section, *args, **kwargs)
+
+        with mock.patch("books.views.save_section", move_part2_first):
+            response = self.client.post(url, {"title": "part 1", "parent": self.part2.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("under itself", str(response.context["form"].errors["parent"]))
+        self.part1.refresh_from_db()
+        self.assertIsNone(self.part1.parent_id)
+
+    def test_table_of_contents(self):
+        with CaptureQueriesContext(connection) as queries:
+            toc = TableOfContents.for_book(self.book)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("content", queries[0]["sql"])
+        self.assertEqual([node.title for node in toc], ["part 1", "chapter 1", "scene 1", "part 2"])
+        self.assertEqual([node.title for node in toc.breadcrumbs(self.scene1.pk)], ["part 1", "chapter 1"])
+        self.assertEqual([node.title for node in toc.children(self.part1.pk)], ["chapter 1"])
+        self.assertEqual(toc.previous(self.part2.pk).title, "scene 1")
+        self.assertEqual(toc.next(self.scene1.pk).title, "part 2")
+        self.assertIsNone(toc.previous(self.part1.pk))
+        self.assertIsNone(toc.next(self.part2.pk))
+
+    def test_section_detail_context(self):
+        self.client.force_login(self.user)
+        url = reverse("books:section-detail", kwargs={"pk": self.book.pk, "section_pk": self.chapter1.pk})
+        response = self.client.get(url)
+        self.assertEqual([node.title for node in response.context["breadcrumbs"]], ["part 1"])
+        self.assertEqual([node.title for node in response.context["subsections"]], ["scene 1"])
+        self.assertEqual(response.context["previous_section"].title, "part 1")
+        self.assertEqual(response.context["next_section"].title, "scene 1")
+
+
+class TestSectionOrdering(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.book = Book.objects.create(name="test", author=self.user)
+        self.one, self.two, self.three = (
+            Section.objects.create(title=title, book=self.book, author=self.user) for title in ("one", "two", "three")
+        )
+
+    def titles(self):
+        return [node.title for node in TableOfContents.for_book(self.book)]
+
+    def test_rank_between(self):
+        ranks = ["", ""]
+        # keep inserting at the front, the back and after the first key
+        for step in range(200):
+            index = (0, len(ranks) - 2, min(1, len(ranks) - 2))[step % 3]
+            new = rank_between(ranks[index], ranks[index + 1])
+            self.assertTrue(ranks[index] < new and (not ranks[index + 1] or new < ranks[index + 1]))
+            self.assertFalse(new.endswith("0"))
+            ranks.insert(index + 1, new)
+        with self.assertRaises(ValueError):
+            rank_between("b", "a")
+
+    def test_spaced_ranks(self):
+        for count in (1, 35, 36, 1000):
+            ranks = spaced_ranks(count)
+            self.assertEqual(ranks, sorted(set(ranks)))
+            self.assertFalse(any(rank.endswith("0") or not rank for rank in ranks))
+
+    def test_new_sections_are_appended(self):
+        positions = [section.position for section in (self.one, self.two, self.three)]
+        self.assertEqual(positions, sorted(positions))
+        self.assertEqual(self.titles(), ["one", "two", "three"])
+
+    def test_move_updates_one_row(self):
+        with CaptureQueriesContext(connection) as queries:
+            move_section(self.three, None, self.one.pk)
+        updates = [query["sql"] for query in queries if query["sql"].startswith('UPDATE "books_section"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.titles(), ["one", "three", "two"])
+        move_section(self.one, None, None)
+        move_section(self.two, None, None)
+        self.assertEqual(self.titles(), ["two", "one", "three"])
+
+    def test_move_under_another_parent(self):
+        child = Section.objects.create(title="child", book=self.book, parent=self.one, author=self.user)
+        move_section(self.three, self.one.pk, None)
+        self.assertEqual(self.titles(), ["one", "three", "child", "two"])
+        self.three.refresh_from_db()
+        self.assertEqual(path_ids(self.three.path), [self.one.pk, self.three.pk])
+        self.assertEqual(self.three.depth, 1)
+        # a reparent through a regular save goes last
+        child.parent = self.two
+        child.save()
+        self.assertEqual(self.titles(), ["one", "three", "two", "child"])
+
+    def test_unranked_siblings_are_ranked_on_first_move(self):
+        Section.objects.filter(book=self.book).update(position="")
+        move_section(self.one, None, self.two.pk)
+        self.assertEqual(self.titles(), ["two", "one", "three"])
+        self.assertNotIn("", Section.objects.filter(book=self.book).values_list("position", flat=True))
+
+    def test_long_keys_are_rebalanced_in_the_background(self):
+        for _ in range(MAX_RANK_LENGTH * 6):
+            move_section(self.three, None, self.one.pk)
+            move_section(self.two, None, self.one.pk)
+            if Job.objects.filter(name=REBALANCE_JOB).exists():
+                break
+        job = Job.objects.filter(name=REBALANCE_JOB).first()
+        self.assertEqual(job.payload, {"book": self.book.pk, "parent": None})
+        order = self.titles()
+        rebalance(self.book.pk, None)
+        self.assertEqual(self.titles(), order)
+        self.assertTrue(all(len(position) <= 1 for position in Section.objects.values_list("position", flat=True)))
+
+    def test_reorder_endpoint(self):
+        self.client.force_login(self.user)
+        url = reverse("books:api-book-sections-reorder", kwargs={"pk": self.book.pk})
+        moves = [{"id": self.three.pk, "parent": None, "after": None}, {"id": self.one.pk, "parent": self.two.pk, "after": None}]
+        response = self.client.post(url, {"moves": moves}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["id"] for row in response.json()["results"]], [self.three.pk, self.one.pk])
+        self.assertEqual(self.titles(), ["three", "two", "one"])
+        self.assertEqual(b"".join(export_markdown(self.book)).decode().split("\n\n")[1:4], ["## three", "## two", "### one"])
+
+        # a move under its own subsection fails and rolls back the whole batch
+        moves = [{"id": self.three.pk, "parent": None, "after": self.two.pk}, {"id": self.two.pk, "parent": self.one.pk, "after": None}]
+        response = self.client.post(url, {"moves": moves}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.titles(), ["three", "two", "one"])
+
+        other = Book.objects.create(name="other", author=self.user)
+        foreign = Section.objects.create(title="foreign", book=other, author=self.user)
+        response = self.client.post(url, {"moves": [{"id": foreign.pk, "parent": None, "after": None}]}, content_type="application/json")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()["index"], 0)
+
+
+class TestRestructure(TestCase, TestLoginRequired):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.book = Book.objects.create(name="Novel", author=self.user)
+        self.other = Book.objects.create(name="Notes", author=self.user)
+        self.part = Section.objects.create(title="part", book=self.other, author=self.user)
+        self.chapter = Section.objects.create(title="chapter", content="whale", book=self.book, author=self.user)
+        self.scene = Section.objects.create(title="scene", content="harpoon", book=self.book, parent=self.chapter, author=self.user)
+        self.epilogue = Section.objects.create(title="epilogue", book=self.book, author=self.user)
+        self.url = reverse("books:move-section", kwargs={"pk": self.book.pk, "section_pk": self.chapter.pk})
+
+    def grow(self, parent, count):
+        parent.refresh_from_db(fields=["book"])
+        for number in range(count):
+            Section.objects.create(title=f"extra {number}", book_id=parent.book_id, parent=parent, author=self.user)
+
+    def assert_consistent(self, book):
+        for section in book.sections.all():
+            parent_path = section.parent.path if section.parent_id else ""
+            self.assertEqual(section.path, parent_path + f"{section.pk:010d}/")
+            self.assertEqual(section.depth, len(path_ids(section.path)) - 1)
+
+    def test_move_subtree_to_another_book(self):
+        move_subtree(self.chapter, self.other, self.part.pk)
+        self.assertEqual([node.title for node in TableOfContents.for_book(self.other)], ["part", "chapter", "scene"])
+        self.assertEqual([node.title for node in TableOfContents.for_book(self.book)], ["epilogue"])
+        self.assert_consistent(self.other)
+        self.assertEqual(self.chapter.parent_id, self.part.pk)
+        self.assertEqual([r.section_id for r in search_sections(self.user, "harpoon", book_id=self.other.pk)], [self.scene.pk])
+        self.assertEqual(search_sections(self.user, "harpoon", book_id=self.book.pk), [])
+
+    def test_move_queries_do_not_grow_with_the_subtree(self):
+        with CaptureQueriesContext(connection) as small:
+            move_subtree(self.chapter, self.other)
+        self.grow(self.scene, 40)
+        with CaptureQueriesContext(connection) as large:
+            move_subtree(self.chapter, self.book)
+        self.assertEqual(len(small), len(large))
+        self.assert_consistent(self.book)
+
+    def test_move_under_own_subsection_rejected(self):
+        with self.assertRaises(TreeError):
+            move_subtree(self.chapter, self.book, self.scene.pk)
+        self.scene.refresh_from_db()
+        self.assertEqual(path_ids(self.scene.path), [self.chapter.pk, self.scene.pk])
+
+    def test_clone_book(self):
+        Section.objects.create(title="intro", book=self.book, author=self.user)
+        move_section(Section.objects.get(title="intro"), None, None)
+        clone = clone_book(self.book, self.user)
+        self.assertEqual(clone.name, "Novel (copy)")
+        titles = [node.title for node in TableOfContents.for_book(clone)]
+        self.assertEqual(titles, [node.title for node in TableOfContents.for_book(self.book)])
+        self.assertEqual(titles, ["intro", "chapter", "scene", "epilogue"])
+        self.assert_consistent(clone)
+        self.assertFalse(clone.sections.filter(pk__in=[self.chapter.pk, self.scene.pk]).exists())
+        self.assertTrue(Book.objects.for_user(self.user).filter(pk=clone.pk).exists())
+        self.assertEqual(len(search_sections(self.user, "whale")), 2)
+
+    def test_clone_queries_do_not_grow_with_the_book(self):
+        with CaptureQueriesContext(connection) as small:
+            clone_book(self.book, self.user)
+        self.grow(self.scene, 40)
+        with CaptureQueriesContext(connection) as large:
+            clone_book(self.book, self.user)
+        self.assertEqual(len(small), len(large))
+
+    def test_move_view(self):
+        self.client.force_login(self.user)
+        response = self.client.post(self.url, {"book": self.other.pk, "parent": self.part.pk})
+        self.assertRedirects(response, reverse("books:section-detail", kwargs={"pk": self.other.pk, "section_pk": self.chapter.pk}))
+        self.assertEqual(Section.objects.get(pk=self.scene.pk).book_id, self.other.pk)
+
+    def test_move_view_parent_from_other_book(self):
+        self.client.force_login(self.user)
+        response = self.client.post(self.url, {"book": self.book.pk, "parent": self.part.pk})
+        self.assertFormError(response, "form", None, "Parent section is not from this book.")
+
+    def test_clone_view(self):
+        collaborator = User.objects.create_user(username="test2", password="test")
+        self.book.collaborators.add(collaborator)
+        self.client.force_login(collaborator)
+        self.assertEqual(self.client.post(reverse("books:clone", kwargs={"pk": self.book.pk})).status_code, 404)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("books:clone", kwargs={"pk": self.book.pk}))
+        clone = Book.objects.get(name="Novel (copy)")
+        self.assertRedirects(response, reverse("books:detail", kwargs={"pk": clone.pk}))
+        self.assertEqual(clone.sections.count(), 3)
+        self.assertFalse(clone.collaborators.exists())
+
+
+class TestTrash(TestCase, TestLoginRequired):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.collaborator = User.objects.create_user(username="test2", password="test")
+        self.book = Book.objects.create(name="Novel", author=self.user)
+        self.book.collaborators.add(self.collaborator)
+        self.chapter = Section.objects.create(title="chapter", content="whale", book=self.book, author=self.user)
+        self.scene = Section.objects.create(title="scene", content="harpoon", book=self.book, parent=self.chapter, author=self.user)
+        self.epilogue = Section.objects.create(title="epilogue", book=self.book, author=self.user)
+        record_revision(self.scene, author=self.user)
+        self.url = reverse("books:trash")
+
+    def expire(self, *querysets):
+        for queryset in querysets:
+            queryset.update(deleted_at=timezone.now() - timedelta(days=31))
+
+    def test_deleting_a_section_hides_its_subtree(self):
+        with self.assertNumQueries(7):
+            self.assertEqual(trash_section(self.chapter), 2)
+        self.assertEqual(list(self.book.sections.all()), [self.epilogue])
+        self.assertEqual(Section.all_objects.filter(book=self.book).count(), 3)
+        self.assertEqual(search_sections(self.user, "harpoon"), [])
+        self.assertEqual([node.title for node in TableOfContents.for_book(self.book)], ["epilogue"])
+        self.assertTrue(Job.objects.filter(name=PURGE_JOB, run_at__gt=timezone.now() + timedelta(days=29)).exists())
+
+    def test_restore_section(self):
+        trash_section(self.scene)
+        trash_section(self.chapter)
+        restore_section(Section.all_objects.get(pk=self.chapter.pk))
+        # the subsection deleted on its own stays in the trash
+        self.assertEqual([node.title for node in TableOfContents.for_book(self.book)], ["chapter", "epilogue"])
+        trash_section(self.chapter)
+        with self.assertRaises(TreeError):
+            restore_section(Section.all_objects.get(pk=self.scene.pk))
+
+    def test_deleting_a_book_hides_it(self):
+        trash_book(self.book)
+        self.assertFalse(Book.objects.filter(pk=self.book.pk).exists())
+        self.assertFalse(Book.objects.for_user(self.collaborator).exists())
+        self.assertEqual(search_sections(self.user, "whale"), [])
+        self.client.force_login(self.collaborator)
+        self.assertEqual(self.client.get(reverse("books:detail", kwargs={"pk": self.book.pk})).status_code, 404)
+
+    def test_restore_book_publishes(self):
+        trash_book(self.book)
+        with mock.patch("books.trash.publish") as publish:
+            restore_book(Book.all_objects.get(pk=self.book.pk))
+        publish.assert_called_once_with(self.book.pk, "book.restored")
+        self.assertTrue(Book.objects.for_user(self.collaborator).exists())
+
+    def test_purge_removes_expired_rows_in_batches(self):
+        trash_section(self.chapter)
+        self.assertEqual(purge(), 0)
+        self.expire(Section.all_objects.filter(pk__in=[self.chapter.pk, self.scene.pk]))
+        self.assertEqual(purge(batch_size=1), 1)
+        self.assertEqual(list(Section.all_objects.filter(book=self.book).values_list("title", flat=True).order_by("pk")), ["chapter", "epilogue"])
+        self.assertEqual(purge(batch_size=1), 1)
+        self.assertEqual(purge(batch_size=1), 0)
+        self.assertFalse(SectionRevision.objects.filter(section_id=self.scene.pk).exists())
+        self.assertEqual(list(Section.objects.values_list("title", flat=True)), ["epilogue"])
+
+    def test_purge_job_removes_a_book(self):
+        trash_book(self.book)
+        self.expire(Book.all_objects.filter(pk=self.book.pk))
+        get_handler(PURGE_JOB)([{}])
+        # every run removes one batch and queues the next
+        while Job.objects.filter(name=PURGE_JOB, run_at__lte=timezone.now()).exists():
+            Job.objects.filter(name=PURGE_JOB, run_at__lte=timezone.now()).delete()
+            get_handler(PURGE_JOB)([{}])
+        self.assertFalse(Book.all_objects.exists())
+        self.assertFalse(Section.all_objects.exists())
+        self.assertFalse(BookMembership.objects.exists())
+        self.assertFalse(BookCollaborator.objects.exists())
+
+    def test_purge_command(self):
+        trash_book(self.book)
+        out = StringIO()
+        call_command("purge_trash", older_than=0, stdout=out)
+        self.assertIn("Purged 4 rows.", out.getvalue())
+        self.assertFalse(Book.all_objects.exists())
+
+    def test_trash_view(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse("books:delete-section", kwargs={"pk": self.book.pk, "section_pk": self.chapter.pk}))
+        other = Book.objects.create(name="Notes", author=self.user)
+        self.client.post(reverse("books:delete", kwargs={"pk": other.pk}))
+        response = self.client.get(self.url)
+        self.assertEqual(list(response.context["books"]), [other])
+        self.assertEqual(list(response.context["sections"]), [Section.all_objects.get(pk=self.chapter.pk)])
+
+        self.client.force_login(self.collaborator)
+        response = self.client.post(reverse("books:restore-book", kwargs={"pk": other.pk}))
+        self.assertEqual(response.status_code, 404)
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("books:restore-section", kwargs={"section_pk": self.chapter.pk}))
+        self.assertRedirects(response, reverse("books:section-detail", kwargs={"pk": self.book.pk, "section_pk": self.chapter.pk}))
+        self.assertEqual(self.book.sections.count(), 3)
+        response = self.client.post(reverse("books:restore-book", kwargs={"pk": other.pk}))
+        self.assertRedirects(response, reverse("books:detail", kwargs={"pk": other.pk}))
+
+    def test_expired_items_cannot_be_restored(self):
+        trash_book(self.book)
+        self.expire(Book.all_objects.filter(pk=self.book.pk))
+        self.client.force_login(self.user)
+        self.assertEqual(list(self.client.get(self.url).context["books"]), [])
+        response = self.client.post(reverse("books:restore-book", kwargs={"pk": self.book.pk}))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestActivity(TestCase, TestLoginRequired):
+    def setUp(self) -> None:
+        activity_buffer.clear()
+        self.addCleanup(activity_buffer.clear)
+        self.user = User.objects.create_user(username="test", password="test")
+        self.collaborator = User.objects.create_user(username="test2", password="test", email="test2@gmail.com")
+        self.book = Book.objects.create(name="Novel", author=self.user)
+        self.section = Section.objects.create(title="chapter", book=self.book, author=self.user)
+        self.url = reverse("books:activity", kwargs={"pk": self.book.pk})
+
+    def test_writes_are_buffered_until_commit_and_flush(self):
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("books:add-section", kwargs={"pk": self.book.pk}), {"title": "scene", "content": "x"})
+            self.client.post(reverse("books:add-collaborator", kwargs={"pk": self.book.pk}), {"email": "test2@gmail.com"})
+            self.assertEqual(len(activity_buffer), 0)
+        self.assertEqual(len(activity_buffer), 2)
+        self.assertFalse(Activity.objects.exists())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(activity_buffer.flush(), 2)
+        self.assertEqual(len([query for query in queries if query["sql"].startswith("INSERT")]), 1)
+        entries = list(Activity.objects.order_by("pk").values_list("actor", "verb", "subject"))
+        self.assertEqual(entries, [
+            (self.user.pk, Activity.SECTION_CREATED, "scene"),
+            (self.user.pk, Activity.COLLABORATOR_ADDED, "test2"),
+        ])
+
+    def test_rolled_back_writes_are_not_logged(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                record(self.book, self.user, Activity.SECTION_UPDATED, section=self.section)
+                transaction.set_rollback(True)
+        self.assertEqual(callbacks, [])
+        self.assertEqual(len(activity_buffer), 0)
+
+    @override_settings(BOOKS_ACTIVITY_BUFFER_SIZE=3)
+    def test_flushes_when_full(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(4):
+                record(self.book, self.user, Activity.SECTION_UPDATED, section=self.section)
+        self.assertEqual(Activity.objects.count(), 3)
+        self.assertEqual(len(activity_buffer), 1)
+
+    @override_settings(BOOKS_ACTIVITY_FLUSH_INTERVAL=0)
+    def test_flushes_after_a_request_once_due(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record(self.book, self.user, Activity.SECTION_UPDATED, section=self.section)
+        self.client.force_login(self.user)
+        self.client.get(reverse("books:home"))
+        self.assertEqual(Activity.objects.count(), 1)
+
+    def test_feed(self):
+        self.book.collaborators.add(self.collaborator)
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in range(5):
+                record(self.book, self.user, Activity.SECTION_UPDATED, section=self.section)
+            record(self.book, self.user, Activity.COLLABORATOR_ADDED, user=self.collaborator)
+        self.client.force_login(self.collaborator)
+        with self.settings(BOOKS_ACTIVITY_FLUSH_INTERVAL=3600):
+            with mock.patch.object(ActivityFeedView, "paginate_by", 4):
+                response = self.client.get(self.url)
+                # buffered entries are written before the feed is read
+                self.assertEqual(len(activity_buffer), 0)
+                self.assertEqual([entry.verb for entry in response.context["activities"]][:2], [Activity.COLLABORATOR_ADDED, Activity.SECTION_UPDATED])
+                self.assertContains(response, "added collaborator")
+                response = self.client.get(self.url, {"cursor": response.context["page"].next_cursor})
+                self.assertEqual(len(response.context["activities"]), 2)
+        self.assertEqual(self.client.get(self.url, {"cursor": "nope"}).status_code, 404)
+        self.client.force_login(User.objects.create_user(username="test3", password="test"))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_purge_removes_the_log(self):
+        Activity.objects.create(book=self.book, actor=self.user, verb=Activity.BOOK_CREATED)
+        trash_book(self.book)
+        call_command("purge_trash", older_than=0, stdout=StringIO())
+        self.assertFalse(Activity.objects.exists())
+
+
+class TestActivityFlush(TransactionTestCase):
+    def setUp(self) -> None:
+        activity_buffer.clear()
+        self.addCleanup(activity_buffer.clear)
+
+    def test_entries_of_books_deleted_meanwhile_are_dropped(self):
+        user = User.objects.create_user(username="test", password="test")
+        book = Book.objects.create(name="Novel", author=user)
+        other = Book.objects.create(name="Notes", author=user)
+        record(book, user, Activity.BOOK_CREATED)
+        record(other, user, Activity.BOOK_CREATED)
+        other.delete()
+        self.assertEqual(activity_buffer.flush(), 1)
+        self.assertEqual(list(Activity.objects.values_list("book", flat=True)), [book.pk])
+
+
+class TestSearchView(TestCase, TestLoginRequired):
+    def setUp(self) -> None:
+        self.url = reverse("books:search")
+        self.user = User.objects.create_user(username="test", password="test")
+        self.user2 = User.objects.create_user(username="test2", password="test")
+        self.book = Book.objects.create(name="test", author=self.user)
+        self.section = Section.objects.create(
+            title="The harbour", content="The <b>lighthouse</b> keeper climbed the stairs.", book=self.book, author=self.user
+        )
+        self.other = Section.objects.create(title="Lighthouse", content="", book=self.book, author=self.user)
+        private = Book.objects.create(name="private", author=self.user2)
+        Section.objects.create(title="lighthouse", content="lighthouse", book=private, author=self.user2)
+
+    def search(self, query, **params):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url, {"q": query, **params})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "books/search.html")
+        return response.context["results"]
+
+    def test_ranked_and_scoped(self):
+        results = self.search("lighthouse")
+        self.assertEqual([result.section_id for result in results], [self.other.pk, self.section.pk])
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        result = self.search("keeper")[0]
+        self.assertIn("<mark>keeper</mark>", result.snippet)
+        self.assertIn("&lt;b&gt;", result.snippet)
+
+    def test_index_follows_saves_and_deletes(self):
+        self.section.content = "A storm rolled in."
+        self.section.save()
+        self.assertEqual([result.section_id for result in self.search("storm")], [self.section.pk])
+        self.assertEqual([result.section_id for result in self.search("keeper")], [])
+        self.section.delete()
+        self.assertEqual(self.search("storm"), [])
+
+    def test_operators_are_literal(self):
+        self.assertEqual(self.search('"light* OR NEAR('), [])
+
+    def test_book_scope(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url, {"q": "lighthouse", "book": self.book.pk + 1})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(self.url, {"q": "lighthouse", "book": "abc"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_rebuild_command(self):
+        get_backend().clear()
+        self.assertEqual(self.search("lighthouse"), [])
+        call_command("rebuild_search_index", batch_size=1, stdout=StringIO())
+        self.assertEqual(len(self.search("lighthouse")), 2)
+
+
+class TestBookExportView(TestCase, TestLoginRequired):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.book = Book.objects.create(name="My Book", author=self.user)
+        self.chapter = Section.objects.create(title="Chapter <1>", content="First\n\nSecond", book=self.book, author=self.user)
+        Section.objects.create(title="Scene", content="Inside", book=self.book, parent=self.chapter, author=self.user)
+        Section.objects.create(title="Chapter 2", content="Last", book=self.book, author=self.user)
+        self.url = reverse("books:export", kwargs={"pk": self.book.pk, "fmt": "md"})
+
+    def export(self, fmt):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("books:export", kwargs={"pk": self.book.pk, "fmt": fmt}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn(f'filename="my-book.{fmt}"', response["Content-Disposition"])
+        return b"".join(response.streaming_content)
+
+    def test_markdown(self):
+        content = self.export("md").decode()
+        self.assertEqual(
+            content,
+            "# My Book\n\n## Chapter <1>\n\nFirst\n\nSecond\n\n### Scene\n\nInside\n\n## Chapter 2\n\nLast\n\n",
+        )
+
+    def test_markdown_queries(self):
+        # the table of contents, then the content of up to CHUNK_SIZE sections per query
+        with self.assertNumQueries(2):
+            b"".join(export_markdown(self.book))
+
+    def test_html(self):
+        content = self.export("html").decode()
+        self.assertIn("<h2>Chapter &lt;1&gt;</h2>", content)
+        self.assertIn("<p>First</p>", content)
+        self.assertLess(content.index("Inside"), content.index("Last"))
+
+    def test_epub(self):
+        archive = zipfile.ZipFile(BytesIO(self.export("epub")))
+        self.assertEqual(archive.namelist()[0], "mimetype")
+        self.assertEqual(archive.read("mimetype"), b"application/epub+zip")
+        self.assertIn(f"OEBPS/section-{self.chapter.pk}.xhtml", archive.namelist())
+        self.assertIn(b"Chapter 2", archive.read("OEBPS/nav.xhtml"))
+
+    def test_unknown_format(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("books:export", kwargs={"pk": self.book.pk, "fmt": "pdf"}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_user(self):
+        user2 = User.objects.create_user(username="test2", password="test")
+        self.client.force_login(user2)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "book.html")
+            call_command("export_book", self.book.pk, format="html", output=output, stdout=StringIO())
+            with open(output) as fh:
+                self.assertIn("Chapter 2", fh.read())
+
+
+class TestFragmentCache(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.user2 = User.objects.create_user(username="test2", password="test", first_name="Second", last_name="User")
+        self.book = Book.objects.create(name="test", author=self.user)
+        self.section = Section.objects.create(title="chapter", content="old text", book=self.book, author=self.user)
+        self.book_url = reverse("books:detail", kwargs={"pk": self.book.pk})
+        self.section_url = reverse("books:section-detail", kwargs={"pk": self.book.pk, "section_pk": self.section.pk})
+        # generations move on commit, which a TestCase never reaches; ids of earlier tests come back
+        get_cache().clear()
+        reset_fragment_cache_stats()
+
+    def test_repeat_hits_cache(self):
+        self.client.force_login(self.user)
+        self.client.get(self.book_url)
+        with CaptureQueriesContext(connection) as cached:
+            response = self.client.get(self.book_url)
+        self.assertContains(response, "chapter")
+        self.assertEqual(fragment_cache_stats()["toc"], {"hits": 1, "misses": 1})
+        self.assertFalse(any('"books_section"."title"' in query["sql"] for query in cached))
+
+    def test_section_edit_invalidates(self):
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(self.section_url), "old text")
+        self.section.content = "new text"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.section.save()
+        response = self.client.get(self.section_url)
+        self.assertContains(response, "new text")
+        self.assertEqual(fragment_cache_stats()["section"], {"hits": 0, "misses": 2})
+
+    def test_fresh_after_commit(self):
+        def titles():
+            return ",".join(self.book.sections.values_list("title", flat=True))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Section.objects.filter(pk=self.section.pk).update(title="renamed")
+                book_changed(self.book.pk)
+                # another connection reading now still sees the committed rows
+                BookFragments(self.book.pk).get("titles", lambda: "chapter")
+        self.assertEqual(BookFragments(self.book.pk).get("titles", titles), "renamed")
+
+    def test_collaborator_change_invalidates(self):
+        self.client.force_login(self.user)
+        self.assertNotContains(self.client.get(self.book_url), "Second User")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.collaborators.add(self.user2)
+        self.assertContains(self.client.get(self.book_url), "Second User")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.collaborators.remove(self.user2)
+        self.assertNotContains(self.client.get(self.book_url), "Second User")
+
+    def test_fragments_are_not_per_user(self):
+        self.book.collaborators.add(self.user2)
+        self.client.force_login(self.user)
+        response = self.client.get(self.book_url)
+        self.assertContains(response, 'form="delete-section-form"')
+        self.assertNotIn("csrfmiddlewaretoken", response.context["toc_html"])
+        self.client.force_login(self.user2)
+        response = self.client.get(self.book_url)
+        self.assertNotContains(response, 'form="delete-section-form"')
+        self.assertNotContains(response, 'id="delete-section-form"')
+
+
+class TestFragmentCacheCheck(SimpleTestCase):
+    def test_warns_about_a_per_process_cache(self):
+        locmem = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        shared = {"default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": "/tmp/bw-cache"}}
+        with override_settings(CACHES=locmem):
+            self.assertEqual([warning.id for warning in fragment_cache_is_shared(None)], ["books.W001"])
+        with override_settings(CACHES=shared):
+            self.assertEqual(fragment_cache_is_shared(None), [])
+
+
+class TestConditionalGet(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.book = Book.objects.create(name="test", author=self.user)
+        self.section = Section.objects.create(title="chapter", content="text", book=self.book, author=self.user)
+        self.urls = [
+            reverse("books:home"),
+            reverse("books:detail", kwargs={"pk": self.book.pk}),
+            reverse("books:section-detail", kwargs={"pk": self.book.pk, "section_pk": self.section.pk}),
+        ]
+        self.client.force_login(self.user)
+
+    def test_not_modified(self):
+        for url in self.urls:
+            self.client.get(url)  # first visit sets the CSRF cookie, which is part of the ETag
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("Cookie", response["Vary"])
+            self.assertIn("Last-Modified", response)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(response.status_code, 304)
+            self.assertIn("Cookie", response["Vary"])
+
+    def test_validator_does_not_load_content(self):
+        with CaptureQueriesContext(connection) as queries:
+            book_last_modified(self.user, self.book.pk)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("content", queries[0]["sql"])
+
+    def test_section_changes_modify(self):
+        etags = [self.client.get(url)["ETag"] for url in self.urls]
+        self.section.title = "renamed"
+        self.section.save()
+        for url, etag in zip(self.urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_deletes_modify(self):
+        url = self.urls[1]
+        etag = self.client.get(url)["ETag"]
+        Section.objects.create(title="other", book=self.book, author=self.user).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_trash_and_restore_modify_dashboard(self):
+        Book.objects.create(name="other", author=self.user)
+        url = self.urls[0]
+        self.client.get(url)
+        etags = [self.client.get(url)["ETag"]]
+        trash_book(self.book)
+        etags.append(self.client.get(url, HTTP_IF_NONE_MATCH=etags[-1])["ETag"])
+        self.assertEqual(dashboard_last_modified(self.user)[1], 1)
+        restore_book(Book.all_objects.get(pk=self.book.pk))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[-1])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(set(etags + [response["ETag"]])), 3)
+
+    def test_etag_is_per_user(self):
+        user2 = User.objects.create_user(username="test2", password="test")
+        self.book.collaborators.add(user2)
+        etag = self.client.get(self.urls[1])["ETag"]
+        self.client.force_login(user2)
+        self.assertEqual(self.client.get(self.urls[1], HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_no_access(self):
+        user2 = User.objects.create_user(username="test2", password="test")
+        self.client.force_login(user2)
+        self.assertEqual(self.client.get(self.urls[1], HTTP_IF_NONE_MATCH="*").status_code, 404)
+
+
+class TestDelta(SimpleTestCase):
+    def test_round_trip(self):
+        old = "one\ntwo\nthree\nfour\n"
+        new = "one\n2\nthree\nfour\nfive"
+        delta = make_delta(old, new)
+        self.assertEqual(apply_delta(old, delta), new)
+        self.assertEqual(delta, [4, -4, "2\n", 11, "five"])
+
+    def test_rejects_delta_for_other_text(self):
+        with self.assertRaises(DeltaError):
+            apply_delta("short", [10])
+        with self.assertRaises(DeltaError):
+            apply_delta("longer text", [3])
+        with self.assertRaises(DeltaError):
+            apply_delta("text", [True])
+
+
+@override_settings(SECTION_REVISION_SNAPSHOT_INTERVAL=3)
+class TestSectionRevisions(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.book = Book.objects.create(name="test", author=self.user)
+        self.section = Section.objects.create(title="chapter", content="v1", book=self.book, author=self.user)
+        record_revision(self.section, author=self.user)
+        self.url = reverse("books:update-section", kwargs={"pk": self.book.pk, "section_pk": self.section.pk})
+        self.client.force_login(self.user)
+
+    def edit(self, content):
+        self.client.post(self.url, {"title": "chapter", "content": content})
+
+    def test_snapshots_and_deltas(self):
+        for i in range(2, 8):
+            self.edit(f"v1\nline {i}")
+        revisions = list(self.section.revisions.order_by("number"))
+        self.assertEqual([r.number for r in revisions], list(range(1, 8)))
+        self.assertEqual([r.is_snapshot for r in revisions], [True, False, False, True, False, False, True])
+        for revision in revisions:
+            expected = "v1" if revision.number == 1 else f"v1\nline {revision.number}"
+            self.assertEqual(rebuild(revision), expected)
+
+    def test_unchanged_save_adds_nothing(self):
+        self.edit("v1")
+        self.assertEqual(self.section.revisions.count(), 1)
+
+    def test_numbering_locks_the_section(self):
+        self.section.content = "v2"
+        with CaptureQueriesContext(connection) as queries:
+            record_revision(self.section, author=self.user, previous_content="v1")
+        lock = next(query["sql"] for query in queries.captured_queries if query["sql"].startswith("SELECT"))
+        self.assertIn('FROM "books_section"', lock)
+        if connection.features.has_select_for_update:
+            self.assertIn("FOR UPDATE", lock)
+        self.assertEqual(self.section.revisions.order_by("-number").first().number, 2)
+
+    def test_out_of_band_change_writes_snapshot(self):
+        Section.objects.filter(pk=self.section.pk).update(content="changed elsewhere")
+        self.edit("edited")
+        revision = self.section.revisions.get(number=2)
+        self.assertTrue(revision.is_snapshot)
+        self.assertEqual(rebuild(revision), "edited")
+
+    def test_list_and_restore(self):
+        self.edit("v2")
+        response = self.client.get(reverse("books:section-revisions", kwargs={"pk": self.book.pk, "section_pk": self.section.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r.number for r in response.context["revisions"]], [2, 1])
+        response = self.client.post(
+            reverse("books:restore-section-revision", kwargs={"pk": self.book.pk, "section_pk": self.section.pk, "number": 1})
+        )
+        self.assertEqual(response.status_code, 302)
+        self.section.refresh_from_db()
+        self.assertEqual(self.section.content, "v1")
+        self.assertEqual(self.section.revisions.count(), 3)
+
+    def test_restore_bumps_version(self):
+        self.edit("v2")
+        self.section.refresh_from_db()
+        stale_version = self.section.version
+        self.client.post(
+            reverse("books:restore-section-revision", kwargs={"pk": self.book.pk, "section_pk": self.section.pk, "number": 1})
+        )
+        self.section.refresh_from_db()
+        self.assertEqual(self.section.version, stale_version + 1)
+        response = self.client.post(self.url, {"title": "chapter", "content": "stale", "version": stale_version})
+        self.assertEqual(response.status_code, 409)
+        self.section.refresh_from_db()
+        self.assertEqual(self.section.content, "v1")
+
+    def test_restore_conflict(self):
+        self.edit("v2")
+        url = reverse("books:restore-section-revision", kwargs={"pk": self.book.pk, "section_pk": self.section.pk, "number": 1})
+        with mock.patch("books.views.save_section", side_effect=VersionConflict(5)):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 409)
+        self.assertContains(response, "Someone else saved this section", status_code=409)
+        self.assertEqual(self.section.revisions.count(), 2)
+
+    def test_restore_requires_access(self):
+        user2 = User.objects.create_user(username="test2", password="test")
+        self.client.force_login(user2)
+        url = reverse("books:restore-section-revision", kwargs={"pk": self.book.pk, "section_pk": self.section.pk, "number": 1})
+        self.assertEqual(self.client.post(url).status_code, 404)
+
+    def test_compact(self):
+        for i in range(2, 9):
+            self.edit(f"v1\nline {i}")
+        SectionRevision.objects.update(created_at=timezone.now() - timedelta(days=60))
+        call_command("compact_revisions", keep=3, older_than=30, stdout=StringIO())
+        revisions = list(self.section.revisions.order_by("number"))
+        self.assertEqual([r.number for r in revisions], [6, 7, 8])
+        self.assertTrue(revisions[0].is_snapshot)
+        self.assertEqual([r.base for r in revisions], [6, 7, 7])
+        self.assertEqual([rebuild(r) for r in revisions], [f"v1\nline {i}" for i in (6, 7, 8)])
+
+
+class TestSectionPatchView(TestCase, TestLoginRequired):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.book = Book.objects.create(name="test", author=self.user)
+        self.section = Section.objects.create(title="test", content="one\ntwo\n", book=self.book, author=self.user)
+        self.url = reverse("books:patch-section", kwargs={"pk": self.book.pk, "section_pk": self.section.pk})
+
+    def patch(self, data):
+        return self.client.post(self.url, json.dumps(data), content_type="application/json")
+
+    def test_patch(self):
+        self.client.force_login(self.user)
+        response = self.patch({"version": 1, "delta": make_delta("one\ntwo\n", "one\n2\n")})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["version"], 2)
+        self.section.refresh_from_db()
+        self.assertEqual((self.section.content, self.section.version), ("one\n2\n", 2))
+        self.assertEqual(self.section.revisions.count(), 2)
+
+    def test_patch_conflict(self):
+        self.client.force_login(self.user)
+        self.patch({"version": 1, "delta": [8, "three\n"]})
+        response = self.patch({"version": 1, "delta": [-8, "zero\n"]})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["version"], 2)
+        self.section.refresh_from_db()
+        self.assertEqual(self.section.content, "one\ntwo\nthree\n")
+
+    def test_patch_bad_delta(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.patch({"version": 1, "delta": [3]}).status_code, 400)
+        self.assertEqual(self.patch({"delta": [8]}).status_code, 400)
+        self.section.refresh_from_db()
+        self.assertEqual(self.section.version, 1)
+
+    def test_patch_other_user(self):
+        self.client.force_login(User.objects.create_user(username="test2", password="test"))
+        self.assertEqual(self.patch({"version": 1, "delta": [8]}).status_code, 404)
+
+    def test_login_required(self):
+        response = self.client.post(self.url, "{}", content_type="application/json")
+        self.assertRedirects(response, f"{reverse('accounts:login')}?next={self.url}")
+
+
+class TestStats(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.book = Book.objects.create(name="Novel", author=self.user)
+        self.other = Book.objects.create(name="Notes", author=self.user)
+        self.part = Section.objects.create(title="part", content="one two", book=self.book, author=self.user)
+        self.chapter = Section.objects.create(title="chapter", content="three four five", book=self.book, parent=self.part, author=self.user)
+        self.scene = Section.objects.create(title="scene", content="six", book=self.book, parent=self.chapter, author=self.user)
+
+    def totals(self, *sections):
+        return [
+            (section.subtree_word_count, section.subtree_section_count)
+            for section in Section.all_objects.filter(pk__in=[s.pk for s in sections]).order_by("path")
+        ]
+
+    def book_totals(self, book):
+        book = Book.all_objects.get(pk=book.pk)
+        return book.word_count, book.char_count, book.section_count
+
+    def assert_recounted(self):
+        for book in (self.book, self.other):
+            self.assertEqual(recount_book(book.pk, chunk_size=2), 0)
+
+    def test_saves_roll_up(self):
+        self.assertEqual(self.totals(self.part, self.chapter, self.scene), [(6, 3), (4, 2), (1, 1)])
+        self.assertEqual(self.book_totals(self.book), (6, 25, 3))
+        self.scene.content = "six seven eight"
+        self.scene.save()
+        self.assertEqual(self.totals(self.part, self.chapter, self.scene), [(8, 3), (6, 2), (3, 1)])
+        self.assertEqual(Section.objects.get(pk=self.scene.pk).char_count, 15)
+        self.assert_recounted()
+
+    def test_stale_instances_do_not_overwrite_totals(self):
+        stale = Section.objects.get(pk=self.part.pk)
+        Section.objects.create(title="more", content="a b c", book=self.book, parent=self.part, author=self.user)
+        stale.title = "renamed"
+        stale.save()
+        self.assertEqual(self.totals(self.part), [(9, 4)])
+        self.assert_recounted()
+
+    def test_versioned_save(self):
+        self.chapter.content = "three"
+        save_section(self.chapter, self.chapter.version)
+        self.assertEqual(self.totals(self.part, self.chapter), [(4, 3), (2, 2)])
+        self.assert_recounted()
+
+    def test_moves(self):
+        self.chapter.parent = None
+        self.chapter.save()
+        self.assertEqual(self.totals(self.part, self.chapter), [(2, 1), (4, 2)])
+        move_section(self.chapter, self.part.pk)
+        self.assertEqual(self.totals(self.part), [(6, 3)])
+        move_subtree(self.chapter, self.other)
+        self.assertEqual(self.totals(self.part, self.chapter), [(2, 1), (4, 2)])
+        self.assertEqual(self.book_totals(self.book)[::2], (2, 1))
+        self.assertEqual(self.book_totals(self.other)[::2], (4, 2))
+        self.assert_recounted()
+
+    def test_trash_and_delete(self):
+        trash_section(self.scene)
+        trash_section(self.chapter)
+        self.assertEqual(self.totals(self.part, self.chapter), [(2, 1), (3, 1)])
+        self.assertEqual(self.book_totals(self.book)[::2], (2, 1))
+        self.assert_recounted()
+        restore_section(Section.all_objects.get(pk=self.chapter.pk))
+        self.assertEqual(self.totals(self.part), [(5, 2)])
+        self.assert_recounted()
+        Section.objects.get(pk=self.chapter.pk).delete()
+        self.assertEqual(self.totals(self.part), [(2, 1)])
+        self.assertEqual(self.book_totals(self.book), (2, 7, 1))
+
+    def test_clone_and_import(self):
+        clone = clone_book(self.book, self.user)
+        self.assertEqual(self.book_totals(clone), self.book_totals(self.book))
+        self.assertEqual(recount_book(clone.pk), 0)
+        source = tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False)
+        self.addCleanup(os.unlink, source.name)
+        rows = [
+            {"type": "book", "id": 1, "name": "Dune", "author": "test"},
+            {"type": "section", "id": "a", "book": 1, "parent": None, "title": "A", "content": "x y"},
+            {"type": "section", "id": "b", "book": 1, "parent": "a", "title": "B", "content": "z"},
+        ]
+        source.write("\n".join(json.dumps(row) for row in rows))
+        source.close()
+        call_command("import_books", source.name, batch_size=2, stdout=StringIO())
+        imported = Book.objects.get(name="Dune")
+        self.assertEqual(self.book_totals(imported), (3, 4, 2))
+        self.assertEqual(recount_book(imported.pk), 0)
+
+    def test_recount_command(self):
+        Section.objects.filter(pk=self.chapter.pk).update(word_count=0, subtree_word_count=99)
+        Book.objects.filter(pk=self.book.pk).update(section_count=0, updated_at=timezone.now() - timedelta(days=1))
+        generations = {book.pk: get_generation(book.pk) for book in (self.book, self.other)}
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("recount_stats", chunk_size=1, stdout=out)
+        self.assertIn("Fixed 2 rows.", out.getvalue())
+        # only the book that drifted is invalidated
+        self.assertNotEqual(get_generation(self.book.pk), generations[self.book.pk])
+        self.assertEqual(get_generation(self.other.pk), generations[self.other.pk])
+        self.assertGreater(Book.objects.get(pk=self.book.pk).updated_at, timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.totals(self.part, self.chapter), [(6, 3), (4, 2)])
+        self.assertEqual(self.book_totals(self.book), (6, 25, 3))
+
+    def test_dashboard(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("books:home"), {"sort": "longest"})
+        self.assertEqual([book.name for book in response.context["books"]], ["Novel", "Notes"])
+        self.assertContains(response, "(1 min)")
+
+
+class TestImportBooks(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as fh:
+            fh.write(text)
+        return path
+
+    def test_markdown(self):
+        self.write("dune.md", "# Dune\n\n## Book One\n\nIntro\n\n### Chapter 1\n\n```\n## not a heading\n```\n\n## Book Two\n")
+        out = StringIO()
+        call_command("import_books", self.directory.name, author="test", stdout=out)
+        self.assertIn("Imported 1 books and 3 sections", out.getvalue())
+
+        book = Book.objects.for_user(self.user).get()
+        self.assertEqual(book.name, "Dune")
+        toc = TableOfContents.for_book(book)
+        self.assertEqual([(node.title, node.depth) for node in toc], [("Book One", 0), ("Chapter 1", 1), ("Book Two", 0)])
+        chapter = book.sections.get(title="Chapter 1")
+        self.assertEqual(chapter.parent.title, "Book One")
+        self.assertEqual(chapter.content, "```\n## not a heading\n```")
+        self.assertEqual(path_ids(chapter.path), [chapter.parent_id, chapter.pk])
+        if get_backend() is not None:
+            self.assertEqual([result.section_id for result in search_sections(self.user, "intro")], [chapter.parent_id])
+
+    def test_jsonl_resume(self):
+        rows = [
+            {"type": "book", "id": 1, "name": "Dune", "author": "test"},
+            {"type": "section", "id": "a", "book": 1, "parent": None, "title": "A"},
+            {"type": "section", "id": "b", "book": 1, "parent": "a", "title": "B", "content": "text"},
+            {"type": "section", "id": "c", "book": 1, "parent": "missing", "title": "C"},
+        ]
+        source = self.write("dump.jsonl", "\n".join(json.dumps(row) for row in rows))
+        with self.assertRaisesMessage(CommandError, "dump.jsonl:4: parent 'missing'"):
+            call_command("import_books", source, batch_size=2, stdout=StringIO())
+        self.assertEqual(Section.objects.count(), 1)
+        self.assertTrue(os.path.exists(source + ".checkpoint"))
+
+        rows[-1]["parent"] = "b"
+        self.write("dump.jsonl", "\n".join(json.dumps(row) for row in rows))
+        out = StringIO()
+        call_command("import_books", source, batch_size=2, stdout=out)
+        self.assertIn("Resuming after 2 records", out.getvalue())
+        self.assertFalse(os.path.exists(source + ".checkpoint"))
+
+        self.assertEqual(Book.objects.count(), 1)
+        c = Section.objects.get(title="C")
+        self.assertEqual([Section.objects.get(pk=pk).title for pk in path_ids(c.path)], ["A", "B", "C"])
+        self.assertEqual(c.author, self.user)
+
+    def test_unknown_author(self):
+        source = self.write("dump.jsonl", json.dumps({"type": "book", "id": 1, "name": "Dune", "author": "nobody"}))
+        with self.assertRaisesMessage(CommandError, "unknown user 'nobody'"):
+            call_command("import_books", source, stdout=StringIO())
+        self.assertFalse(Book.objects.exists())
+
+
+class TestBenchmark(TestCase):
+    def test_seed_and_benchmark(self):
+        call_command("seed_benchmark", users=3, books=1, depth=2, width=2, words=5, revisions=2, stdout=StringIO())
+        self.assertEqual(Book.objects.count(), 3)
+        self.assertEqual(Section.objects.count(), 3 * (2 + 4))
+        self.assertEqual(BookCollaborator.objects.count(), 3 * 2)
+        user = User.objects.get(username="bench0")
+        self.assertTrue(self.client.login(username="bench0", password="bench"))
+        self.assertEqual(Book.objects.for_user(user).count(), 3)
+
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = os.path.join(directory, "baseline.json")
+            out = StringIO()
+            call_command("benchmark", repeat=1, baseline=baseline, save=True, stdout=out)
+            self.assertIn("books:section-revision ", out.getvalue())
+            with open(baseline) as fh:
+                data = json.load(fh)
+            self.assertIn("accounts:login", data["results"])
+            self.assertNotIn("books:delete", data["results"])
+
+            data["results"]["books:detail"]["queries"] = 0
+            with open(baseline, "w") as fh:
+                json.dump(data, fh)
+            with self.assertRaisesMessage(CommandError, "books:detail"):
+                call_command("benchmark", repeat=1, baseline=baseline, only=["books:detail"], stdout=StringIO())
+
+    def test_flush_keeps_other_accounts(self):
+        benchley = User.objects.create_user(username="benchley", email="benchley@example.com")
+        User.objects.create_user(username="bench7", email="someone@example.com")
+        Book.objects.create(name="mine", author=benchley)
+        options = dict(users=2, books=1, depth=1, width=1, words=5, revisions=0, stdout=StringIO())
+        call_command("seed_benchmark", **options)
+        with self.assertRaisesMessage(CommandError, "already exist"):
+            call_command("seed_benchmark", **options)
+        call_command("seed_benchmark", flush=True, **options)
+        self.assertEqual(set(User.objects.values_list("username", flat=True)), {"benchley", "bench7", "bench0", "bench1"})
+        self.assertTrue(Book.objects.filter(author=benchley).exists())
+        with self.assertRaisesMessage(CommandError, "bench7"):
+            call_command("seed_benchmark", flush=True, **{**options, "users": 8})
+        self.assertEqual(User.objects.filter(username__in=["bench0", "bench7"]).count(), 2)
+
+    def test_index_report(self):
+        call_command("seed_benchmark", users=2, books=1, depth=2, width=2, words=5, revisions=2, stdout=StringIO())
+        out = StringIO()
+        call_command("index_report", check=True, stdout=out)
+        self.assertIn("books:toc", out.getvalue())
+        self.assertIn("books_sect_book_path_idx", out.getvalue())
+        self.assertIn("0 queries with full table scans.", out.getvalue())
+
+    def test_full_scans(self):
+        self.assertEqual(full_scans("SCAN books_section\nSEARCH auth_user USING INTEGER PRIMARY KEY"), ["books_section"])
+        self.assertEqual(full_scans("SCAN books_book USING INDEX books_book_updated_idx"), [])
+        self.assertEqual(full_scans("Seq Scan on books_section  (cost=0.00..1.01 rows=1)"), ["books_section"])
+
+
+@override_settings(SQL_INSTRUMENTATION=True, SQL_INSTRUMENTATION_N1_THRESHOLD=3)
+class TestQueryInstrumentation(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.book = Book.objects.create(name="test", author=self.user)
+        for i in range(3):
+            Section.objects.create(title=f"Section {i}", book=self.book, author=self.user)
+
+    def test_server_timing_and_log(self):
+        self.client.force_login(self.user)
+        with self.assertLogs("book_writer.sql", "INFO") as logs:
+            response = self.client.get(reverse("books:detail", kwargs={"pk": self.book.pk}))
+        self.assertRegex(response["Server-Timing"], r'^db;desc="\d+ queries";dur=[\d.]+, total;dur=[\d.]+$')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((record["path"], record["status"], record["n_plus_one"]), (response.wsgi_request.path, 200, []))
+        self.assertGreater(record["queries"], 0)
+
+    def test_n_plus_one_origin(self):
+        recorder = QueryRecorder(threshold=3)
+        template = Template(
+            "{% for section in sections %}\n{{ section.author.username }}\n{% endfor %}",
+            origin=Origin("loop.html", template_name="loop.html"),
+        )
+        with connection.execute_wrapper(recorder):
+            template.render(Context({"sections": Section.objects.all()}))
+        (repeated,) = recorder.repeated()
+        self.assertEqual((repeated["count"], repeated["origin"]), (3, "loop.html:2"))
+        self.assertIn('"auth_user"', repeated["sql"])
+
+    def test_sql_template(self):
+        self.assertEqual(
+            sql_template("SELECT 1 FROM t WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21"),
+            "SELECT ? FROM t WHERE id IN (%s, ...) AND name = ? LIMIT ?",
+        )
+
+    @override_settings(SQL_INSTRUMENTATION=False)
+    def test_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            QueryInstrumentationMiddleware(lambda request: None)
+
+
+@override_settings(DATABASE_REPLICAS=["replica1", "replica2"], DATABASE_PIN_SECONDS=30)
+class TestReplicaRouting(SimpleTestCase):
+    def setUp(self) -> None:
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        self.reads = []
+        self.middleware = ReplicaMiddleware(self.view)
+
+    def view(self, request):
+        self.reads.append(self.router.db_for_read(Book))
+        if request.GET.get("write") or request.method == "POST":
+            self.router.db_for_write(Book)
+            self.reads.append(self.router.db_for_read(Book))
+        return HttpResponse()
+
+    def test_safe_requests_read_from_a_replica(self):
+        for _ in range(10):
+            self.middleware(self.factory.get("/"))
+        self.assertTrue(set(self.reads) <= {"replica1", "replica2"})
+        # outside a request, e.g. in the job worker
+        self.assertEqual(self.router.db_for_read(Book), "default")
+
+    def test_a_request_that_writes_reads_its_write(self):
+        self.middleware(self.factory.get("/", {"write": 1}))
+        self.assertEqual(self.reads[1:], ["default"])
+        self.assertEqual(self.router.db_for_write(Book), "default")
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        response = self.middleware(self.factory.post("/"))
+        self.assertEqual(self.reads, ["default", "default"])
+        cookie = response.cookies["primary_until"]
+        self.assertEqual(cookie["max-age"], 30)
+        request = self.factory.get("/")
+        request.COOKIES["primary_until"] = cookie.value
+        self.middleware(request)
+        self.assertEqual(self.reads[-1], "default")
+        with mock.patch("time.time", return_value=time.time() + 31):
+            self.middleware(request)
+        self.assertIn(self.reads[-1], ["replica1", "replica2"])
+
+    async def test_async_requests(self):
+        async def view(request):
+            return self.view(request)
+
+        middleware = ReplicaMiddleware(view)
+        response = await middleware(self.factory.post("/"))
+        self.assertIn("primary_until", response.cookies)
+        await middleware(self.factory.get("/"))
+        self.assertEqual(self.reads[0], "default")
+        self.assertIn(self.reads[-1], ["replica1", "replica2"])
+
+    def test_replicas_are_not_migrated(self):
+        self.assertIs(self.router.allow_migrate("replica1", "books"), False)
+        self.assertIsNone(self.router.allow_migrate("default", "books"))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_disabled_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaMiddleware(self.view)
+        self.assertEqual(self.router.db_for_read(Book), "default")
+
+
+@skipUnless(settings.DATABASE_REPLICAS, "Set DATABASE_REPLICA_URLS to test against replica aliases.")
+class TestReplicaDatabases(TransactionTestCase):
+    databases = "__all__"
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.book = Book.objects.create(name="test", author=self.user)
+        self.client.force_login(self.user)
+
+    def replica_queries(self, method, url, **kwargs):
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in settings.DATABASE_REPLICAS]
+            response = getattr(self.client, method)(url, **kwargs)
+        return response, sum(len(queries) for queries in captured)
+
+    def test_reads_follow_the_pin(self):
+        url = reverse("books:detail", kwargs={"pk": self.book.pk})
+        response, queries = self.replica_queries("get", url)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(queries, 0)
+        self.replica_queries("post", reverse("books:update", kwargs={"pk": self.book.pk}), data={"name": "renamed"})
+        response, queries = self.replica_queries("get", url)
+        self.assertContains(response, "renamed")
+        self.assertEqual(queries, 0)
+
+
+class TestAsyncViews(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test", first_name="Ada")
+        self.book = Book.objects.create(name="test", author=self.user)
+        self.book.collaborators.add(User.objects.create_user(username="test2", first_name="Grace"))
+        self.chapter = Section.objects.create(title="Chapter", content="Text", book=self.book, author=self.user)
+        self.scene = Section.objects.create(title="Scene", book=self.book, parent=self.chapter, author=self.user)
+
+    async def get(self, name, **kwargs):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(reverse(name, kwargs=kwargs))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    async def test_book_list(self):
+        response = await self.get("books:book-list")
+        self.assertIs(response.resolver_match.func.view_class, AsyncBookListView)
+        self.assertEqual([book.name for book in response.context["books"]], ["test"])
+
+    async def test_book_detail(self):
+        response = await self.get("books:detail", pk=self.book.pk)
+        self.assertIs(response.resolver_match.func.view_class, AsyncBookDetailView)
+        self.assertContains(response, "Scene")
+        self.assertContains(response, "Grace")
+
+    async def test_section_detail(self):
+        response = await self.get("books:section-detail", pk=self.book.pk, section_pk=self.scene.pk)
+        self.assertIs(response.resolver_match.func.view_class, AsyncSectionDetailView)
+        self.assertEqual([node.id for node in response.context["breadcrumbs"]], [self.chapter.pk])
+
+    async def test_toc(self):
+        response = await self.get("books:toc", pk=self.book.pk)
+        self.assertContains(response, "Chapter")
+        not_modified = await self.async_client.get(
+            reverse("books:toc", kwargs={"pk": self.book.pk}), headers={"If-None-Match": response["ETag"]}
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    async def test_other_user(self):
+        other = await User.objects.acreate(username="other")
+        await sync_to_async(self.async_client.force_login)(other)
+        response = await self.async_client.get(reverse("books:detail", kwargs={"pk": self.book.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_login_required(self):
+        url = reverse("books:section-detail", kwargs={"pk": self.book.pk, "section_pk": self.scene.pk})
+        response = await self.async_client.get(url)
+        self.assertRedirects(response, f"{reverse('accounts:login')}?next={url}", fetch_redirect_response=False)
+
+    def test_wsgi_keeps_sync_views(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("books:toc", kwargs={"pk": self.book.pk}))
+        self.assertIs(response.resolver_match.func.view_class, BookTocView)
+        self.assertContains(response, "Scene")
+
+
+class TestBookEvents(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.member = User.objects.create_user(username="member", password="test")
+        self.book = Book.objects.create(name="test", author=self.user)
+        self.book.collaborators.add(self.member)
+        self.url = reverse("books:events", kwargs={"pk": self.book.pk})
+
+    async def open(self, user):
+        await sync_to_async(self.async_client.force_login)(user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await self.next(stream), "retry: 3000\n\n")
+        return stream
+
+    async def next(self, stream):
+        chunk = await asyncio.wait_for(anext(stream), 5)
+        return chunk.decode()
+
+    async def change(self, func):
+        def run():
+            with self.captureOnCommitCallbacks(execute=True):
+                return func()
+
+        return await sync_to_async(run)()
+
+    def event(self, chunk):
+        name, data = chunk.strip().split("\n")
+        return name.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+    async def test_section_events(self):
+        stream = await self.open(self.user)
+        section = await self.change(
+            lambda: Section.objects.create(title="Chapter", book=self.book, author=self.user)
+        )
+        name, data = self.event(await self.next(stream))
+        self.assertEqual(name, "section.created")
+        self.assertEqual(data, {
+            "type": "section.created", "book": self.book.pk, "id": section.pk,
+            "parent": None, "title": "Chapter", "version": 1,
+        })
+
+        section.title = "Renamed"
+        await self.change(section.save)
+        self.assertEqual(self.event(await self.next(stream))[1]["title"], "Renamed")
+
+        section_pk = section.pk
+        await self.change(section.delete)
+        self.assertEqual(self.event(await self.next(stream)), (
+            "section.deleted", {"type": "section.deleted", "book": self.book.pk, "id": section_pk},
+        ))
+        await stream.aclose()
+
+    async def test_removed_collaborator_stream_ends(self):
+        stream = await self.open(self.member)
+        await self.change(lambda: self.book.collaborators.remove(self.member))
+        name, data = self.event(await self.next(stream))
+        self.assertEqual((name, data["user"]), ("collaborator.removed", self.member.pk))
+        with self.assertRaises(StopAsyncIteration):
+            await self.next(stream)
+
+    @override_settings(BOOKS_EVENTS_HEARTBEAT=0.01)
+    async def test_heartbeat(self):
+        stream = await self.open(self.user)
+        self.assertEqual(await self.next(stream), ": ping\n\n")
+        await stream.aclose()
+
+    async def test_slow_client_is_reset(self):
+        hub = Hub()
+        subscriber = hub.subscribe(self.book.pk, self.user.pk, maxsize=2)
+        for number in range(5):
+            hub.deliver(self.book.pk, {"type": "section.updated", "id": number})
+        await asyncio.sleep(0)
+        self.assertEqual(subscriber.queue.qsize(), 1)
+        self.assertEqual(subscriber.queue.get_nowait(), {"type": "reset"})
+        hub.unsubscribe(subscriber)
+        self.assertEqual(hub.subscriber_count(), 0)
+
+    async def test_other_user(self):
+        other = await User.objects.acreate(username="other")
+        await sync_to_async(self.async_client.force_login)(other)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_not_served_by_wsgi(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+
+class TestApi(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test", password="test")
+        self.member = User.objects.create_user(username="member", password="test", first_name="Grace")
+        self.book = Book.objects.create(name="test", author=self.user)
+        self.book.collaborators.add(self.member)
+        self.chapter = Section.objects.create(title="Chapter", content="Text", book=self.book, author=self.user)
+        self.scene = Section.objects.create(title="Scene", content="More", book=self.book, parent=self.chapter, author=self.user)
+        self.other = Section.objects.create(
+            title="Hidden", book=Book.objects.create(name="other", author=self.member), author=self.member
+        )
+        self.client.force_login(self.user)
+
+    def batch(self, operations, user=None):
+        if user is not None:
+            self.client.force_login(user)
+        return self.client.post(
+            reverse("books:api-book-sections-batch", kwargs={"pk": self.book.pk}),
+            json.dumps({"operations": operations}),
+            content_type="application/json",
+        )
+
+    def test_books(self):
+        response = self.client.get(reverse("books:api-books"), {"fields": "id,name"})
+        self.assertEqual(response.json(), {"results": [{"id": self.book.pk, "name": "test"}], "next": None, "previous": None})
+        self.assertEqual(self.client.get(reverse("books:api-books"), {"fields": "secret"}).status_code, 400)
+
+    def test_sections_sparse_and_paginated(self):
+        url = reverse("books:api-book-sections", kwargs={"pk": self.book.pk})
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get(url, {"fields": "id,title,parent", "limit": 1}).json()
+        self.assertFalse(any('"content"' in query["sql"] for query in queries.captured_queries))
+        self.assertEqual(first["results"], [{"id": self.chapter.pk, "title": "Chapter", "parent": None}])
+        second = self.client.get(url, {"fields": "id,parent", "limit": 1, "cursor": first["next"]}).json()
+        self.assertEqual(second["results"], [{"id": self.scene.pk, "parent": self.chapter.pk}])
+        self.assertIsNone(second["next"])
+
+    def test_sections_in_reading_order(self):
+        url = reverse("books:api-book-sections", kwargs={"pk": self.book.pk})
+        epilogue = Section.objects.create(title="Epilogue", book=self.book, author=self.user)
+        move_section(epilogue, None, after_id=None)
+        titles = []
+        cursor = None
+        while True:
+            page = self.client.get(url, {"fields": "title", "limit": 2, **({"cursor": cursor} if cursor else {})}).json()
+            titles += [row["title"] for row in page["results"]]
+            cursor = page["next"]
+            if cursor is None:
+                break
+        self.assertEqual(titles, ["Epilogue", "Chapter", "Scene"])
+        previous = self.client.get(url, {"fields": "title", "limit": 2, "cursor": page["previous"]}).json()
+        self.assertEqual([row["title"] for row in previous["results"]], ["Epilogue", "Chapter"])
+        self.assertEqual(self.client.get(url, {"cursor": "bogus"}).status_code, 400)
+        for payload in (["n", "abc"], ["n", None], ["n", [1]]):
+            cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            self.assertEqual(self.client.get(url, {"cursor": cursor}).status_code, 400)
+        cursor = base64.urlsafe_b64encode(json.dumps(["n", str(epilogue.pk)]).encode()).decode()
+        self.assertEqual([row["title"] for row in self.client.get(url, {"fields": "title", "cursor": cursor}).json()["results"]], ["Chapter", "Scene"])
+
+    def test_collaborators(self):
+        response = self.client.get(reverse("books:api-book-collaborators", kwargs={"pk": self.book.pk}))
+        self.assertEqual([row["first_name"] for row in response.json()["results"]], ["Grace"])
+
+    def test_invite_collaborators(self):
+        invited = User.objects.create_user(username="invited", email="invited@example.com")
+        url = reverse("books:api-book-collaborators", kwargs={"pk": self.book.pk})
+        response = self.client.post(url, {"emails": ["Invited@example.com", "nobody@example.com"]}, content_type="application/json")
+        self.assertEqual(response.json(), {
+            "added": [{"id": invited.pk, "username": "invited", "email": "invited@example.com"}],
+            "existing": [],
+            "unknown": ["nobody@example.com"],
+            "invalid": [],
+        })
+        self.client.force_login(self.member)
+        response = self.client.post(url, {"emails": ["nobody@example.com"]}, content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+
+    def test_fetch_sections_by_id(self):
+        ids = f"{self.scene.pk},{self.other.pk},{self.chapter.pk}"
+        with self.assertNumQueries(3):  # session, user, sections
+            data = self.client.get(reverse("books:api-sections"), {"ids": ids, "fields": "id,content"}).json()
+        self.assertEqual(data["results"], [{"id": self.scene.pk, "content": "More"}, {"id": self.chapter.pk, "content": "Text"}])
+        self.assertEqual(data["missing"], [self.other.pk])
+
+    def test_batch_write(self):
+        response = self.batch([
+            {"op": "create", "ref": "part", "title": "Part", "parent": None},
+            {"op": "move", "id": self.chapter.pk, "parent": "part"},
+            {"op": "update", "id": self.scene.pk, "version": 1, "content": "Rewritten"},
+        ])
+        self.assertEqual(response.status_code, 200, response.content)
+        part_id = response.json()["results"][0]["id"]
+        self.scene.refresh_from_db()
+        self.assertEqual(path_ids(self.scene.path), [part_id, self.chapter.pk, self.scene.pk])
+        self.assertEqual((self.scene.content, self.scene.version), ("Rewritten", 2))
+
+    def test_batch_is_atomic(self):
+        response = self.batch([
+            {"op": "create", "title": "Part"},
+            {"op": "update", "id": self.scene.pk, "version": 7, "title": "Stale"},
+        ])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["index"], 1)
+        self.assertEqual(response.json()["version"], 1)
+        self.assertFalse(Section.objects.filter(title="Part").exists())
+
+    def test_batch_rejects_cycles_and_foreign_parents(self):
+        response = self.batch([{"op": "move", "id": self.chapter.pk, "parent": self.scene.pk}])
+        self.assertEqual(response.status_code, 400)
+        response = self.batch([{"op": "move", "id": self.chapter.pk, "parent": self.other.pk}])
+        self.assertEqual(response.status_code, 400)
+        self.chapter.refresh_from_db()
+        self.assertIsNone(self.chapter.parent_id)
+
+    def test_members_cannot_create(self):
+        response = self.batch([{"op": "create", "title": "Part"}], user=self.member)
+        self.assertEqual(response.status_code, 403)
+        response = self.batch([{"op": "update", "id": self.scene.pk, "title": "Edited"}], user=self.member)
+        self.assertEqual(response.status_code, 200)
+
+    def test_permissions(self):
+        outsider = User.objects.create_user(username="outsider")
+        self.client.force_login(outsider)
+        self.assertEqual(self.client.get(reverse("books:api-book", kwargs={"pk": self.book.pk})).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("books:api-books")).status_code, 401)
@@ -0,0 +1,149 @@
+"""
+Deleting books and sections through the trash.
+
+Deleting only sets ``deleted_at``: one UPDATE for a book, one for a section
+and its subtree, whatever their size.  ``Book.objects`` and
+``Section.objects`` leave those rows out (``all_objects`` keeps them) and
+search skips them, so they disappear at once and can be restored for
+``BOOKS_TRASH_RETENTION_DAYS``.
+
+After that the ``books.purge_trash`` job removes them ``PURGE_BATCH_SIZE``
+rows per transaction with plain ``DELETE ... WHERE id IN (...)``, instead of
+the ORM collector walking the ``parent`` cascade level by level.  Rows that
+point at a purged row go first: revisions and search entries of sections,
+sections deepest first, then the activity log, memberships and
+collaborators of books.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from books.cache import bump_generation
+from books.events import publish
+from books.models import Activity, Book, BookCollaborator, BookMembership, Section, SectionRevision
+from books.search import remove_sections
+from books.stats import SECTION_TOTALS, add_to_ancestors, subtree_counts
+from books.tree import TreeError
+from jobs.queue import enqueue
+
+PURGE_JOB = "books.purge_trash"
+PURGE_BATCH_SIZE = 1000
+
+
+def retention():
+    return timedelta(days=settings.BOOKS_TRASH_RETENTION_DAYS)
+
+
+def _schedule_purge(deleted_at):
+    enqueue(PURGE_JOB, run_at=deleted_at + retention() + timedelta(seconds=1))
+
+
+def trash_book(book):
+    now = timezone.now()
+    with transaction.atomic():
+        Book.objects.filter(pk=book.pk).update(deleted_at=now, updated_at=now)
+        _schedule_purge(now)
+    book.deleted_at = book.updated_at = now
+    bump_generation(book.pk)
+    publish(book.pk, "book.deleted")
+
+
+def trash_section(section):
+    """Move ``section`` and its subsections to the trash; returns the number of rows."""
+    from books.signals import book_changed
+
+    now = timezone.now()
+    with transaction.atomic():
+        section.refresh_from_db(fields=["path", *SECTION_TOTALS])
+        count = Section.objects.filter(book_id=section.book_id, path__startswith=section.path).update(deleted_at=now)
+        add_to_ancestors(section.path, section.book_id, -subtree_counts(section))
+        book_changed(section.book_id)
+        _schedule_purge(now)
+    section.deleted_at = now
+    publish(section.book_id, "section.deleted", id=section.pk)
+    return count
+
+
+def trashed_books(user):
+    """The user's books in the trash that can still be restored, newest first."""
+    return Book.all_objects.filter(author=user, deleted_at__gte=timezone.now() - retention()).order_by("-deleted_at")
+
+
+def trashed_sections(user):
+    """
+    The sections the user deleted from the books they write, one per delete:
+    subsections trashed along with their parent are left out.
+    """
+    return (
+        Section.all_objects.filter(book__in=user.books.all(), deleted_at__gte=timezone.now() - retention())
+        .exclude(parent__deleted_at=F("deleted_at"))
+        .select_related("book")
+        .order_by("-deleted_at")
+    )
+
+
+def restore_book(book):
+    now = timezone.now()
+    Book.all_objects.filter(pk=book.pk).update(deleted_at=None, updated_at=now)
+    book.deleted_at, book.updated_at = None, now
+    bump_generation(book.pk)
+    publish(book.pk, "book.restored")
+
+
+def restore_section(section):
+    """Bring back ``section`` with the subsections that were deleted with it."""
+    from books.signals import book_changed
+
+    if section.parent_id is not None and not Section.objects.filter(pk=section.parent_id).exists():
+        raise TreeError("Its parent section is in the trash, restore that first.")
+    with transaction.atomic():
+        section.refresh_from_db(fields=["path", *SECTION_TOTALS])
+        count = Section.all_objects.filter(
+            book_id=section.book_id, path__startswith=section.path, deleted_at=section.deleted_at
+        ).update(deleted_at=None)
+        add_to_ancestors(section.path, section.book_id, subtree_counts(section))
+        book_changed(section.book_id)
+    section.deleted_at = None
+    publish(section.book_id, "section.created", id=section.pk, parent=section.parent_id, title=section.title, version=section.version)
+    return count
+
+
+def _delete_in(model, column, ids):
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    placeholders = ", ".join(["%s"] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {quote(model._meta.db_table)} WHERE {quote(column)} IN ({placeholders})", list(ids))
+        return cursor.rowcount
+
+
+def purge(before=None, batch_size=PURGE_BATCH_SIZE):
+    """
+    Delete one batch of rows trashed before ``before`` (the end of the
+    retention window by default); returns the number of sections and books
+    removed, 0 once there is nothing left.
+    """
+    if before is None:
+        before = timezone.now() - retention()
+    with transaction.atomic():
+        # children sort before their parents, so no batch leaves a section without its parent
+        section_ids = list(
+            Section.all_objects.filter(Q(deleted_at__lt=before) | Q(book__deleted_at__lt=before))
+            .order_by("-depth", "pk")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if section_ids:
+            _delete_in(SectionRevision, "section_id", section_ids)
+            remove_sections(section_ids)
+            return _delete_in(Section, "id", section_ids)
+
+        book_ids = list(Book.all_objects.filter(deleted_at__lt=before).order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if book_ids:
+            _delete_in(Activity, "book_id", book_ids)
+            _delete_in(BookCollaborator, "book_id", book_ids)
+            _delete_in(BookMembership, "book_id", book_ids)
+            return _delete_in(Book, "id", book_ids)
+    return 0
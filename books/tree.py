@@ -0,0 +1,194 @@
+"""
+Materialized-path index over ``Section``.
+
+Every section stores the ids of its ancestors and itself as fixed-width
+segments in ``Section.path`` (``"0000000001/0000000007/"``) plus its
+``depth``.  Sorting a book's sections by path groups every subtree after its
+root, a subtree is a ``path__startswith`` range scan and the ancestors of a
+section can be read straight out of its path.  Siblings are put in reading
+order by their ``position`` (see ``books.ordering``) in memory.
+"""
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import CharField, F, Max, Value
+from django.db.models.functions import Concat, Substr
+
+SEGMENT_WIDTH = 10
+SEPARATOR = "/"
+
+
+class TreeError(ValueError):
+    pass
+
+
+def segment(pk):
+    return f"{pk:0{SEGMENT_WIDTH}d}{SEPARATOR}"
+
+
+def path_ids(path):
+    """Ids along a path, root first, ending with the section itself."""
+    return [int(part) for part in path.split(SEPARATOR) if part]
+
+
+def parent_id_from_path(path):
+    ids = path_ids(path)
+    return ids[-2] if len(ids) > 1 else None
+
+
+def is_placed(section):
+    """Whether ``section.path`` still agrees with its id and parent."""
+    if not section.path or path_ids(section.path)[-1] != section.pk:
+        return False
+    return parent_id_from_path(section.path) == section.parent_id
+
+
+def check_parent(section):
+    """
+    Raise ``TreeError`` unless the parent of ``section`` is a section of the
+    same book outside its subtree.  Returns the parent's path, ``""`` at the
+    top level, and keeps it for the ``place_section`` that follows the save.
+    """
+    from books.models import Section
+
+    parent_path = ""
+    if section.parent_id is not None:
+        parent = Section.objects.filter(pk=section.parent_id).values_list("book_id", "path").first()
+        if parent is None or parent[0] != section.book_id:
+            raise TreeError(f"Section {section.parent_id} is not in this book.")
+        parent_path = parent[1]
+        if section.pk is not None and section.pk in path_ids(parent_path):
+            raise TreeError("A section cannot be moved under itself or one of its subsections.")
+    height = 0
+    if section.path and len(parent_path) + len(segment(0)) > len(section.path):
+        # a move deeper takes the whole subtree along
+        height = Section.all_objects.filter(path__startswith=section.path).aggregate(height=Max("depth"))["height"]
+        height -= section.depth
+    check_depth(parent_path, height)
+    section._parent_path = parent_path
+    return parent_path
+
+
+def check_depth(parent_path, height=0):
+    """
+    Raise ``TreeError`` unless a subtree ``height`` levels deep still fits
+    in ``Section.path`` below ``parent_path``.
+    """
+    from books.models import Section
+
+    max_length = Section._meta.get_field("path").max_length
+    if len(parent_path) + (height + 1) * len(segment(0)) > max_length:
+        raise TreeError(f"Sections cannot be nested more than {max_length // len(segment(0))} levels deep.")
+
+
+def place_section(section, keep_position=False):
+    """
+    Bring the path of a saved section, and of its whole subtree, in line
+    with its current parent.  A no-op when nothing moved.  A section moved
+    to another parent goes after its new siblings unless ``keep_position``.
+    The parent was checked before the save (``check_parent``).
+    """
+    parent_path = section.__dict__.pop("_parent_path", None)
+    if is_placed(section):
+        return
+    from books.models import Section
+    from books.ordering import last_position
+    from books.stats import SECTION_TOTALS, Counts, move_totals
+
+    if parent_path is None:
+        parent_path = ""
+        if section.parent_id is not None:
+            parent_path = Section.objects.filter(pk=section.parent_id).values_list("path", flat=True).get()
+    new_path = parent_path + segment(section.pk)
+    new_depth = len(path_ids(new_path)) - 1
+    old_path = section.path
+
+    changes = {"path": new_path, "depth": new_depth}
+    if old_path and not keep_position and parent_id_from_path(old_path) != section.parent_id:
+        changes["position"] = last_position(section.book_id, section.parent_id, exclude=section.pk)
+
+    with transaction.atomic():
+        Section.objects.filter(pk=section.pk).update(**changes)
+        if old_path and old_path != new_path:
+            # Re-root every descendant in one statement, trashed ones included.
+            Section.all_objects.filter(path__startswith=old_path).exclude(pk=section.pk).update(
+                path=Concat(Value(new_path), Substr("path", len(old_path) + 1), output_field=CharField()),
+                depth=F("depth") + (new_depth - section.depth),
+            )
+            totals = Counts(*Section.all_objects.filter(pk=section.pk).values_list(*SECTION_TOTALS).get())
+            move_totals(totals, old_path, section.book_id, new_path, section.book_id)
+    for name, value in changes.items():
+        setattr(section, name, value)
+
+
+@dataclass
+class TocNode:
+    id: int
+    title: str
+    parent_id: int
+    depth: int
+    path: str
+    position: str = ""
+    children: list = field(default_factory=list, repr=False)
+
+
+def _sibling_order(node):
+    return node.position, node.id
+
+
+class TableOfContents:
+    """The sections of one book in reading order, built from one query."""
+
+    fields = ("id", "title", "parent_id", "depth", "path", "position")
+
+    def __init__(self, rows):
+        nodes = [TocNode(**row) for row in rows]
+        self.by_id = {node.id: node for node in nodes}
+        self.roots = []
+        for node in nodes:
+            parent = self.by_id.get(node.parent_id)
+            (parent.children if parent else self.roots).append(node)
+        self.roots.sort(key=_sibling_order)
+        for node in nodes:
+            node.children.sort(key=_sibling_order)
+        # depth first, each node before its children
+        self.nodes = []
+        stack = self.roots[::-1]
+        while stack:
+            node = stack.pop()
+            self.nodes.append(node)
+            stack.extend(reversed(node.children))
+        self.position = {node.id: index for index, node in enumerate(self.nodes)}
+
+    @classmethod
+    def for_book(cls, book):
+        return cls(book.sections.order_by("path").values(*cls.fields))
+
+    @classmethod
+    async def afor_book(cls, book):
+        return cls([row async for row in book.sections.order_by("path").values(*cls.fields)])
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, section_id):
+        return section_id in self.by_id
+
+    def breadcrumbs(self, section_id):
+        """Ancestors of a section, root first, excluding the section."""
+        node = self.by_id[section_id]
+        return [self.by_id[pk] for pk in path_ids(node.path)[:-1] if pk in self.by_id]
+
+    def children(self, section_id):
+        return self.by_id[section_id].children
+
+    def previous(self, section_id):
+        index = self.position[section_id]
+        return self.nodes[index - 1] if index > 0 else None
+
+    def next(self, section_id):
+        index = self.position[section_id]
+        return self.nodes[index + 1] if index + 1 < len(self.nodes) else None
@@ -1,16 +1,40 @@
 from django.urls import path
+from books.api import (
+    BookApiView,
+    BookListApiView,
+    CollaboratorListApiView,
+    SectionBatchApiView,
+    SectionListApiView,
+    SectionReorderApiView,
+    SectionWriteBatchApiView,
+)
+from books.async_views import BookEventsView
 from books.views import (
     BookListView,
     BookCreateView,
     BookDetailView,
+    BookExportView,
+    ActivityFeedView,
+    BookTocView,
     BookUpdateView,
     BookDeleteView,
+    BookCloneView,
     SectionCreateView,
     SectionDetailView,
     SectionUpdateView,
     SectionDeleteView,
+    SectionMoveView,
+    SectionPatchView,
+    SectionRevisionListView,
+    SectionRevisionDetailView,
+    SectionRevisionRestoreView,
     CollaboratorCreateView,
     CollaboratorDeleteView,
+    CollaboratorInviteView,
+    SearchView,
+    TrashView,
+    BookRestoreView,
+    SectionRestoreView,
 )
 
 app_name = "books"
@@ -19,14 +43,28 @@ urlpatterns = [
     path("", BookListView.as_view(), name="home"),
     path("books/", BookListView.as_view(), name="book-list"),
     path("books/add/", BookCreateView.as_view(), name="add"),
+    path("search/", SearchView.as_view(), name="search"),
+    path("trash/", TrashView.as_view(), name="trash"),
+    path("trash/books/<int:pk>/restore/", BookRestoreView.as_view(), name="restore-book"),
+    path("trash/sections/<int:section_pk>/restore/", SectionRestoreView.as_view(), name="restore-section"),
     path("books/<int:pk>/", BookDetailView.as_view(), name="detail"),
+    path("books/<int:pk>/toc/", BookTocView.as_view(), name="toc"),
+    path("books/<int:pk>/events/", BookEventsView.as_view(), name="events"),
+    path("books/<int:pk>/activity/", ActivityFeedView.as_view(), name="activity"),
+    path("books/<int:pk>/export/<str:fmt>/", BookExportView.as_view(), name="export"),
     path("books/<int:pk>/update/", BookUpdateView.as_view(), name="update"),
     path("books/<int:pk>/delete/", BookDeleteView.as_view(), name="delete"),
+    path("books/<int:pk>/clone/", BookCloneView.as_view(), name="clone"),
     path(
         "books/<int:pk>/collaborators/add/",
         CollaboratorCreateView.as_view(),
         name="add-collaborator",
     ),
+    path(
+        "books/<int:pk>/collaborators/invite/",
+        CollaboratorInviteView.as_view(),
+        name="invite-collaborators",
+    ),
     path(
         "books/<int:pk>/collaborators/<int:collaborator_pk>/delete/",
         CollaboratorDeleteView.as_view(),
@@ -52,4 +90,36 @@ urlpatterns = [
         SectionDeleteView.as_view(),
         name="delete-section",
     ),
+    path(
+        "books/<int:pk>/sections/<int:section_pk>/move/",
+        SectionMoveView.as_view(),
+        name="move-section",
+    ),
+    path(
+        "books/<int:pk>/sections/<int:section_pk>/patch/",
+        SectionPatchView.as_view(),
+        name="patch-section",
+    ),
+    path(
+        "books/<int:pk>/sections/<int:section_pk>/revisions/",
+        SectionRevisionListView.as_view(),
+        name="section-revisions",
+    ),
+    path(
+        "books/<int:pk>/sections/<int:section_pk>/revisions/<int:number>/",
+        SectionRevisionDetailView.as_view(),
+        name="section-revision",
+    ),
+    path(
+        "books/<int:pk>/sections/<int:section_pk>/revisions/<int:number>/restore/",
+        SectionRevisionRestoreView.as_view(),
+        name="restore-section-revision",
+    ),
+    path("api/books/", BookListApiView.as_view(), name="api-books"),
+    path("api/books/<int:pk>/", BookApiView.as_view(), name="api-book"),
+    path("api/books/<int:pk>/sections/", SectionListApiView.as_view(), name="api-book-sections"),
+    path("api/books/<int:pk>/sections/batch/", SectionWriteBatchApiView.as_view(), name="api-book-sections-batch"),
+    path("api/books/<int:pk>/sections/reorder/", SectionReorderApiView.as_view(), name="api-book-sections-reorder"),
+    path("api/books/<int:pk>/collaborators/", CollaboratorListApiView.as_view(), name="api-book-collaborators"),
+    path("api/sections/", SectionBatchApiView.as_view(), name="api-sections"),
 ]
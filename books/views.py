@@ -1,10 +1,30 @@
+import json
+
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views import View
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from django.contrib.auth.mixins import LoginRequiredMixin
 
-from books.forms import BookForm, SectionForm, CollaboratorForm
+from books.activity import buffer as activity_buffer, record
+from books.cache import BookFragments
+from books.concurrency import VersionConflict, save_section
+from books.conditional import ConditionalGetMixin, book_last_modified, dashboard_last_modified, make_etag
+from books.diff import DeltaError, apply_delta
+from books.exporters import EXPORTERS, export_filename
+from books.forms import BookForm, SectionForm, SectionMoveForm, CollaboratorForm, CollaboratorInviteForm
+from books.models import Activity, Book, Section
+from books.pagination import InvalidCursor, KeysetPaginator
+from books.restructure import clone_book, move_subtree
+from books.revisions import rebuild, record_revision
+from books.search import search_sections
+from books.tree import TableOfContents, TreeError
+from books.trash import (
+    restore_book, restore_section, retention, trash_book, trash_section, trashed_books, trashed_sections,
+)
 
-get_books = lambda user: user.books.all() | user.contributed_books.all()
+get_books = lambda user: Book.objects.for_user(user)
 
 class BookCreateView(LoginRequiredMixin, View):
     def post(self, request):
@@ -13,6 +33,7 @@ class BookCreateView(LoginRequiredMixin, View):
             book = form.save(commit=False)
             book.author = request.user
             book.save()
+            record(book, request.user, Activity.BOOK_CREATED)
             return redirect("books:detail", pk=book.pk)
         return render(request, "books/add_book.html", {"form": form})
     
@@ -21,16 +42,129 @@ class BookCreateView(LoginRequiredMixin, View):
         return render(request, "books/add_book.html", {"form": form})
 
 
-class BookListView(LoginRequiredMixin, View):
+class BookListView(LoginRequiredMixin, ConditionalGetMixin, View):
+    paginate_by = 25
+    sort_options = {
+        "updated": ("-updated_at", "Recently updated"),
+        "oldest-updated": ("updated_at", "Least recently updated"),
+        "created": ("-created_at", "Newest"),
+        "oldest-created": ("created_at", "Oldest"),
+        "name": ("name", "Name (A-Z)"),
+        "name-desc": ("-name", "Name (Z-A)"),
+        "longest": ("-word_count", "Most words"),
+    }
+    default_sort = "updated"
+
+    def get_validators(self, request):
+        last_modified, count = dashboard_last_modified(request.user)
+        if last_modified is None:
+            return None
+        return make_etag(request, "books", request.GET.urlencode(), count, last_modified.isoformat()), last_modified
+
     def get(self, request):
-        books = get_books(self.request.user)
-        return render(request, "books/books.html", {"books": books})
+        sort = request.GET.get("sort")
+        if sort not in self.sort_options:
+            sort = self.default_sort
+        books = get_books(request.user).with_dashboard_stats(request.user)
+        ordering, _ = self.sort_options[sort]
+        paginator = KeysetPaginator(books, ordering, per_page=self.paginate_by)
+        try:
+            page = paginator.page(request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404("Invalid cursor.")
+        return render(
+            request,
+            "books/books.html",
+            {
+                "books": page.object_list,
+                "page": page,
+                "sort": sort,
+                "sort_options": [(key, label) for key, (_, label) in self.sort_options.items()],
+            },
+        )
+
+
+class BookDetailView(LoginRequiredMixin, ConditionalGetMixin, View):
+    def get_validators(self, request, pk):
+        last_modified = book_last_modified(request.user, pk)
+        if last_modified is None:
+            return None
+        return make_etag(request, "book", pk, last_modified.isoformat()), last_modified
+
+    def get(self, request, pk):
+        book = get_object_or_404(get_books(self.request.user).select_related("author"), pk=pk)
+        is_author = book.author_id == request.user.id
+        variant = "author" if is_author else "member"
+        fragments = BookFragments(book.pk)
+        context = {"book": book, "is_author": is_author}
+        toc_html = fragments.get(
+            "toc",
+            lambda: render_to_string(
+                "books/partials/toc.html", {**context, "toc": TableOfContents.for_book(book)}
+            ),
+            variant=variant,
+        )
+        collaborators_html = fragments.get(
+            "collaborators",
+            lambda: render_to_string(
+                "books/partials/collaborators.html",
+                {**context, "collaborators": book.collaborators.only("id", "first_name", "last_name")},
+            ),
+            variant=variant,
+        )
+        return render(
+            request,
+            "books/book.html",
+            {**context, "toc_html": mark_safe(toc_html), "collaborators_html": mark_safe(collaborators_html)},
+        )
+
+
+class BookTocView(LoginRequiredMixin, ConditionalGetMixin, View):
+    """The table of contents of a book as an HTML fragment."""
 
+    def get_validators(self, request, pk):
+        last_modified = book_last_modified(request.user, pk)
+        if last_modified is None:
+            return None
+        return make_etag(request, "book", pk, last_modified.isoformat()), last_modified
 
-class BookDetailView(LoginRequiredMixin, View):
     def get(self, request, pk):
-        book = get_object_or_404(get_books(self.request.user), pk=pk)
-        return render(request, "books/book.html", {"book": book})
+        book = get_object_or_404(get_books(request.user), pk=pk)
+        is_author = book.author_id == request.user.id
+        context = {"book": book, "is_author": is_author}
+        html = BookFragments(book.pk).get(
+            "toc",
+            lambda: render_to_string("books/partials/toc.html", {**context, "toc": TableOfContents.for_book(book)}),
+            variant="author" if is_author else "member",
+        )
+        return HttpResponse(html)
+
+
+class ActivityFeedView(LoginRequiredMixin, View):
+    paginate_by = 50
+
+    def get(self, request, pk):
+        book = get_object_or_404(get_books(request.user), pk=pk)
+        if len(activity_buffer):
+            # show what this process has not written yet
+            activity_buffer.flush()
+        paginator = KeysetPaginator(book.activities.select_related("actor"), "-created_at", per_page=self.paginate_by)
+        try:
+            page = paginator.page(request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404("Invalid cursor.")
+        return render(request, "books/activity.html", {"book": book, "activities": page.object_list, "page": page})
+
+
+class BookExportView(LoginRequiredMixin, View):
+    def get(self, request, pk, fmt):
+        if fmt not in EXPORTERS:
+            raise Http404("Unknown export format.")
+        book = get_object_or_404(get_books(request.user), pk=pk)
+        exporter, content_type, _ = EXPORTERS[fmt]
+        response = StreamingHttpResponse(exporter(book), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="{export_filename(book, fmt)}"'
+        return response
 
 
 class BookUpdateView(LoginRequiredMixin, View):
@@ -52,10 +186,19 @@ class BookDeleteView(LoginRequiredMixin, View):
 
     def post(self, request, pk):
         book = get_object_or_404(request.user.books, pk=pk)
-        book.delete()
+        trash_book(book)
+        record(book, request.user, Activity.BOOK_DELETED)
         return redirect("books:home")
     
 
+class BookCloneView(LoginRequiredMixin, View):
+    def post(self, request, pk):
+        book = get_object_or_404(request.user.books, pk=pk)
+        clone = clone_book(book, request.user)
+        record(clone, request.user, Activity.BOOK_CLONED, subject=book.name)
+        return redirect("books:detail", pk=clone.pk)
+
+
 class SectionCreateView(LoginRequiredMixin, View):
     def post(self, request, pk):
         book = get_object_or_404(request.user.books, pk=pk)
@@ -64,7 +207,14 @@ class SectionCreateView(LoginRequiredMixin, View):
             section = form.save(commit=False)
             section.book = book
             section.author = request.user
-            section.save()
+            try:
+                section.save()
+            except TreeError as exc:
+                # the parent moved or went to the trash since the form was rendered
+                form.add_error("parent", str(exc))
+                return render(request, "books/add_section.html", {"form": form})
+            record_revision(section, author=request.user)
+            record(book, request.user, Activity.SECTION_CREATED, section=section)
             return redirect("books:detail", pk=book.pk)
         return render(request, "books/add_section.html", {"form": form})
     
@@ -74,20 +224,58 @@ class SectionCreateView(LoginRequiredMixin, View):
         return render(request, "books/add_section.html", {"form": form})
 
 
-class SectionDetailView(LoginRequiredMixin, View):
+class SectionDetailView(LoginRequiredMixin, ConditionalGetMixin, View):
+    def get_validators(self, request, pk, section_pk):
+        last_modified = book_last_modified(request.user, pk)
+        if last_modified is None:
+            return None
+        return make_etag(request, "section", pk, section_pk, last_modified.isoformat()), last_modified
+
     def get(self, request, pk, section_pk):
         book = get_object_or_404((get_books(self.request.user)), pk=pk)
-        section = get_object_or_404(book.sections, pk=section_pk)
-        return render(request, "books/section.html", {"book": book, "section": section})
+        context = {"book": book, "section_id": section_pk, "is_author": book.author_id == request.user.id}
+
+        def render_section():
+            section = get_object_or_404(book.sections.select_related("author"), pk=section_pk)
+            toc = TableOfContents.for_book(book)
+            context.update({
+                "section": section,
+                "toc": toc,
+                "breadcrumbs": toc.breadcrumbs(section.pk),
+                "subsections": toc.children(section.pk),
+                "previous_section": toc.previous(section.pk),
+                "next_section": toc.next(section.pk),
+            })
+            return render_to_string("books/partials/section_body.html", context)
+
+        section_html = BookFragments(book.pk).get("section", render_section, variant=str(section_pk))
+        return render(request, "books/section.html", {**context, "section_html": mark_safe(section_html)})
 
 
 class SectionUpdateView(LoginRequiredMixin, View):
     def post(self, request, pk, section_pk):
         book = get_object_or_404((get_books(self.request.user)), pk=pk)
         section = get_object_or_404(book.sections, pk=section_pk)
+        previous_content = section.content
         form = SectionForm(book, request.POST, instance=section)
         if form.is_valid():
-            form.save()
+            version = form.cleaned_data["version"]
+            try:
+                save_section(section, version if version is not None else section.version)
+            except VersionConflict as conflict:
+                form.add_error(
+                    None,
+                    f"Someone else saved this section while you were editing it (it is now at version "
+                    f"{conflict.current_version}). Copy your changes, reload the page and apply them again.",
+                )
+                return render(
+                    request, "books/update_section.html", {"form": form, "book": book, "section": section}, status=409
+                )
+            except TreeError as exc:
+                form.add_error("parent", str(exc))
+                return render(request, "books/update_section.html", {"form": form, "book": book, "section": section})
+            record_revision(section, author=request.user, previous_content=previous_content)
+            record(book, request.user, Activity.SECTION_UPDATED, section=section)
             return redirect("books:section-detail", pk=book.pk, section_pk=section.pk)
         return render(request, "books/update_section.html", {"form": form, "book": book, "section": section})
     
@@ -98,21 +286,166 @@ class SectionUpdateView(LoginRequiredMixin, View):
         return render(request, "books/update_section.html", {"form": form, "book": book, "section": section})
 
 
+class SectionMoveView(LoginRequiredMixin, View):
+    """Move a section with its subsections under another section or book of the author."""
+
+    def get(self, request, pk, section_pk):
+        book = get_object_or_404(request.user.books, pk=pk)
+        section = get_object_or_404(book.sections, pk=section_pk)
+        form = SectionMoveForm(section, request.user)
+        return render(request, "books/move_section.html", {"book": book, "section": section, "form": form})
+
+    def post(self, request, pk, section_pk):
+        book = get_object_or_404(request.user.books, pk=pk)
+        section = get_object_or_404(book.sections, pk=section_pk)
+        form = SectionMoveForm(section, request.user, request.POST)
+        if form.is_valid():
+            target = form.cleaned_data["book"]
+            parent = form.cleaned_data["parent"]
+            try:
+                move_subtree(section, target, parent.pk if parent else None)
+            except TreeError as exc:
+                form.add_error("parent", str(exc))
+            else:
+                record(target, request.user, Activity.SECTION_MOVED, section=section)
+                return redirect("books:section-detail", pk=target.pk, section_pk=section.pk)
+        return render(request, "books/move_section.html", {"book": book, "section": section, "form": form})
+
+
+class SectionPatchView(LoginRequiredMixin, View):
+    """
+    Apply a text delta (see ``books.diff``) made against a known version:
+    ``{"version": 7, "delta": [120, -5, "new words", 300], "title": "optional"}``.
+    """
+
+    def post(self, request, pk, section_pk):
+        book = get_object_or_404(get_books(request.user), pk=pk)
+        section = get_object_or_404(book.sections, pk=section_pk)
+        try:
+            data = json.loads(request.body)
+            version = data["version"]
+            delta = data.get("delta", [])
+            title = data.get("title", section.title)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return JsonResponse({"error": "Expected a JSON object with version and delta."}, status=400)
+        if not isinstance(title, str) or not title or len(title) > Section._meta.get_field("title").max_length:
+            return JsonResponse({"error": "Invalid title."}, status=400)
+        if version != section.version:
+            return JsonResponse({"error": "Version conflict.", "version": section.version}, status=409)
+        try:
+            content = apply_delta(section.content or "", delta)
+        except DeltaError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+
+        previous_content = section.content
+        section.content, section.title = content, title
+        try:
+            save_section(section, version, fields=("title", "content"))
+        except VersionConflict as conflict:
+            return JsonResponse({"error": "Version conflict.", "version": conflict.current_version}, status=409)
+        record_revision(section, author=request.user, previous_content=previous_content)
+        record(book, request.user, Activity.SECTION_UPDATED, section=section)
+        return JsonResponse({"version": section.version, "length": len(content)})
+
+
+class SectionRevisionListView(LoginRequiredMixin, View):
+    def get(self, request, pk, section_pk):
+        book = get_object_or_404(get_books(request.user), pk=pk)
+        section = get_object_or_404(book.sections.only("id", "title", "book_id"), pk=section_pk)
+        revisions = (
+            section.revisions.select_related("author")
+            .defer("snapshot", "delta")
+            .order_by("-number")
+        )
+        return render(request, "books/revisions.html", {"book": book, "section": section, "revisions": revisions})
+
+
+class SectionRevisionDetailView(LoginRequiredMixin, View):
+    def get(self, request, pk, section_pk, number):
+        book = get_object_or_404(get_books(request.user), pk=pk)
+        section = get_object_or_404(book.sections.only("id", "title", "book_id"), pk=section_pk)
+        revision = get_object_or_404(section.revisions.select_related("author"), number=number)
+        return render(
+            request,
+            "books/revision.html",
+            {"book": book, "section": section, "revision": revision, "content": rebuild(revision)},
+        )
+
+
+class SectionRevisionRestoreView(LoginRequiredMixin, View):
+    def post(self, request, pk, section_pk, number):
+        book = get_object_or_404(get_books(request.user), pk=pk)
+        section = get_object_or_404(book.sections, pk=section_pk)
+        revision = get_object_or_404(section.revisions, number=number)
+        previous_content = section.content
+        section.content = rebuild(revision)
+        try:
+            save_section(section, section.version, fields=("content",))
+        except VersionConflict:
+            return render(
+                request,
+                "books/revision.html",
+                {
+                    "book": book, "section": section, "revision": revision, "content": section.content,
+                    "error": "Someone else saved this section just now. Check its latest text and restore again.",
+                },
+                status=409,
+            )
+        record_revision(section, author=request.user, previous_content=previous_content)
+        record(book, request.user, Activity.SECTION_UPDATED, section=section)
+        return redirect("books:section-detail", pk=book.pk, section_pk=section.pk)
+
+
 class SectionDeleteView(LoginRequiredMixin, View):
 
     def post(self, request, pk, section_pk):
         book = get_object_or_404(request.user.books, pk=pk)
         section = get_object_or_404(book.sections, pk=section_pk)
-        section.delete()
+        trash_section(section)
+        record(book, request.user, Activity.SECTION_DELETED, section=section)
         return redirect("books:detail", pk=book.pk)
 
 
+def render_trash(request, error=None):
+    return render(request, "books/trash.html", {
+        "books": trashed_books(request.user),
+        "sections": trashed_sections(request.user),
+        "retention_days": retention().days,
+        "error": error,
+    })
+
+
+class TrashView(LoginRequiredMixin, View):
+    def get(self, request):
+        return render_trash(request)
+
+
+class BookRestoreView(LoginRequiredMixin, View):
+    def post(self, request, pk):
+        book = get_object_or_404(trashed_books(request.user), pk=pk)
+        restore_book(book)
+        record(book, request.user, Activity.BOOK_RESTORED)
+        return redirect("books:detail", pk=book.pk)
+
+
+class SectionRestoreView(LoginRequiredMixin, View):
+    def post(self, request, section_pk):
+        section = get_object_or_404(trashed_sections(request.user), pk=section_pk)
+        try:
+            restore_section(section)
+        except TreeError as exc:
+            return render_trash(request, error=str(exc))
+        record(section.book, request.user, Activity.SECTION_RESTORED, section=section)
+        return redirect("books:section-detail", pk=section.book_id, section_pk=section.pk)
+
+
 class CollaboratorDeleteView(LoginRequiredMixin, View):
 
     def post(self, request, pk, collaborator_pk):
         book = get_object_or_404(request.user.books, pk=pk)
         collaborator = get_object_or_404(book.collaborators, pk=collaborator_pk)
         collaborator.delete()
+        record(book, request.user, Activity.COLLABORATOR_REMOVED, user=collaborator)
         return redirect("books:detail", pk=book.pk)
 
 
@@ -126,6 +459,38 @@ class CollaboratorCreateView(LoginRequiredMixin, View):
         book = get_object_or_404(request.user.books, pk=pk)
         form = CollaboratorForm(book, request, request.POST)
         if form.is_valid():
-            form.save()
+            collaborator = form.save()
+            record(book, request.user, Activity.COLLABORATOR_ADDED, user=collaborator)
             return redirect("books:detail", pk=book.pk)
         return render(request, "books/add_collaborator.html", {"book": book, "form": form})
+
+
+class CollaboratorInviteView(LoginRequiredMixin, View):
+    def get(self, request, pk):
+        book = get_object_or_404(request.user.books, pk=pk)
+        form = CollaboratorInviteForm(book, request)
+        return render(request, "books/invite_collaborators.html", {"book": book, "form": form})
+
+    def post(self, request, pk):
+        book = get_object_or_404(request.user.books, pk=pk)
+        form = CollaboratorInviteForm(book, request, request.POST, request.FILES)
+        result = form.save() if form.is_valid() else None
+        if result is not None:
+            for collaborator in result.added:
+                record(book, request.user, Activity.COLLABORATOR_ADDED, user=collaborator)
+            form = CollaboratorInviteForm(book, request)
+        return render(request, "books/invite_collaborators.html", {"book": book, "form": form, "result": result})
+
+
+class SearchView(LoginRequiredMixin, View):
+    def get(self, request):
+        query = request.GET.get("q", "").strip()
+        book = None
+        if request.GET.get("book"):
+            try:
+                book_id = int(request.GET["book"])
+            except ValueError:
+                raise Http404("No such book.")
+            book = get_object_or_404(get_books(request.user), pk=book_id)
+        results = search_sections(request.user, query, book_id=book.pk if book else None) if query else []
+        return render(request, "books/search.html", {"query": query, "book": book, "results": results})
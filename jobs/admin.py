@@ -0,0 +1,8 @@
+from django.contrib import admin
+from jobs.models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ["name", "status", "attempts", "run_at", "created_at", "updated_at"]
+    list_filter = ["status", "name"]
@@ -0,0 +1,23 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from jobs.queue import Worker, registered_names
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs on a fixed-size worker pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, help="Number of worker threads (default: JOBS_CONCURRENCY).")
+        parser.add_argument("--poll-interval", type=float, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument("--once", action="store_true", help="Exit once no due jobs are left.")
+
+    def handle(self, *args, **options):
+        worker = Worker(concurrency=options["concurrency"], poll_interval=options["poll_interval"])
+        # finish the batches in flight, then exit
+        signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+        signal.signal(signal.SIGINT, lambda *_: worker.stop())
+        self.stdout.write(f"Running jobs: {', '.join(registered_names()) or 'no handlers registered'}")
+        processed = worker.run(once=options["once"])
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} jobs."))
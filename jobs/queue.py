@@ -0,0 +1,222 @@
+"""
+A small database-backed job queue.
+
+Handlers are registered by name from an app's ``tasks.py``::
+
+    @register("accounts.send_email", batch_size=50)
+    def deliver(payloads):
+        ...
+
+A handler with ``batch_size == 1`` is called with a single payload and fails
+by raising.  A batch handler is called with a list of payloads and returns a
+list of the same length holding ``None`` for every payload it handled or the
+exception for those that failed, so one bad item does not retry the batch.
+
+``enqueue()`` stores a job in the caller's transaction and ``Worker`` (run by
+``manage.py run_jobs``) claims due jobs with a conditional UPDATE, runs them
+on a fixed-size thread pool and reschedules failures with exponential
+backoff until ``max_attempts`` is reached.  A job whose worker died counts
+the attempt too.
+"""
+import logging
+import random
+import threading
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+class Handler:
+    def __init__(self, func, batch_size):
+        self.func = func
+        self.batch_size = batch_size
+
+    def __call__(self, payloads):
+        if self.batch_size == 1:
+            try:
+                self.func(payloads[0])
+            except Exception as exc:
+                return [exc]
+            return [None]
+        try:
+            results = list(self.func(payloads))
+        except Exception as exc:
+            return [exc] * len(payloads)
+        if len(results) != len(payloads):
+            error = RuntimeError(f"Handler returned {len(results)} results for {len(payloads)} jobs.")
+            return [error] * len(payloads)
+        return results
+
+
+def register(name, batch_size=1):
+    def decorator(func):
+        _handlers[name] = Handler(func, batch_size)
+        return func
+    return decorator
+
+
+def get_handler(name):
+    return _handlers.get(name)
+
+
+def registered_names():
+    return sorted(_handlers)
+
+
+def enqueue(name, payload=None, run_at=None, max_attempts=None):
+    if name not in _handlers:
+        raise KeyError(f"No job handler registered for {name!r}.")
+    job = Job(name=name, payload=payload or {}, run_at=run_at or timezone.now())
+    if max_attempts is not None:
+        job.max_attempts = max_attempts
+    job.save()
+    return job
+
+
+def backoff(attempts):
+    """Seconds to wait before retry number ``attempts``, with a little jitter."""
+    base = getattr(settings, "JOBS_RETRY_BACKOFF", 30)
+    ceiling = getattr(settings, "JOBS_RETRY_BACKOFF_MAX", 3600)
+    delay = min(base * 2 ** max(attempts - 1, 0), ceiling)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim(name, limit):
+    """Atomically take up to ``limit`` due jobs of one kind; safe across workers."""
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    due = list(
+        Job.objects.filter(status=Job.QUEUED, name=name, run_at__lte=now)
+        .order_by("run_at", "pk")
+        .values_list("pk", flat=True)[:limit]
+    )
+    if not due:
+        return []
+    # only rows still queued are taken, so two workers never get the same job
+    Job.objects.filter(pk__in=due, status=Job.QUEUED).update(
+        status=Job.RUNNING, locked_by=token, locked_at=now, attempts=F("attempts") + 1
+    )
+    return list(Job.objects.filter(locked_by=token, status=Job.RUNNING).order_by("run_at", "pk"))
+
+
+def requeue_stale():
+    """
+    Put back jobs whose worker died while running them; those that used up
+    their attempts fail instead, so a job that kills its worker every time
+    is not retried forever.  Returns the number requeued.
+    """
+    timeout = getattr(settings, "JOBS_LOCK_TIMEOUT", 600)
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=timeout))
+    failed = stale.filter(attempts__gte=F("max_attempts")).update(
+        status=Job.FAILED, locked_by="", locked_at=None, updated_at=now,
+        last_error="The worker stopped while running this job.",
+    )
+    if failed:
+        logger.error("%s jobs failed permanently: their workers stopped while running them", failed)
+    return stale.update(status=Job.QUEUED, locked_by="", locked_at=None, updated_at=now)
+
+
+def run_batch(jobs):
+    """Run claimed jobs of the same name and record each outcome."""
+    handler = get_handler(jobs[0].name)
+    if handler is None:
+        results = [KeyError(f"No job handler registered for {jobs[0].name!r}.")] * len(jobs)
+    else:
+        results = handler([job.payload for job in jobs])
+
+    now = timezone.now()
+    done = [job.pk for job, error in zip(jobs, results) if error is None]
+    if done:
+        Job.objects.filter(pk__in=done).update(status=Job.DONE, locked_by="", locked_at=None, last_error="", updated_at=now)
+    for job, error in zip(jobs, results):
+        if error is None:
+            continue
+        message = "".join(traceback.format_exception(error)) if isinstance(error, BaseException) else str(error)
+        if job.attempts >= job.max_attempts:
+            logger.error("Job %s failed permanently after %s attempts", job, job.attempts)
+            changes = {"status": Job.FAILED}
+        else:
+            changes = {"status": Job.QUEUED, "run_at": now + timedelta(seconds=backoff(job.attempts))}
+        Job.objects.filter(pk=job.pk).update(locked_by="", locked_at=None, last_error=message, updated_at=now, **changes)
+    return len(done)
+
+
+class Worker:
+    """
+    Runs queued jobs on a fixed pool of ``concurrency`` threads.  With a
+    concurrency of one the batches run in the calling thread.
+    """
+
+    def __init__(self, concurrency=None, poll_interval=None):
+        self.concurrency = concurrency or getattr(settings, "JOBS_CONCURRENCY", 4)
+        self.poll_interval = poll_interval if poll_interval is not None else getattr(settings, "JOBS_POLL_INTERVAL", 1.0)
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _claim_next(self):
+        for name in registered_names():
+            jobs = claim(name, _handlers[name].batch_size)
+            if jobs:
+                return jobs
+        return []
+
+    def _run_in_thread(self, jobs):
+        try:
+            return run_batch(jobs)
+        finally:
+            close_old_connections()
+
+    def run(self, once=False):
+        """Process jobs until stopped, or until the queue is drained when ``once``."""
+        processed = 0
+        requeue_stale()
+        if self.concurrency == 1:
+            while not self._stopping.is_set():
+                jobs = self._claim_next()
+                if jobs:
+                    run_batch(jobs)
+                    processed += len(jobs)
+                elif once:
+                    break
+                else:
+                    self._stopping.wait(self.poll_interval)
+                    requeue_stale()
+            return processed
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="jobs") as pool:
+            running = {}
+            while not self._stopping.is_set():
+                while len(running) < self.concurrency:
+                    jobs = self._claim_next()
+                    if not jobs:
+                        break
+                    running[pool.submit(self._run_in_thread, jobs)] = len(jobs)
+                if not running:
+                    if once:
+                        break
+                    self._stopping.wait(self.poll_interval)
+                    requeue_stale()
+                    continue
+                finished, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    processed += running.pop(future)
+                    if future.exception():
+                        logger.error("Job batch crashed", exc_info=future.exception())
+            wait(running)
+            processed += sum(running.values())
+        return processed
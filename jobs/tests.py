@@ -0,0 +1,122 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core import mail
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from accounts.emails import SEND_EMAIL_JOB, queue_email
+from jobs.models import Job
+from jobs.queue import Worker, claim, enqueue, register, requeue_stale
+
+calls = []
+
+
+@register("tests.record")
+def record(payload):
+    if payload.get("fail"):
+        raise ValueError("boom")
+    calls.append(payload["value"])
+
+
+class TestQueue(TestCase):
+    def setUp(self) -> None:
+        calls.clear()
+
+    def test_enqueue_unknown_name(self):
+        with self.assertRaises(KeyError):
+            enqueue("tests.missing")
+
+    def test_claim_is_exclusive(self):
+        job = enqueue("tests.record", {"value": 1})
+        self.assertEqual(claim("tests.record", 10), [job])
+        self.assertEqual(claim("tests.record", 10), [])
+
+    def test_claim_skips_future_jobs(self):
+        enqueue("tests.record", {"value": 1}, run_at=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(claim("tests.record", 10), [])
+
+    def test_run(self):
+        job = enqueue("tests.record", {"value": 1})
+        Worker(concurrency=1).run(once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(calls, [1])
+
+    def test_retry_with_backoff(self):
+        job = enqueue("tests.record", {"fail": True}, max_attempts=2)
+        Worker(concurrency=1).run(once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn("ValueError: boom", job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs("jobs.queue", "ERROR"):
+            Worker(concurrency=1).run(once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    @override_settings(JOBS_LOCK_TIMEOUT=60)
+    def test_requeue_stale(self):
+        job = enqueue("tests.record", {"value": 1})
+        claim("tests.record", 1)
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+
+    @override_settings(JOBS_LOCK_TIMEOUT=60)
+    def test_stale_job_out_of_attempts_fails(self):
+        job = enqueue("tests.record", {"value": 1}, max_attempts=2)
+        claim("tests.record", 1)
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(requeue_stale(), 1)
+        claim("tests.record", 1)
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(minutes=5))
+        with self.assertLogs("jobs.queue", "ERROR"):
+            self.assertEqual(requeue_stale(), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn("worker stopped", job.last_error)
+
+
+class TestEmailJobs(TestCase):
+    def test_batch_uses_one_connection(self):
+        for i in range(3):
+            queue_email(f"message {i}", [f"user{i}@example.com"])
+        self.assertEqual(len(mail.outbox), 0)
+        with mock.patch("accounts.emails.get_connection", wraps=mail.get_connection) as get_connection:
+            Worker(concurrency=1).run(once=True)
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual([email.body for email in mail.outbox], ["message 0", "message 1", "message 2"])
+        self.assertEqual(Job.objects.filter(name=SEND_EMAIL_JOB, status=Job.DONE).count(), 3)
+
+    def test_failed_message_only_retries_itself(self):
+        queue_email("ok", ["ok@example.com"])
+        queue_email("bad", ["bad@example.com"])
+        original_send = mail.EmailMessage.send
+
+        def send(message, *args, **kwargs):
+            if message.body == "bad":
+                raise ConnectionError("refused")
+            return original_send(message, *args, **kwargs)
+
+        with mock.patch("django.core.mail.EmailMessage.send", send):
+            Worker(concurrency=1).run(once=True)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(Job.objects.get(payload__message="bad").status, Job.QUEUED)
+        self.assertEqual(Job.objects.get(payload__message="ok").status, Job.DONE)
+
+
+class TestThreadedWorker(TransactionTestCase):
+    def test_pool(self):
+        calls.clear()
+        for value in range(6):
+            enqueue("tests.record", {"value": value})
+        processed = Worker(concurrency=3, poll_interval=0.01).run(once=True)
+        self.assertEqual(processed, 6)
+        self.assertEqual(sorted(calls), list(range(6)))
+        self.assertFalse(Job.objects.exclude(status=Job.DONE).exists())